@@ -94,23 +94,27 @@ class AttackMaximalValueBotAgent(BotAgent):
         :return: action_id
         """
         import gym_idsgame.envs.util.idsgame_util as util
-        actions = list(range(self.game_config.num_attack_actions))
-        legal_actions = list(filter(lambda action: util.is_attack_id_legal(action, self.game_config,
-                                                                                   game_state.attacker_pos,
-                                                                                   game_state), actions))
+        network_config = self.game_config.network_config
+        # The attack values of the game state are stored as (num_nodes, num_attack_types) arrays, so the maximal
+        # attack of every node is found with a single vectorized argmax over the rows
+        max_idxs = np.argmax(game_state.attack_values, axis=1)
         attacker_row, attacker_col = game_state.attacker_pos
         max_node_value = float("-inf")
         max_action_id = -1
-        for id, node in enumerate(self.game_config.network_config.node_list):
-            if node == NodeType.SERVER.value or node == NodeType.DATA.value:
-                max_idx = np.argmax(game_state.attack_values[id])
+        for id, node in enumerate(network_config.node_list):
+            if node in util.RESOURCE_NODE_TYPES:
+                max_idx = max_idxs[id]
                 action_id = util.get_attack_action_id(id, max_idx, self.game_config)
-                node_row, node_col = self.game_config.network_config.get_node_pos(id)
-                if game_state.attack_values[id][max_idx] > max_node_value and action_id in legal_actions and \
-                        node_row < attacker_row:
+                # Read from the cached id -> position table of the network config
+                node_row = network_config.get_node_pos(id)[0]
+                # Legality is only checked for candidates that would improve on the current maximum
+                if game_state.attack_values[id][max_idx] > max_node_value and node_row < attacker_row and \
+                        util.is_attack_id_legal(action_id, self.game_config, game_state.attacker_pos, game_state):
                     max_node_value = game_state.attack_values[id][max_idx]
                     max_action_id = action_id
         if max_action_id == -1:
+            actions = list(range(self.game_config.num_attack_actions))
+            legal_actions = np.flatnonzero(util.attack_legal_mask(self.game_config, game_state.attacker_pos, game_state))
             if len(legal_actions) > 0:
                 max_action_id = np.random.choice(legal_actions)
             else:
@@ -6,7 +6,6 @@ import numpy as np
 from gym_idsgame.agents.bot_agents.bot_agent import BotAgent
 from gym_idsgame.envs.dao.game_state import GameState
 from gym_idsgame.envs.dao.game_config import GameConfig
-from gym_idsgame.envs.dao.node_type import NodeType
 
 class DefendMinimalValueBotAgent(BotAgent):
     """
@@ -29,36 +28,39 @@ class DefendMinimalValueBotAgent(BotAgent):
         :return: action_id
         """
         from gym_idsgame.envs.util import idsgame_util
-        actions = list(range(self.game_config.num_defense_actions))
-        legal_actions = list(filter(lambda action: idsgame_util.is_defense_id_legal(action, self.game_config,
-                                                                                    game_state), actions))
+        # The defense values of the game state are stored as (num_nodes, num_attack_types) arrays, so the minimal
+        # defense of every node is found with a single vectorized argmin over the rows
+        min_idxs = np.argmin(game_state.defense_values, axis=1)
         min_node_value = float("inf")
         min_action_id = -1
         min_action_ids = []
+        # A defense of a server or data node is always legal, so there is no need to enumerate the legal actions
+        # unless the policy has to fall back on a random action
         for id, node in enumerate(self.game_config.network_config.node_list):
-            if node == NodeType.SERVER.value or node == NodeType.DATA.value:
-                min_idx = np.argmin(game_state.defense_values[id])
+            if node in idsgame_util.RESOURCE_NODE_TYPES:
+                min_idx = min_idxs[id]
                 if game_state.defense_det[id] < game_state.defense_values[id][min_idx]:
                     action_id = idsgame_util.get_defense_action_id(id, self.game_config.num_attack_types,
                                                                    self.game_config)
-                    if game_state.defense_det[id] < min_node_value and action_id in legal_actions:
+                    if game_state.defense_det[id] < min_node_value:
                         min_node_value = game_state.defense_det[id]
                         min_action_id = action_id
                         min_action_ids = []
-                    elif game_state.defense_det[id] < min_node_value and action_id in legal_actions:
-                        min_action_ids.append(action_id)
 
                 else:
                     action_id = idsgame_util.get_defense_action_id(id, min_idx, self.game_config)
-                    if game_state.defense_values[id][min_idx] < min_node_value and action_id in legal_actions:
+                    if game_state.defense_values[id][min_idx] < min_node_value:
                         min_node_value = game_state.defense_values[id][min_idx]
                         min_action_id = action_id
                         min_action_ids = []
-                    elif game_state.defense_values[id][min_idx] == min_node_value and action_id in legal_actions:
+                    elif game_state.defense_values[id][min_idx] == min_node_value:
                         min_action_ids.append(action_id)
         if min_action_ids != -1 and len(min_action_ids) > 1:
           min_action_id = np.random.choice(min_action_ids)
         elif min_action_id == -1:
+            actions = list(range(self.game_config.num_defense_actions))
+            legal_actions = list(filter(lambda action: idsgame_util.is_defense_id_legal(action, self.game_config,
+                                                                                        game_state), actions))
             if len(legal_actions) == 0:
                 min_action_id = np.random.choice(actions)
             else:
@@ -31,10 +31,8 @@ class RandomAttackBotAgent(BotAgent):
         from gym_idsgame.envs.util import idsgame_util
         actions = list(range(self.game_config.num_attack_actions))
         if not self.game_config.reconnaissance_actions:
-            legal_actions = list(filter(lambda action: idsgame_util.is_attack_id_legal(action,
-                                                                                       self.game_config,
-                                                                                       game_state.attacker_pos,
-                                                                                       game_state), actions))
+            legal_actions = np.flatnonzero(idsgame_util.attack_legal_mask(self.game_config, game_state.attacker_pos,
+                                                                          game_state))
             if len(legal_actions) > 0:
                 action = np.random.choice(legal_actions)
             else:
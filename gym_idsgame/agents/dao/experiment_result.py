@@ -1,14 +1,22 @@
 """
 Experiment results
 """
-from typing import List
+from typing import List, Tuple
 import csv
+import os
+import numpy as np
 
 class ExperimentResult:
     """
     DTO with experiment result from an experiment in the IDSGameEnvironment
     """
 
+    # Metrics that are recorded once per log-tick with record()
+    RECORDED_METRICS = ("avg_episode_steps", "avg_attacker_episode_rewards", "avg_defender_episode_rewards",
+                        "epsilon_values", "hack_probability", "cumulative_hack_probabiltiy",
+                        "attacker_cumulative_reward", "defender_cumulative_reward", "avg_episode_loss_attacker",
+                        "avg_episode_loss_defender", "lr_list")
+
     def __init__(self, avg_attacker_episode_rewards: List[float] = None,
                  avg_defender_episode_rewards: List[float] = None,
                  avg_episode_steps: List[int] = None,
@@ -74,6 +82,59 @@ class ExperimentResult:
             self.lr_list = []
         if cumulative_hack_probability is None:
             self.cumulative_hack_probabiltiy = []
+        self._buffers = None
+        self._i = 0
+
+    def preallocate(self, capacity: int) -> None:
+        """
+        Preallocates numpy buffers for the recorded metrics so that record() writes in-place instead of
+        appending to python lists. The metric attributes become views of the filled part of the buffers.
+        Values that have already been recorded are kept.
+
+        :param capacity: the expected number of records
+        :return: None
+        """
+        n = len(self.avg_episode_steps)
+        capacity = max(capacity, n)
+        self._buffers = {}
+        for metric in ExperimentResult.RECORDED_METRICS:
+            buffer = np.empty(capacity, dtype=np.float64)
+            values = getattr(self, metric)
+            if len(values) != n:
+                raise ValueError("Cannot preallocate metric {} with {} values, expected {}".format(
+                    metric, len(values), n))
+            buffer[:n] = values
+            self._buffers[metric] = buffer
+            setattr(self, metric, buffer[:n])
+        self._i = n
+
+    def record(self, **metrics) -> None:
+        """
+        Records the metrics of a single log-tick. If the result has not been preallocated, the values are
+        appended to the metric lists, otherwise they are written to the preallocated buffers (which are doubled
+        in size if full).
+
+        :param metrics: values of the metrics in RECORDED_METRICS, all of them must be given
+        :return: None
+
+        :raises ValueError when the given metrics are not exactly the metrics in RECORDED_METRICS
+        """
+        if len(metrics) != len(ExperimentResult.RECORDED_METRICS) \
+                or not all(metric in metrics for metric in ExperimentResult.RECORDED_METRICS):
+            raise ValueError("Expected values of the metrics {}, got {}".format(
+                sorted(ExperimentResult.RECORDED_METRICS), sorted(metrics)))
+        if self._buffers is None:
+            for metric, value in metrics.items():
+                getattr(self, metric).append(value)
+            return
+        if self._i == len(self._buffers["avg_episode_steps"]):
+            for metric in ExperimentResult.RECORDED_METRICS:
+                self._buffers[metric] = np.resize(self._buffers[metric], max(2 * self._i, 1))
+        for metric, value in metrics.items():
+            self._buffers[metric][self._i] = value
+        self._i += 1
+        for metric in ExperimentResult.RECORDED_METRICS:
+            setattr(self, metric, self._buffers[metric][:self._i])
 
 
     def to_csv(self, file_path : str) -> None:
@@ -83,6 +144,15 @@ class ExperimentResult:
         :param file_path: path to save the csv file
         :return: None
         """
+        ExperimentResult.write_csv(file_path, *self.csv_columns())
+
+    def csv_columns(self) -> Tuple[List[str], List[np.ndarray]]:
+        """
+        Collects the non-empty metrics of the result as csv columns. The columns are copies, so they can be written
+        (e.g. by a background thread) while new results are recorded.
+
+        :return: the labels and the values of the columns
+        """
         metrics = [self.avg_attacker_episode_rewards, self.avg_defender_episode_rewards,
                    self.avg_episode_steps, self.epsilon_values, self.hack_probability,
                    self.attacker_cumulative_reward, self.defender_cumulative_reward, self.attacker_wins,
@@ -96,11 +166,25 @@ class ExperimentResult:
         filtered_metrics = []
         for i in range(len(metrics)):
             if len(metrics[i]) > 0:
-                filtered_metrics.append(metrics[i])
+                filtered_metrics.append(np.array(metrics[i]))
                 filtered_metric_labels.append(metric_labels[i])
-        rows = zip(*filtered_metrics)
-        with open(file_path, "w") as f:
+        return filtered_metric_labels, filtered_metrics
+
+    @staticmethod
+    def write_csv(file_path : str, labels : List[str], columns : List[np.ndarray]) -> None:
+        """
+        Writes columns of metrics to a csv file. The rows are written to a temporary file that then replaces the
+        file at the given path, so that an interrupted write never leaves a truncated csv file behind.
+
+        :param file_path: path to save the csv file
+        :param labels: the labels of the columns
+        :param columns: the values of the columns
+        :return: None
+        """
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w") as f:
             writer = csv.writer(f)
-            writer.writerow(filtered_metric_labels)
-            for row in rows:
-                writer.writerow(row)
\ No newline at end of file
+            writer.writerow(labels)
+            for row in zip(*columns):
+                writer.writerow(row)
+        os.replace(tmp_path, file_path)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+A pool of opponents for training against past versions of a policy
+"""
+from collections import deque
+import numpy as np
+from gym_idsgame.agents.training_agents.common.opponent_pool_config import OpponentPoolConfig
+
+
+class OpponentPool:
+    """
+    Pool of opponents that are sampled during training. With quality scores, opponents are sampled from a softmax
+    distribution over their quality scores and the quality score of an opponent is lowered when it loses, using the
+    same update rule as in "Dota 2 with Large Scale Deep Reinforcement Learning" by Berner et. al. Otherwise the
+    opponents are sampled uniformly.
+    """
+
+    def __init__(self, config: OpponentPoolConfig):
+        """
+        Constructor, initializes an empty pool
+
+        :param config: the opponent pool configuration
+        """
+        self.config = config
+        # The oldest opponent is evicted when the pool is full, which is O(1) for a deque
+        self.opponents = deque()
+        self.qualities = np.zeros(0, dtype=np.float64)
+        # Softmax distribution over the quality scores, computed on demand and cleared when the scores change
+        self._softmax = None
+
+    def __len__(self) -> int:
+        return len(self.opponents)
+
+    def __getitem__(self, opponent_idx: int):
+        return self.opponents[opponent_idx]
+
+    def append(self, opponent, quality: float = None) -> None:
+        """
+        Appends an opponent to the pool, without evicting opponents if the pool is full
+
+        :param opponent: the opponent
+        :param quality: the quality score of the opponent, defaults to the initial quality
+        :return: None
+        """
+        self.opponents.append(opponent)
+        if self.config.quality_scores:
+            self.qualities = np.append(self.qualities, self.config.initial_quality if quality is None else quality)
+            self._softmax = None
+
+    def add(self, opponent) -> None:
+        """
+        Adds an opponent to the pool. If the pool is full, the oldest opponent is evicted first. The new opponent
+        gets the maximal quality score in the pool, or the initial quality if the pool is empty.
+
+        :param opponent: the opponent
+        :return: None
+        """
+        if len(self.opponents) >= self.config.pool_maxsize:
+            self.popleft()
+        quality = self.qualities.max() if len(self.qualities) > 0 else None
+        self.append(opponent, quality)
+
+    def popleft(self) -> None:
+        """
+        Removes the oldest opponent from the pool
+
+        :return: None
+        """
+        self.opponents.popleft()
+        if self.config.quality_scores:
+            self.qualities = self.qualities[1:]
+            self._softmax = None
+
+    def softmax_distribution(self) -> np.ndarray:
+        """
+        Gets the softmax distribution over the quality scores. The distribution is cached until the quality scores
+        change, it should not be modified.
+
+        :return: the softmax distribution
+        """
+        if self._softmax is None:
+            exp_qualities = np.exp(self.qualities - self.qualities.max())
+            self._softmax = exp_qualities / exp_qualities.sum()
+        return self._softmax
+
+    def sample(self) -> int:
+        """
+        Samples an opponent from the pool using the global numpy RNG
+
+        :return: the index of the sampled opponent
+        """
+        if self.config.quality_scores:
+            # Inverse transform sampling of a single index, draws the same index from the global RNG as
+            # np.random.choice(len(self), p=softmax_dist) without its argument validation
+            cdf = np.cumsum(self.softmax_distribution())
+            cdf /= cdf[-1]
+            return int(np.searchsorted(cdf, np.random.random_sample(), side="right"))
+        return int(np.random.randint(len(self.opponents)))
+
+    def quality_score_delta(self, opponent_idx: int) -> float:
+        """
+        Computes the update of the quality score of an opponent that lost (see update_quality_score)
+
+        :param opponent_idx: the index of the opponent in the pool
+        :return: the (negative) change of the quality score
+        """
+        p = self.softmax_distribution()[opponent_idx]
+        return -(self.config.quality_score_eta / (len(self.opponents) * p))
+
+    def update_quality_score(self, opponent_idx: int) -> None:
+        """
+        Lowers the quality score of an opponent that lost
+
+        :param opponent_idx: the index of the opponent in the pool
+        :return: None
+        """
+        # The delta is computed from the distribution before the update, which is then cleared
+        self.qualities[opponent_idx] += self.quality_score_delta(opponent_idx)
+        self._softmax = None
+
+    def apply_quality_score_deltas(self, deltas: np.ndarray) -> None:
+        """
+        Applies quality score updates that were accumulated over several games
+
+        :param deltas: the accumulated changes of the quality scores, one per opponent in the pool
+        :return: None
+        """
+        updated_idxs = np.flatnonzero(deltas)
+        if len(updated_idxs) > 0:
+            self.qualities[updated_idxs] += deltas[updated_idxs]
+            self._softmax = None
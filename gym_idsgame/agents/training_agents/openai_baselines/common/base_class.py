@@ -1,35 +1,354 @@
 import time
 import os
+import math
 import io
+import json
+import contextlib
 import zipfile
+import struct
+import mmap
+import zlib
 import pickle
+import hashlib
+import operator
 from typing import Union, Type, Optional, Dict, Any, List, Tuple, Callable
 from abc import ABC, abstractmethod
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import gymnasium as gym
 import torch as th
 import numpy as np
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import safetensors.torch
+except ImportError:
+    safetensors = None
 
 from stable_baselines3.common import logger
 from gym_idsgame.agents.training_agents.openai_baselines.common.ppo.ppo_policies import BasePolicy
-from gym_idsgame.agents.training_agents.openai_baselines.common.utils import set_random_seed, get_schedule_fn, update_learning_rate, get_device
+from gym_idsgame.agents.training_agents.openai_baselines.common.utils import set_random_seed, get_schedule_fn, get_device, \
+    json_to_data, data_to_json
 from stable_baselines3.common.preprocessing import is_image_space
-from stable_baselines3.common.save_util import data_to_json, json_to_data, recursive_getattr, recursive_setattr
+from stable_baselines3.common.save_util import recursive_setattr
 from stable_baselines3.common.type_aliases import GymEnv, TensorDict, RolloutReturn, MaybeCallback
 from gym_idsgame.agents.training_agents.openai_baselines.common.callbacks import BaseCallback, CallbackList, ConvertCallback, \
     EvalCallback
 from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.noise import ActionNoise
-from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.noise import ActionNoise, NormalActionNoise
+from gym_idsgame.agents.training_agents.openai_baselines.common.buffers import ReplayBuffer
 from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
 from gym_idsgame.agents.dao.experiment_result import ExperimentResult
 from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.single_env_vec_view import SingleEnvVecView
 from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.base_vec_env import VecEnv
 from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env import unwrap_vec_normalize
 from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.vec_normalize import VecNormalize
 from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.vec_transpose import VecTransposeImage
 
+# Supported dtypes of the Linear/Conv weights in saved checkpoints
+CHECKPOINT_DTYPES = ("fp32", "bf16", "int8")
+# Suffix of the entries holding the per-channel scales of int8 quantized weights in saved state dicts
+_INT8_SCALE_SUFFIX = "._int8_scale"
+
+# Minimum total size of the state dicts in a zip-archive for deserializing them in parallel threads,
+# below it the thread start-up costs more than it saves
+PARALLEL_LOAD_MIN_BYTES = 1 << 20
+
+# Number of most recent episodes whose reward/length statistics are kept for logging
+EP_INFO_BUFFER_SIZE = 100
+
+# Number of transitions the off-policy rollouts collect before inserting them into the replay buffer at once
+REPLAY_INSERT_BATCH_SIZE = 64
+
+# Buffer size of the files zip-archived models are written to
+ZIP_WRITE_BUFFER_SIZE = 64 * 1024 * 1024
+
+# Number of gaussian action noise samples drawn at once by ``_NormalNoiseBuffer``
+NOISE_BATCH_SIZE = 1024
+
+# Attributes that are never serialized into the "data" entry of a saved model
+EXCLUDED_SAVE_PARAMS = frozenset(["policy", "device", "env", "eval_env", "replay_buffer", "rollout_buffer",
+                                  "_vec_normalize_env", "_obs_buffers", "_lr_linear_a", "_lr_linear_d",
+                                  "_idsgame_state", "_eval_seed_applied", "_joint_actions_buf", "_clip_range_linear",
+                                  "_clip_range_vf_linear", "_attacker_opponent_scratch",
+                                  "_defender_opponent_scratch", "_attacker_updated", "_defender_updated",
+                                  "_results_writer"])
+
+# Tensorboard tags per mode, built once instead of being concatenated on every log call
+_TB_TAGS = {
+    mode: {
+        "avg_episode_rewards_attacker": "avg_episode_rewards/" + mode + "/attacker",
+        "avg_episode_rewards_defender": "avg_episode_rewards/" + mode + "/defender",
+        "episode_steps": "episode_steps/" + mode,
+        "episode_avg_loss_attacker": "episode_avg_loss/" + mode + "/attacker",
+        "episode_avg_loss_defender": "episode_avg_loss/" + mode + "/defender",
+        "hack_probability": "hack_probability/" + mode,
+        "cumulative_hack_probability": "cumulative_hack_probability/" + mode,
+        "cumulative_reward_attacker": "cumulative_reward/attacker/" + mode,
+        "cumulative_reward_defender": "cumulative_reward/defender/" + mode
+    }
+    for mode in ("train", "eval")
+}
+
+
+def _space_fingerprint(space: gym.spaces.Space) -> Optional[int]:
+    """
+    Computes a fingerprint of a Box or Discrete space (shape, dtype and bounds) so that spaces can be compared
+    in O(1) instead of element-wise. The fingerprint is cached on the space instance.
+
+    :param space: the space to fingerprint
+    :return: the fingerprint, or None if the type of space is not supported
+    """
+    fingerprint = getattr(space, "_fingerprint", None)
+    if fingerprint is not None:
+        return fingerprint
+    if isinstance(space, gym.spaces.Discrete):
+        content = [b"Discrete", str(int(space.n)).encode(), str(int(getattr(space, "start", 0))).encode()]
+    elif isinstance(space, gym.spaces.Box):
+        content = [b"Box", str(space.shape).encode(), space.dtype.str.encode(), space.low.tobytes(),
+                   space.high.tobytes()]
+    else:
+        return None
+    if xxhash is not None:
+        hasher = xxhash.xxh3_64()
+    else:
+        hasher = hashlib.blake2b(digest_size=8)
+    for c in content:
+        hasher.update(c)
+    fingerprint = int.from_bytes(hasher.digest(), "little")
+    space._fingerprint = fingerprint
+    return fingerprint
+
+
+def _spaces_equal(space_1: gym.spaces.Space, space_2: gym.spaces.Space) -> bool:
+    """
+    Compares two spaces using their fingerprints, falling back to ``==`` for unsupported types of spaces
+
+    :param space_1: the first space
+    :param space_2: the second space
+    :return: True if the spaces are equal
+    """
+    if space_1 is space_2:
+        return True
+    fingerprint_1 = _space_fingerprint(space_1)
+    fingerprint_2 = _space_fingerprint(space_2)
+    if fingerprint_1 is None or fingerprint_2 is None:
+        return space_1 == space_2
+    return fingerprint_1 == fingerprint_2
+
+
+
+def _quantize_state_dict(state_dict: Dict[str, Any], checkpoint_dtype: str) -> Dict[str, Any]:
+    """
+    Converts the Linear/Conv weights (floating point ".weight" entries with at least two dimensions) of a state
+    dict to the given checkpoint dtype. Biases, normalization parameters and other entries are kept as they are.
+    int8 weights are quantized symmetrically per output channel, the scales are stored as extra entries.
+
+    :param state_dict: the state dict to convert
+    :param checkpoint_dtype: one of CHECKPOINT_DTYPES
+    :return: the converted state dict
+    """
+    if checkpoint_dtype not in CHECKPOINT_DTYPES:
+        raise ValueError("Unsupported checkpoint dtype: {}, expected one of {}".format(checkpoint_dtype,
+                                                                                     CHECKPOINT_DTYPES))
+    if checkpoint_dtype == "fp32":
+        return state_dict
+    converted = state_dict.__class__()
+    for key, value in state_dict.items():
+        if not (key.endswith(".weight") and isinstance(value, th.Tensor) and value.is_floating_point()
+                and value.dim() >= 2):
+            converted[key] = value
+        elif checkpoint_dtype == "bf16":
+            converted[key] = value.detach().to(th.bfloat16)
+        else:
+            weight = value.detach().float()
+            scale = weight.abs().flatten(1).amax(dim=1).clamp(min=1e-12) / 127.0
+            scale_shape = (-1,) + (1,) * (weight.dim() - 1)
+            converted[key] = th.round(weight / scale.view(scale_shape)).clamp(-127, 127).to(th.int8)
+            converted[key + _INT8_SCALE_SUFFIX] = scale
+    return converted
+
+
+def _dequantize_state_dict(state_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Restores float32 weights of a state dict written with _quantize_state_dict. State dicts without quantized
+    entries (e.g. fp32 checkpoints and optimizer state dicts) are returned as they are.
+
+    :param state_dict: the loaded state dict
+    :return: the state dict with float32 weights
+    """
+    if not any(isinstance(value, th.Tensor) and value.dtype in (th.bfloat16, th.int8)
+               for value in state_dict.values()):
+        return state_dict
+    restored = state_dict.__class__()
+    for key, value in state_dict.items():
+        if key.endswith(_INT8_SCALE_SUFFIX):
+            continue
+        if isinstance(value, th.Tensor) and value.dtype == th.int8 and key + _INT8_SCALE_SUFFIX in state_dict:
+            scale = state_dict[key + _INT8_SCALE_SUFFIX]
+            restored[key] = value.float() * scale.view((-1,) + (1,) * (value.dim() - 1))
+        elif isinstance(value, th.Tensor) and value.dtype == th.bfloat16:
+            restored[key] = value.float()
+        else:
+            restored[key] = value
+    return restored
+
+
+def _to_device(obj: Any, device: th.device) -> Any:
+    """
+    Moves all tensors of a (nested) dict/list/tuple to a device
+
+    :param obj: the object holding the tensors
+    :param device: the device to move the tensors to
+    :return: the object with the moved tensors
+    """
+    if isinstance(obj, th.Tensor):
+        return obj.to(device)
+    if isinstance(obj, dict):
+        moved = obj.__class__()
+        for key, value in obj.items():
+            moved[key] = _to_device(value, device)
+        return moved
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(_to_device(value, device) for value in obj)
+    return obj
+
+
+@lru_cache(maxsize=None)
+def _attr_getter(name: str) -> Callable[[Any], Any]:
+    """
+    Returns a (cached) getter of a dotted attribute path, e.g. "attacker_policy.optimizer"
+
+    :param name: the dotted path of the attribute
+    :return: the getter, called with the object to get the attribute from
+    """
+    return operator.attrgetter(name)
+
+
+def _is_flat_tensor_dict(obj: Any) -> bool:
+    """
+    Checks whether an object is a non-empty dict that maps names directly to tensors (e.g. the state dict of a
+    module, but not the one of an optimizer), which is what the safetensors format can store
+
+    :param obj: the object to check
+    :return: True if the object is a flat dict of tensors
+    """
+    return isinstance(obj, dict) and len(obj) > 0 and all(isinstance(value, th.Tensor) for value in obj.values())
+
+
+def _stage_to_pinned_cpu(obj: Any) -> Any:
+    """
+    Copies all cuda tensors of a (nested) dict/list/tuple into pinned cpu memory. The device-to-host copies are
+    issued asynchronously and synchronized once at the end instead of blocking for every tensor
+
+    :param obj: the object holding the tensors
+    :return: the object with the cuda tensors replaced by pinned cpu copies
+    """
+    copied = []
+
+    def stage(value):
+        if isinstance(value, th.Tensor):
+            if not value.is_cuda:
+                return value
+            pinned = th.empty(value.shape, dtype=value.dtype, pin_memory=True)
+            pinned.copy_(value, non_blocking=True)
+            copied.append(pinned)
+            return pinned
+        if isinstance(value, dict):
+            staged = value.__class__()
+            for key, item in value.items():
+                staged[key] = stage(item)
+            return staged
+        if isinstance(value, (list, tuple)):
+            return value.__class__(stage(item) for item in value)
+        return value
+
+    staged_obj = stage(obj)
+    if len(copied) > 0:
+        th.cuda.synchronize()
+    return staged_obj
+
+
+class _NormalNoiseBuffer(object):
+    """
+    Serves the samples of a ``NormalActionNoise`` from a batch drawn with a single vectorized call, instead of
+    calling the RNG on every step. The samples are drawn from the same global numpy RNG as the wrapped noise.
+
+    :param action_noise: the gaussian action noise to sample from
+    :param batch_size: the number of samples drawn at once
+    """
+
+    def __init__(self, action_noise: NormalActionNoise, batch_size: int = NOISE_BATCH_SIZE):
+        self.action_noise = action_noise
+        self.batch_size = batch_size
+        self._samples = None
+        self._idx = batch_size
+
+    def __call__(self) -> np.ndarray:
+        if self._idx == self.batch_size:
+            mu, sigma = self.action_noise._mu, self.action_noise._sigma
+            shape = (self.batch_size,) + np.broadcast(mu, sigma).shape
+            self._samples = np.random.normal(mu, sigma, size=shape).astype(self.action_noise._dtype)
+            self._idx = 0
+        sample = self._samples[self._idx]
+        self._idx += 1
+        return sample
+
+    def reset(self) -> None:
+        self.action_noise.reset()
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file-like view of a bytes-like object (e.g. a slice of a memory-mapped file) that, in
+    contrast to ``io.BytesIO``, does not copy the buffer up-front
+
+    :param buffer: the bytes-like object to read from
+    """
+
+    def __init__(self, buffer: Union[bytes, memoryview]):
+        super(_BufferReader, self).__init__()
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        n = len(chunk)
+        memoryview(buffer).cast("B")[:n] = chunk
+        self._pos += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        chunk = self._view[self._pos:end]
+        self._pos += len(chunk)
+        return chunk.tobytes()
+
 class BaseRLModel(ABC):
     """
     The base RL model
@@ -58,6 +377,13 @@ class BaseRLModel(ABC):
         Default: -1 (only sample at the beginning of the rollout)
     """
 
+    # Format strings of the log lines written by log_metrics
+    _EVAL_FMT = "[Eval] iter:{},avg_a_R:{:.2f},avg_d_R:{:.2f},avg_t:{:.2f},avg_h:{:.2f},acc_A_R:{:.2f}," \
+                "acc_D_R:{:.2f},lr_a:{:.4E},lr_d:{:.4E},c_h:{:.2f}"
+    _TRAIN_FMT = "[Train] iter: {:.2f} epsilon:{:.2f},avg_a_R:{:.2f},avg_d_R:{:.2f},avg_t:{:.2f},avg_h:{:.2f}," \
+                 "acc_A_R:{:.2f},acc_D_R:{:.2f},A_loss:{:.6f},D_loss:{:.6f},lr_a:{:.4E},lr_d:{:.4E},c_h:{:.2f}," \
+                 "Tr_A:{},Tr_D:{},a_pool:{},d_pool:{},episode:{}"
+
     def __init__(self,
                  policy: Type[BasePolicy],
                  env: Union[GymEnv, str],
@@ -84,6 +410,8 @@ class BaseRLModel(ABC):
         if verbose > 0:
             print(f"Using {self.device} device")
         self.env = None  # type: Optional[GymEnv]
+        # Game state of the (first) wrapped idsgame env, bound whenever the env is set
+        self._idsgame_state = None
         # get VecNormalize object if needed
         self._vec_normalize_env = unwrap_vec_normalize(env)
         self.verbose = verbose
@@ -109,15 +437,26 @@ class BaseRLModel(ABC):
         self.learning_rate = learning_rate
         self.lr_schedule_a = None  # type: Optional[Callable]
         self.lr_schedule_d = None  # type: Optional[Callable]
+        # Start and end values of constant/linear learning rate schedules (None if the schedule has another shape)
+        self._lr_linear_a = None  # type: Optional[Tuple[float, float]]
+        self._lr_linear_d = None  # type: Optional[Tuple[float, float]]
         self._last_obs_a = None  # type: Optional[np.ndarray]
         self._last_obs_d = None  # type: Optional[np.ndarray]
-        self._last_obs_a_a = None
-        self._last_obs_a_d = None
-        self._last_obs_a_p = None
-        self._last_obs_a_r = None
+        # Reusable (pinned host, device) tensor pairs for transferring observations to the device and pinned host
+        # buffers for transferring sampled actions back
+        self._obs_buffers = {}  # type: Dict[str, Union[th.Tensor, Tuple[th.Tensor, th.Tensor]]]
+        # Running sums/counts of the training losses since the last log tick
+        self._a_loss_sum = 0.0
+        self._a_loss_count = 0
+        self._d_loss_sum = 0.0
+        self._d_loss_count = 0
+        # All channels of the last attacker observation when using multi-channel observations
+        self._last_obs_channels = None
         # When using VecNormalize:
         self._last_original_obs = None  # type: Optional[np.ndarray]
         self._episode_num = 0
+        # (id of the eval env, seed) that ``_setup_learn`` last seeded the eval env with
+        self._eval_seed_applied = None  # type: Optional[Tuple[int, int]]
         # Used for gSDE only
         self.use_sde = use_sde
         self.sde_sample_freq = sde_sample_freq
@@ -125,7 +464,11 @@ class BaseRLModel(ABC):
         # this is used to update the learning rate
         self._current_progress = 1
         # Buffers for logging
-        self.ep_info_buffer = None  # type: Optional[deque]
+        # Ring buffers with the rewards and lengths of the last EP_INFO_BUFFER_SIZE episodes (from Monitor infos)
+        self._ep_r_buf = None  # type: Optional[np.ndarray]
+        self._ep_l_buf = None  # type: Optional[np.ndarray]
+        self._ep_buf_i = 0
+        self._ep_buf_n = 0
         self.ep_success_buffer = None  # type: Optional[deque]
         # For logging
         self._n_updates = 0  # type: int
@@ -148,17 +491,10 @@ class BaseRLModel(ABC):
         if env is not None:
             if isinstance(env, str):
                 if create_eval_env:
-                    eval_env = gym.make(env)
-                    if monitor_wrapper:
-                        eval_env = Monitor(eval_env, filename=None)
-                    self.eval_env = DummyVecEnv([lambda: eval_env])
+                    self.eval_env = self._make_vec_env(env, monitor_wrapper)
                 if self.verbose >= 1:
                     print("Creating environment from the given name, wrapped in a DummyVecEnv.")
-
-                env = gym.make(env)
-                if monitor_wrapper:
-                    env = Monitor(env, filename=None)
-                env = DummyVecEnv([lambda: env])
+                env = self._make_vec_env(env, monitor_wrapper)
 
             env = self._wrap_env(env)
 
@@ -168,16 +504,50 @@ class BaseRLModel(ABC):
             self.defender_action_space = env.defender_action_space
             self.n_envs = env.num_envs
             self.env = env
+            self._bind_idsgame_state()
 
             if not support_multi_env and self.n_envs > 1:
-                raise ValueError("Error: the model does not support multiple envs requires a single vectorized"
-                                 " environment.")
+                raise ValueError("Error: the model does not support multiple envs, it requires a single vectorized"
+                                 " environment (got {} envs).".format(self.n_envs))
+
+    @staticmethod
+    def _make_vec_env(env_id: str, monitor_wrapper: bool) -> VecEnv:
+        """
+        Creates an environment from its id, optionally wrapped in a Monitor, and vectorizes it in a DummyVecEnv
+
+        :param env_id: the id of the environment in the gym registry
+        :param monitor_wrapper: whether to wrap the environment in a Monitor
+        :return: the vectorized environment
+        """
+        env = gym.make(env_id)
+        if monitor_wrapper:
+            env = Monitor(env, filename=None)
+        return DummyVecEnv([lambda env=env: env])
+
+    def _bind_idsgame_state(self) -> None:
+        """
+        Caches a reference to the game state of the wrapped idsgame env so that logging does not have to walk
+        the env -> idsgame_env -> state chain on every call. The state object is reset in-place by the env, so
+        the reference stays valid for the lifetime of the env. Envs that do not wrap an idsgame env
+        (e.g. a DummyVecEnv of Monitors) bind None.
+
+        :return: None
+        """
+        try:
+            self._idsgame_state = self.env.envs[0].idsgame_env.state
+        except (AttributeError, IndexError):
+            self._idsgame_state = None
 
     def _wrap_env(self, env: GymEnv) -> VecEnv:
         if not isinstance(env, VecEnv):
-            if self.verbose >= 1:
-                print("Wrapping the env in a DummyVecEnv.")
-            env = DummyVecEnv([lambda: env])
+            if hasattr(env, "idsgame_env"):
+                if self.verbose >= 1:
+                    print("Wrapping the env in a SingleEnvVecView.")
+                env = SingleEnvVecView(env)
+            else:
+                if self.verbose >= 1:
+                    print("Wrapping the env in a DummyVecEnv.")
+                env = DummyVecEnv([lambda: env])
 
         # if is_image_space(env.attacker_observation_space) and not isinstance(env, VecTransposeImage):
         #     if self.verbose >= 1:
@@ -202,8 +572,12 @@ class BaseRLModel(ABC):
         :param attacker_episode_rewards: list of attacker episode rewards for the last <self.config.log_frequency> episodes
         :param defender_episode_rewards: list of defender episode rewards for the last <self.config.log_frequency> episodes
         :param episode_steps: list of episode steps for the last <self.config.log_frequency> episodes
-        :param episode_avg_attacker_loss: list of episode attacker loss for the last <self.config.log_frequency> episodes
-        :param episode_avg_defender_loss: list of episode defedner loss for the last <self.config.log_frequency> episodes
+        :param episode_avg_attacker_loss: (optional) list of episode attacker loss for the last
+                                          <self.config.log_frequency> episodes, if None the running loss
+                                          recorded with record_loss() is used
+        :param episode_avg_defender_loss: (optional) list of episode defender loss for the last
+                                          <self.config.log_frequency> episodes, if None the running loss
+                                          recorded with record_loss() is used
         :param eval: boolean flag whether the metrics are logged in an evaluation context.
         :param update_stats: boolean flag whether to update stats
         :param lr_attacker: the learning rate of the attacker
@@ -215,46 +589,63 @@ class BaseRLModel(ABC):
         :param total_num_episodes: number of training episodes
         :return: None
         """
-        avg_attacker_episode_rewards = np.mean(attacker_episode_rewards)
-        avg_defender_episode_rewards = np.mean(defender_episode_rewards)
+        episode_metrics = (attacker_episode_rewards, defender_episode_rewards, episode_steps)
+        if len(episode_steps) > 0 and len(attacker_episode_rewards) == len(defender_episode_rewards) == len(episode_steps):
+            # All per-episode metrics have the same length, reduce them with a single vectorized call
+            avg_attacker_episode_rewards, avg_defender_episode_rewards, avg_episode_steps = \
+                np.array(episode_metrics, dtype=np.float64).reshape(len(episode_metrics), -1).mean(axis=1)
+        else:
+            avg_attacker_episode_rewards, avg_defender_episode_rewards, avg_episode_steps = \
+                map(np.mean, episode_metrics)
         if lr_attacker is None:
             lr_attacker = 0.0
         if lr_defender is None:
             lr_defender = 0.0
-        if not eval and episode_avg_attacker_loss is not None:
-            avg_episode_attacker_loss = np.mean(episode_avg_attacker_loss)
-        else:
+        if eval:
             avg_episode_attacker_loss = 0.0
-        if not eval and episode_avg_defender_loss is not None:
-            avg_episode_defender_loss = np.mean(episode_avg_defender_loss)
-        else:
             avg_episode_defender_loss = 0.0
+        else:
+            if episode_avg_attacker_loss is not None:
+                avg_episode_attacker_loss = np.mean(episode_avg_attacker_loss)
+            else:
+                avg_episode_attacker_loss = self._running_mean_loss(attacker=True)
+            if episode_avg_defender_loss is not None:
+                avg_episode_defender_loss = np.mean(episode_avg_defender_loss)
+            else:
+                avg_episode_defender_loss = self._running_mean_loss(attacker=False)
+            self._reset_loss_stats()
 
-        avg_episode_steps = np.mean(episode_steps)
-        hack_probability = self.train_hack_probability if not eval else self.eval_hack_probability
-        hack_probability_total = self.train_cumulative_hack_probability if not eval else self.eval_cumulative_hack_probability
-        attacker_cumulative_reward = self.env.envs[0].idsgame_env.state.attacker_cumulative_reward if not eval \
-            else self.eval_attacker_cumulative_reward
-        defender_cumulative_reward = self.env.envs[0].idsgame_env.state.defender_cumulative_reward if not eval \
-            else self.eval_defender_cumulative_reward
+        if not eval:
+            hack_probability = self.train_hack_probability
+            hack_probability_total = self.train_cumulative_hack_probability
+            state = self._idsgame_state
+            if state is not None:
+                attacker_cumulative_reward = state.attacker_cumulative_reward
+                defender_cumulative_reward = state.defender_cumulative_reward
+            else:
+                attacker_cumulative_reward = 0.0
+                defender_cumulative_reward = 0.0
+        else:
+            hack_probability = self.eval_hack_probability
+            hack_probability_total = self.eval_cumulative_hack_probability
+            attacker_cumulative_reward = self.eval_attacker_cumulative_reward
+            defender_cumulative_reward = self.eval_defender_cumulative_reward
         if eval:
-            log_str = "[Eval] iter:{},avg_a_R:{:.2f},avg_d_R:{:.2f},avg_t:{:.2f},avg_h:{:.2f},acc_A_R:{:.2f}," \
-                      "acc_D_R:{:.2f},lr_a:{:.4E},lr_d:{:.4E},c_h:{:.2f}".format(
+            log_str = self._EVAL_FMT.format(
                 iteration, avg_attacker_episode_rewards, avg_defender_episode_rewards, avg_episode_steps,
                 hack_probability,
                 attacker_cumulative_reward, defender_cumulative_reward, lr_attacker, lr_defender,
                 hack_probability_total)
         else:
-            log_str = "[Train] iter: {:.2f} epsilon:{:.2f},avg_a_R:{:.2f},avg_d_R:{:.2f},avg_t:{:.2f},avg_h:{:.2f},acc_A_R:{:.2f}," \
-                      "acc_D_R:{:.2f},A_loss:{:.6f},D_loss:{:.6f},lr_a:{:.4E},lr_d:{:.4E},c_h:{:.2f},Tr_A:{},Tr_D:{}," \
-                      "a_pool:{},d_pool:{},episode:{}".format(
+            log_str = self._TRAIN_FMT.format(
                 iteration, self.pg_agent_config.epsilon, avg_attacker_episode_rewards, avg_defender_episode_rewards,
                 avg_episode_steps, hack_probability, attacker_cumulative_reward, defender_cumulative_reward,
                 avg_episode_attacker_loss, avg_episode_defender_loss, lr_attacker, lr_defender, hack_probability_total,
                 train_attacker,
                 train_defender, a_pool, d_pool, total_num_episodes)
         self.pg_agent_config.logger.info(log_str)
-        print(log_str)
+        if self.verbose >= 1:
+            print(log_str)
         if update_stats and self.pg_agent_config.tensorboard:
             self.log_tensorboard(iteration, avg_attacker_episode_rewards, avg_defender_episode_rewards,
                                  avg_episode_steps,
@@ -263,17 +654,56 @@ class BaseRLModel(ABC):
                                  lr_attacker,
                                  lr_defender, hack_probability_total, a_pool, d_pool, eval=eval)
         if update_stats:
-            result.avg_episode_steps.append(avg_episode_steps)
-            result.avg_attacker_episode_rewards.append(avg_attacker_episode_rewards)
-            result.avg_defender_episode_rewards.append(avg_defender_episode_rewards)
-            result.epsilon_values.append(self.pg_agent_config.epsilon)
-            result.hack_probability.append(hack_probability)
-            result.cumulative_hack_probabiltiy.append(hack_probability_total)
-            result.attacker_cumulative_reward.append(attacker_cumulative_reward)
-            result.defender_cumulative_reward.append(defender_cumulative_reward)
-            result.avg_episode_loss_attacker.append(avg_episode_attacker_loss)
-            result.avg_episode_loss_defender.append(avg_episode_defender_loss)
-            result.lr_list.append(lr_attacker)
+            result.record(avg_episode_steps=avg_episode_steps,
+                          avg_attacker_episode_rewards=avg_attacker_episode_rewards,
+                          avg_defender_episode_rewards=avg_defender_episode_rewards,
+                          epsilon_values=self.pg_agent_config.epsilon,
+                          hack_probability=hack_probability,
+                          cumulative_hack_probabiltiy=hack_probability_total,
+                          attacker_cumulative_reward=attacker_cumulative_reward,
+                          defender_cumulative_reward=defender_cumulative_reward,
+                          avg_episode_loss_attacker=avg_episode_attacker_loss,
+                          avg_episode_loss_defender=avg_episode_defender_loss,
+                          lr_list=lr_attacker)
+
+    def record_loss(self, loss: float, attacker: bool = True) -> None:
+        """
+        Adds a training loss to the running statistics that are averaged at the next log tick
+
+        :param loss: the loss to record
+        :param attacker: whether the loss is of the attacker or the defender
+        :return: None
+        """
+        if attacker:
+            self._a_loss_sum += float(loss)
+            self._a_loss_count += 1
+        else:
+            self._d_loss_sum += float(loss)
+            self._d_loss_count += 1
+
+    def _running_mean_loss(self, attacker: bool = True) -> float:
+        """
+        :param attacker: whether to return the mean loss of the attacker or the defender
+        :return: the mean of the losses recorded since the last log tick (nan if nothing was recorded)
+        """
+        if attacker:
+            loss_sum, loss_count = self._a_loss_sum, self._a_loss_count
+        else:
+            loss_sum, loss_count = self._d_loss_sum, self._d_loss_count
+        if loss_count == 0:
+            return float("nan")
+        return loss_sum / loss_count
+
+    def _reset_loss_stats(self) -> None:
+        """
+        Resets the running loss statistics
+
+        :return: None
+        """
+        self._a_loss_sum = 0.0
+        self._a_loss_count = 0
+        self._d_loss_sum = 0.0
+        self._d_loss_count = 0
 
     def log_tensorboard(self, episode: int, avg_attacker_episode_rewards: float, avg_defender_episode_rewards: float,
                         avg_episode_steps: float, episode_avg_loss_attacker: float, episode_avg_loss_defender: float,
@@ -301,30 +731,24 @@ class BaseRLModel(ABC):
         :param d_pool: size of the defender opponent pool
         :return: None
         """
-        train_or_eval = "eval" if eval else "train"
-        self.tensorboard_writer.add_scalar('avg_episode_rewards/' + train_or_eval + "/attacker",
-                                           avg_attacker_episode_rewards, episode)
-        self.tensorboard_writer.add_scalar('avg_episode_rewards/' + train_or_eval + "/defender",
-                                           avg_defender_episode_rewards, episode)
-        self.tensorboard_writer.add_scalar('episode_steps/' + train_or_eval, avg_episode_steps, episode)
-        self.tensorboard_writer.add_scalar('episode_avg_loss/' + train_or_eval + "/attacker", episode_avg_loss_attacker,
-                                           episode)
-        self.tensorboard_writer.add_scalar('episode_avg_loss/' + train_or_eval + "/defender", episode_avg_loss_defender,
-                                           episode)
-        self.tensorboard_writer.add_scalar('hack_probability/' + train_or_eval, hack_probability, episode)
-        self.tensorboard_writer.add_scalar('cumulative_hack_probability/' + train_or_eval, cumulative_hack_probability,
-                                           episode)
-        self.tensorboard_writer.add_scalar('cumulative_reward/attacker/' + train_or_eval,
-                                           attacker_cumulative_reward, episode)
-        self.tensorboard_writer.add_scalar('cumulative_reward/defender/' + train_or_eval,
-                                           defender_cumulative_reward, episode)
-        self.tensorboard_writer.add_scalar('epsilon', epsilon, episode)
-        if self.pg_agent_config.opponent_pool and a_pool is not None and d_pool is not None and not eval:
-            self.tensorboard_writer.add_scalar('opponent_pool_size/attacker', a_pool, episode)
-            self.tensorboard_writer.add_scalar('opponent_pool_size/defender', d_pool, episode)
+        tags = _TB_TAGS["eval" if eval else "train"]
+        writer = self.tensorboard_writer
+        writer.add_scalar(tags["avg_episode_rewards_attacker"], avg_attacker_episode_rewards, episode)
+        writer.add_scalar(tags["avg_episode_rewards_defender"], avg_defender_episode_rewards, episode)
+        writer.add_scalar(tags["episode_steps"], avg_episode_steps, episode)
+        writer.add_scalar(tags["episode_avg_loss_attacker"], episode_avg_loss_attacker, episode)
+        writer.add_scalar(tags["episode_avg_loss_defender"], episode_avg_loss_defender, episode)
+        writer.add_scalar(tags["hack_probability"], hack_probability, episode)
+        writer.add_scalar(tags["cumulative_hack_probability"], cumulative_hack_probability, episode)
+        writer.add_scalar(tags["cumulative_reward_attacker"], attacker_cumulative_reward, episode)
+        writer.add_scalar(tags["cumulative_reward_defender"], defender_cumulative_reward, episode)
+        writer.add_scalar('epsilon', epsilon, episode)
         if not eval:
-            self.tensorboard_writer.add_scalar('lr/attacker', lr_attacker, episode)
-            self.tensorboard_writer.add_scalar('lr/defender', lr_defender, episode)
+            if self.pg_agent_config.opponent_pool and a_pool is not None and d_pool is not None:
+                writer.add_scalar('opponent_pool_size/attacker', a_pool, episode)
+                writer.add_scalar('opponent_pool_size/defender', d_pool, episode)
+            writer.add_scalar('lr/attacker', lr_attacker, episode)
+            writer.add_scalar('lr/defender', lr_defender, episode)
 
     @abstractmethod
     def _setup_model(self) -> None:
@@ -352,6 +776,103 @@ class BaseRLModel(ABC):
         """Transform to callable if needed."""
         self.lr_schedule_a = get_schedule_fn(self.pg_agent_config.alpha_attacker)
         self.lr_schedule_d = get_schedule_fn(self.pg_agent_config.alpha_defender)
+        self._lr_linear_a = self._linear_schedule_ends(self.lr_schedule_a)
+        self._lr_linear_d = self._linear_schedule_ends(self.lr_schedule_d)
+
+    @staticmethod
+    def _linear_schedule_ends(schedule: Callable) -> Optional[Tuple[float, float]]:
+        """
+        Gets the start and end values of a constant or linear schedule (e.g. of the learning rate or the clip range),
+        so that its value can be computed without calling the schedule.
+
+        :param schedule: the schedule (a function of the progress, from 1 to 0)
+        :return: the values at progress 1 and 0, or None if the schedule is neither constant nor linear
+        """
+        hi = float(schedule(1.0))
+        lo = float(schedule(0.0))
+        for progress in (0.25, 0.5, 0.75):
+            expected = lo + (hi - lo) * progress
+            if not math.isclose(float(schedule(progress)), expected, rel_tol=1e-9, abs_tol=1e-12):
+                return None
+        return hi, lo
+
+    def _scheduled_value(self, ends: Optional[Tuple[float, float]], schedule: Callable) -> float:
+        """
+        :param ends: the start and end values of a constant/linear schedule, or None for other schedules
+        :param schedule: the schedule, only evaluated when the start and end values are not known
+        :return: the value of the schedule at the current progress
+        """
+        if ends is None:
+            return schedule(self._current_progress)
+        hi, lo = ends
+        return hi + (lo - hi) * (1.0 - self._current_progress)
+
+    def _current_lr(self, attacker: bool = True) -> float:
+        """
+        :param attacker: whether to use the learning rate schedule of the attacker or the defender
+        :return: the learning rate at the current progress
+        """
+        if attacker:
+            return self._scheduled_value(self._lr_linear_a, self.lr_schedule_a)
+        return self._scheduled_value(self._lr_linear_d, self.lr_schedule_d)
+
+    def _obs_as_tensor(self, obs: np.ndarray, key: str) -> th.Tensor:
+        """
+        Converts an observation to a tensor on the device of the model. On CUDA devices the observation is
+        staged in a reusable pinned host buffer and copied asynchronously to a reusable device buffer instead of
+        allocating new tensors every step. On the CPU the numpy memory is shared without a copy.
+
+        :param obs: the observation to convert
+        :param key: name of the observation slot (one pair of buffers is kept per slot)
+        :return: the observation tensor on the device
+        """
+        if th.device(self.device).type != "cuda":
+            return th.as_tensor(obs)
+        obs_tensor = th.as_tensor(obs)
+        buffers = self._obs_buffers.get(key)
+        if buffers is None or buffers[0].shape != obs_tensor.shape or buffers[0].dtype != obs_tensor.dtype:
+            host_buffer = th.empty(obs_tensor.shape, dtype=obs_tensor.dtype, pin_memory=True)
+            buffers = (host_buffer, th.empty_like(host_buffer, device=self.device))
+            self._obs_buffers[key] = buffers
+        host_buffer, device_buffer = buffers
+        host_buffer.copy_(obs_tensor)
+        device_buffer.copy_(host_buffer, non_blocking=True)
+        return device_buffer
+
+    def _actions_as_numpy(self, actions: th.Tensor, key: str) -> np.ndarray:
+        """
+        Converts sampled actions to a numpy array. On the CPU the tensor memory is shared without a copy, on CUDA
+        devices the actions are copied into a reusable pinned host buffer instead of a newly allocated cpu tensor.
+
+        :param actions: the actions to convert
+        :param key: name of the action slot (one buffer is kept per slot)
+        :return: the actions as numpy array (owning its memory on CUDA devices, so the buffer can be reused)
+        """
+        if not actions.is_cuda:
+            return actions.numpy()
+        host_buffer = self._obs_buffers.get(key)
+        if host_buffer is None or host_buffer.shape != actions.shape or host_buffer.dtype != actions.dtype:
+            host_buffer = th.empty(actions.shape, dtype=actions.dtype, pin_memory=True)
+            self._obs_buffers[key] = host_buffer
+        host_buffer.copy_(actions)
+        return host_buffer.numpy().copy()
+
+    def _channels_as_tensors(self, channels, key: str) -> List[th.Tensor]:
+        """
+        Converts the channels of a multi-channel observation to tensors on the device of the model. On CUDA
+        devices channels of the same dtype are concatenated and transferred with a single host-to-device copy,
+        the returned tensors are views into the transferred buffer.
+
+        :param channels: the channels to convert
+        :param key: name of the observation slot (see ``_obs_as_tensor``)
+        :return: the list of channel tensors on the device
+        """
+        channels = [np.asarray(channel) for channel in channels]
+        if th.device(self.device).type != "cuda" or len({channel.dtype for channel in channels}) != 1:
+            return [self._obs_as_tensor(channel, key + "_" + str(i)) for i, channel in enumerate(channels)]
+        flat = self._obs_as_tensor(np.concatenate([channel.ravel() for channel in channels]), key)
+        return [chunk.view(channel.shape) for chunk, channel in
+                zip(th.split(flat, [channel.size for channel in channels]), channels)]
 
     def _update_current_progress(self, num_timesteps: int, total_timesteps: int) -> None:
         """
@@ -369,19 +890,12 @@ class BaseRLModel(ABC):
 
         :param optimizers: (Union[List[th.optim.Optimizer], th.optim.Optimizer])
             An optimizer or a list of optimizers.
+        :param attacker: whether to use the learning rate schedule of the attacker or the defender
         """
-        # Log the current learning rate
-        if attacker:
-            if not isinstance(optimizers, list):
-                optimizers = [optimizers]
-            for optimizer in optimizers:
-                update_learning_rate(optimizer, self.lr_schedule_a(self._current_progress))
-        else:
-            if not isinstance(optimizers, list):
-                optimizers = [optimizers]
-            for optimizer in optimizers:
-                update_learning_rate(optimizer, self.lr_schedule_d(self._current_progress))
-
+        new_lr = self._current_lr(attacker=attacker)
+        for optimizer in (optimizers if type(optimizers) is list else (optimizers,)):
+            for param_group in optimizer.param_groups:
+                param_group['lr'] = new_lr
 
     @staticmethod
     def safe_mean(arr: Union[np.ndarray, list, deque]) -> np.ndarray:
@@ -389,10 +903,18 @@ class BaseRLModel(ABC):
         Compute the mean of an array if there is at least one element.
         For empty array, return NaN. It is used for logging only.
 
+        Small Python buffers (e.g. the episode info deques) are averaged with ``math.fsum`` to avoid the
+        array construction and ufunc dispatch of ``np.mean``.
+
         :param arr:
         :return:
         """
-        return np.nan if len(arr) == 0 else np.mean(arr)
+        n = len(arr)
+        if n == 0:
+            return np.nan
+        if isinstance(arr, np.ndarray):
+            return arr.mean()
+        return math.fsum(arr) / n
 
     def get_env(self) -> Optional[VecEnv]:
         """
@@ -423,22 +945,22 @@ class BaseRLModel(ABC):
         :param attacker_observation_space: (gym.spaces.Space)
         :param attacker_action_space: (gym.spaces.Space)
         """
-        if (attacker_observation_space != env.attacker_observation_space
+        if (not _spaces_equal(attacker_observation_space, env.attacker_observation_space)
             # Special cases for images that need to be transposed
             and not (is_image_space(env.attacker_observation_space)
                      and attacker_observation_space == VecTransposeImage.transpose_space(env.attacker_observation_space))):
             raise ValueError(f'Observation spaces do not match: {attacker_observation_space} != {env.attacker_observation_space}')
-        if attacker_action_space != env.attacker_action_space:
+        if not _spaces_equal(attacker_action_space, env.attacker_action_space):
             raise ValueError(f'Action spaces do not match: {attacker_action_space} != {env.attacker_action_space}')
 
-        if (defender_observation_space != env.defender_observation_space
+        if (not _spaces_equal(defender_observation_space, env.defender_observation_space)
                 # Special cases for images that need to be transposed
                 and not (is_image_space(env.defender_observation_space)
                          and defender_observation_space == VecTransposeImage.transpose_space(
                             env.defender_observation_space))):
             raise ValueError(
                 f'Observation spaces do not match: {defender_observation_space} != {env.defender_observation_space}')
-        if defender_action_space != env.defender_action_space:
+        if not _spaces_equal(defender_action_space, env.defender_action_space):
             raise ValueError(f'Action spaces do not match: {defender_action_space} != {env.defender_action_space}')
 
     def set_env(self, env: GymEnv) -> None:
@@ -459,6 +981,7 @@ class BaseRLModel(ABC):
 
         self.n_envs = env.num_envs
         self.env = env
+        self._bind_idsgame_state()
 
     def get_torch_variables(self, attacker:bool = True) -> Tuple[List[str], List[str]]:
         """
@@ -481,6 +1004,60 @@ class BaseRLModel(ABC):
                 state_dicts = ["defender_node_policy", "defender_at_policy"]
         return state_dicts, []
 
+    def _maybe_compile_policies(self) -> None:
+        """
+        Compiles the networks of the attacker and defender policies with ``torch.compile`` if enabled in the config.
+        Only the tensor-only submodules are compiled since the forward pass of the policies queries the environment
+        for legal actions. The modules are compiled in-place so that the keys of the saved state dicts are unchanged.
+
+        :return: None
+        """
+        if not self.pg_agent_config.torch_compile:
+            return
+        mode = "reduce-overhead" if th.device(self.device).type == "cuda" else None
+        for attacker in [True, False]:
+            state_dicts_names, _ = self.get_torch_variables(attacker=attacker)
+            for name in state_dicts_names:
+                policy = getattr(self, name, None)
+                if policy is None:
+                    continue
+                for module in [policy.features_extractor, policy.mlp_extractor, policy.action_net, policy.value_net]:
+                    module.compile(mode=mode, fullgraph=False, dynamic=False)
+
+    def _maybe_enable_cuda_graphs(self) -> None:
+        """
+        Enables replaying the tensor-only part of the rollout forward passes of the policies with CUDA graphs if
+        enabled in the config and the model runs on a CUDA device. The graphs are captured lazily by the policies
+        on the first forward pass of each observation shape. Not combined with ``torch_compile``, whose
+        "reduce-overhead" mode already uses CUDA graphs.
+
+        :return: None
+        """
+        if not self.pg_agent_config.use_cuda_graph \
+                or self.pg_agent_config.torch_compile \
+                or th.device(self.device).type != "cuda":
+            return
+        for attacker in [True, False]:
+            state_dicts_names, _ = self.get_torch_variables(attacker=attacker)
+            for name in state_dicts_names:
+                policy = getattr(self, name, None)
+                if policy is not None:
+                    policy.use_cuda_graph = True
+
+    def _set_training_mode(self, mode: bool) -> None:
+        """
+        Puts the trained policies in training or evaluation mode (affects e.g. dropout and batch normalization)
+
+        :param mode: (bool) True for training mode, False for evaluation mode
+        :return: None
+        """
+        for attacker in [True, False]:
+            state_dicts_names, _ = self.get_torch_variables(attacker=attacker)
+            for name in state_dicts_names:
+                policy = getattr(self, name, None)
+                if policy is not None:
+                    policy.train(mode)
+
     @abstractmethod
     def learn(self, total_timesteps: int,
               callback: MaybeCallback = None,
@@ -513,7 +1090,7 @@ class BaseRLModel(ABC):
     def load(cls, load_path: str, env: Optional[GymEnv] = None, policy_class = None,
              pg_agent_config : PolicyGradientAgentConfig = None, **kwargs):
         """
-        Load the model from a zip-file
+        Load the model from a zip-file or a native torch checkpoint
 
         :param load_path: the location of the saved data
         :param env: the new environment to run the loaded model on
@@ -557,8 +1134,8 @@ class BaseRLModel(ABC):
 
         # put state_dicts back in place
         for name in params:
-            attr = recursive_getattr(model, name)
-            attr.load_state_dict(params[name])
+            attr = _attr_getter(name)(model)
+            attr.load_state_dict(_dequantize_state_dict(params[name]))
 
         # put tensors back in place
         if tensors is not None:
@@ -579,65 +1156,250 @@ class BaseRLModel(ABC):
         :return: (dict),(dict),(dict) Class parameters, model state_dicts (dict of state_dict)
             and dict of extra tensors
         """
-        # Check if file exists if load_path is a string
-        if isinstance(load_path, str):
-            if not os.path.exists(load_path):
-                if os.path.exists(load_path + ".zip"):
-                    load_path += ".zip"
-                else:
-                    raise ValueError(f"Error: the file {load_path} could not be found")
+        load_path = BaseRLModel._resolve_load_path(load_path)
 
         # set device to cpu if cuda is not available
         device = get_device(None, pg_agent_config)
+        use_fast_loader = pg_agent_config.use_fast_loader
+        skip_zip_crc_check = pg_agent_config.skip_zip_crc_check
+        move_after_load = pg_agent_config.load_to_cpu_then_move and device.type != "cpu"
+        # The string location takes the fast path of th.load for the cpu
+        map_location = "cpu" if device.type == "cpu" or move_after_load else device
+
+        if BaseRLModel._is_torch_checkpoint(load_path):
+            data, params, tensors = BaseRLModel._load_from_torch_checkpoint(load_path, load_data=load_data,
+                                                                            device=map_location)
+        else:
+            data, params, tensors = BaseRLModel._load_from_zip_file(load_path, load_data=load_data,
+                                                                    map_location=map_location,
+                                                                    use_fast_loader=use_fast_loader,
+                                                                    verify_crc=not skip_zip_crc_check)
+        if move_after_load:
+            # Loaded to the cpu, moved to the device in a single pass over the tensors
+            params = _to_device(params, device)
+            tensors = _to_device(tensors, device)
+        return data, params, tensors
+
+    @staticmethod
+    def _resolve_load_path(load_path: Union[str, io.BufferedIOBase]) -> Union[str, io.BufferedIOBase]:
+        """
+        Resolves the path of a saved model (appending ".zip" if needed) and checks the zip magic number of the
+        file, so that missing files and files of another format are rejected before any archive is parsed.
+
+        :param load_path: the path (or file-like object) of the saved model
+        :return: the resolved path (or the file-like object, rewound to where it was)
+        """
+        if isinstance(load_path, str):
+            try:
+                file = open(load_path, "rb")
+            except FileNotFoundError:
+                try:
+                    file = open(load_path + ".zip", "rb")
+                except FileNotFoundError:
+                    raise ValueError(f"Error: the file {load_path} could not be found")
+                load_path += ".zip"
+            with file:
+                magic = file.read(4)
+        else:
+            position = load_path.tell()
+            magic = load_path.read(4)
+            load_path.seek(position)
+        # Local file header, or end of central directory of an empty archive
+        if magic not in (b"PK\x03\x04", b"PK\x05\x06"):
+            raise ValueError(f"Error: the file {load_path} wasn't a zip-file")
+        return load_path
 
+    @staticmethod
+    def _load_from_zip_file(load_path: Union[str, io.BufferedIOBase], load_data: bool = True,
+                            map_location: Union[str, th.device] = "cpu", use_fast_loader: bool = False,
+                            verify_crc: bool = True) \
+            -> (Tuple[Optional[Dict[str, Any]], Optional[TensorDict], Optional[TensorDict]]):
+        """
+        Load model data from a zip-archive written by ``_save_to_file_zip``
+
+        :param load_path: Where to load the model from
+        :param load_data: Whether we should load and return data (class parameters)
+        :param map_location: the location to load the tensors to
+        :param use_fast_loader: whether to read the archive with ``_read_zip_records`` instead of ``zipfile``
+        :param verify_crc: whether to verify the CRC32 of the members (archives are always read with
+                           ``_read_zip_records`` when it is not verified)
+        :return: (dict),(dict),(dict) Class parameters, model state_dicts (dict of state_dict)
+            and dict of extra tensors
+        """
         # Open the zip archive and load data
         try:
-            with zipfile.ZipFile(load_path, "r") as archive:
-                namelist = archive.namelist()
-                # If data or parameters is not in the
-                # zip archive, assume they were stored
-                # as None (_save_to_file_zip allows this).
-                data = None
-                tensors = None
-                params = {}
-
-                if "data" in namelist and load_data:
-                    # Load class parameters and convert to string
-                    json_data = archive.read("data").decode()
-                    data = json_to_data(json_data)
-
-                if "tensors.pth" in namelist and load_data:
-                    # Load extra tensors
-                    with archive.open('tensors.pth', mode="r") as tensor_file:
-                        # File has to be seekable, but opt_param_file is not, so load in BytesIO first
-                        # fixed in python >= 3.7
-                        file_content = io.BytesIO()
-                        file_content.write(tensor_file.read())
-                        # go to start of file
-                        file_content.seek(0)
-                        # load the parameters with the right ``map_location``
-                        tensors = th.load(file_content, map_location=device)
-
-                # check for all other .pth files
-                other_files = [file_name for file_name in namelist if
-                               os.path.splitext(file_name)[1] == ".pth" and file_name != "tensors.pth"]
+            if use_fast_loader or not verify_crc:
+                # zipfile streams always compute the CRC32, so unverified reads slice the payloads directly
+                records = BaseRLModel._read_zip_records(load_path, verify_crc=verify_crc)
+            else:
+                with zipfile.ZipFile(load_path, "r") as archive:
+                    # Read the members in the order they are stored in the file (rather than the order of the
+                    # central directory) so that the archive is streamed instead of being read with random seeks
+                    infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+                    records = {info.filename: archive.read(info) for info in infos}
+        except zipfile.BadZipFile:
+            # load_path wasn't a zip file
+            raise ValueError(f"Error: the file {load_path} wasn't a zip-file")
+
+        # If data or parameters is not in the
+        # zip archive, assume they were stored
+        # as None (_save_to_file_zip allows this).
+        data = None
+        tensors = None
+        params = {}
+
+        # Classify the records in a single pass
+        has_data = False
+        has_tensors = False
+        has_params = False
+        other_files = []
+        safetensors_files = []
+        for file_name in records:
+            if file_name == "data":
+                has_data = True
+            elif file_name == "tensors.pth" or file_name == "tensors.safetensors":
+                has_tensors = True
+            elif file_name == "params.pth":
+                has_params = True
+            elif file_name.endswith(".safetensors"):
+                safetensors_files.append(file_name)
+            elif file_name.endswith(".pth"):
                 # if there are any other files which end with .pth and aren't "params.pth"
                 # assume that they each are optimizer parameters
-                if len(other_files) > 0:
-                    for file_path in other_files:
-                        with archive.open(file_path, mode="r") as opt_param_file:
-                            # File has to be seekable, but opt_param_file is not, so load in BytesIO first
-                            # fixed in python >= 3.7
-                            file_content = io.BytesIO()
-                            file_content.write(opt_param_file.read())
-                            # go to start of file
-                            file_content.seek(0)
-                            # load the parameters with the right ``map_location``
-                            params[os.path.splitext(file_path)[0]] = th.load(file_content, map_location=device)
+                other_files.append(file_name)
+
+        if has_data and load_data:
+            # Load class parameters
+            data = json_to_data(records["data"])
+
+        if (safetensors_files or "tensors.safetensors" in records) and safetensors is None:
+            raise ValueError(f"Error: the file {load_path} contains safetensors members, "
+                             f"but the safetensors package is not installed")
 
+        def load_safetensors(file_path):
+            # safetensors always deserializes to the cpu
+            loaded = safetensors.torch.load(bytes(records[file_path]))
+            return loaded if map_location == "cpu" else _to_device(loaded, map_location)
+
+        if has_tensors and load_data:
+            # Load extra tensors with the right ``map_location``
+            if "tensors.safetensors" in records:
+                tensors = load_safetensors("tensors.safetensors")
+            else:
+                tensors = th.load(_BufferReader(records["tensors.pth"]), map_location=map_location)
+
+        for file_path in safetensors_files:
+            params[file_path[:-len(".safetensors")]] = load_safetensors(file_path)
+
+        if has_params:
+            # All state dicts were coalesced into a single member
+            params.update(th.load(_BufferReader(records["params.pth"]), map_location=map_location))
+
+        # The records are already read, so only the deserialization (which mostly runs in torch's C++ reader
+        # without the GIL) is parallelized, the results are collected in the order of the archive
+        def load_member(file_path):
+            # load the parameters with the right ``map_location``
+            return th.load(_BufferReader(records[file_path]), map_location=map_location)
+
+        other_files_size = sum(len(records[file_path]) for file_path in other_files)
+        if len(other_files) > 1 and other_files_size >= PARALLEL_LOAD_MIN_BYTES:
+            with ThreadPoolExecutor(max_workers=min(8, len(other_files))) as executor:
+                state_dicts = list(executor.map(load_member, other_files))
+        else:
+            state_dicts = [load_member(file_path) for file_path in other_files]
+        for file_path, state_dict in zip(other_files, state_dicts):
+            params[file_path[:-len(".pth")]] = state_dict
+        return data, params, tensors
+
+    @staticmethod
+    def _read_zip_records(load_path: Union[str, io.BufferedIOBase], verify_crc: bool = True) \
+            -> Dict[str, Union[bytes, memoryview]]:
+        """
+        Reads all records of a zip archive without going through per-member ``zipfile`` streams. Files are
+        memory-mapped and stored members are returned as zero-copy slices of the mapping, using the offsets of
+        their local headers; only the central directory is parsed with ``zipfile``. Deflated members are inflated
+        with zlib. File-like objects are read with a single read.
+
+        Models saved with ``torch_checkpoint`` are already loaded by the (miniz-based) reader of ``th.load``; the
+        zip-archives written by ``_save_to_file_zip`` can not be read by that reader since their records are not
+        stored under a common top-level directory.
+
+        :param load_path: the path (or file-like object) of the zip-archive
+        :param verify_crc: whether to verify the CRC32 of the records
+        :return: dict with the content of each record
+        """
+        if isinstance(load_path, str):
+            with open(load_path, "rb") as file:
+                # The mapping stays alive (and open) as long as slices of it are referenced
+                content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            archive_file = content
+        else:
+            content = load_path.read()
+            archive_file = io.BytesIO(content)
+        with zipfile.ZipFile(archive_file, "r") as archive:
+            # Members are sliced in the order they are stored in the file, so the pages of the mapping are touched
+            # sequentially when the records are decoded
+            infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+        content_view = memoryview(content)
+        records = {}
+        for info in infos:
+            # Local file header: 30 fixed bytes followed by the file name and the extra field
+            name_length, extra_length = struct.unpack("<HH", content_view[info.header_offset + 26:
+                                                                           info.header_offset + 30])
+            start = info.header_offset + 30 + name_length + extra_length
+            payload = content_view[start:start + info.compress_size]
+            if info.compress_type == zipfile.ZIP_STORED:
+                record = payload
+            elif info.compress_type == zipfile.ZIP_DEFLATED:
+                record = zlib.decompress(payload, -zlib.MAX_WBITS)
+            else:
+                raise ValueError(f"Error: unsupported compression of {info.filename} in the zip-file")
+            if verify_crc and zlib.crc32(record) != info.CRC:
+                # Raised like the reads of zipfile
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+            records[info.filename] = record
+        return records
+
+    @staticmethod
+    def _is_torch_checkpoint(load_path: str) -> bool:
+        """
+        Checks whether a file was saved with ``_save_to_file_torch`` rather than ``_save_to_file_zip``.
+        Both formats are zip-archives, the torch format is recognized by its pickled ``data.pkl`` record.
+
+        :param load_path: the path (or file-like object) of the saved model
+        :return: True if the file is a native torch checkpoint
+        """
+        try:
+            with zipfile.ZipFile(load_path, "r") as archive:
+                namelist = archive.namelist()
         except zipfile.BadZipFile:
-            # load_path wasn't a zip file
-            raise ValueError(f"Error: the file {load_path} wasn't a zip-file")
+            return False
+        finally:
+            if not isinstance(load_path, str):
+                load_path.seek(0)
+        return "data" not in namelist and any(name.endswith("/data.pkl") for name in namelist)
+
+    @staticmethod
+    def _load_from_torch_checkpoint(load_path: str, load_data: bool = True, device: th.device = None) \
+            -> (Tuple[Optional[Dict[str, Any]], Optional[TensorDict], Optional[TensorDict]]):
+        """
+        Load model data from a native torch checkpoint. Tensors are memory-mapped from the file
+        and placed directly on the target device.
+
+        :param load_path: Where to load the model from
+        :param load_data: Whether we should load and return data (class parameters)
+        :param device: the device to load the tensors to
+        :return: (dict),(dict),(dict) Class parameters, model state_dicts (dict of state_dict)
+            and dict of extra tensors
+        """
+        checkpoint = th.load(load_path, map_location=device, mmap=isinstance(load_path, str))
+        data = None
+        tensors = None
+        if load_data:
+            if checkpoint["data"] is not None:
+                data = json_to_data(checkpoint["data"])
+            tensors = checkpoint["tensors"]
+        params = checkpoint["params"] if checkpoint["params"] is not None else {}
         return data, params, tensors
 
     def set_random_seed(self, seed: Optional[int] = None) -> None:
@@ -707,8 +1469,11 @@ class BaseRLModel(ABC):
         :return: (BaseCallback)
         """
         self.start_time = time.time()
-        self.ep_info_buffer = deque(maxlen=100)
-        self.ep_success_buffer = deque(maxlen=100)
+        self._ep_r_buf = np.empty(EP_INFO_BUFFER_SIZE, dtype=np.float32)
+        self._ep_l_buf = np.empty(EP_INFO_BUFFER_SIZE, dtype=np.int32)
+        self._ep_buf_i = 0
+        self._ep_buf_n = 0
+        self.ep_success_buffer = deque(maxlen=EP_INFO_BUFFER_SIZE)
 
         if self.action_noise is not None:
             self.action_noise.reset()
@@ -732,27 +1497,20 @@ class BaseRLModel(ABC):
                 if self._vec_normalize_env is not None:
                     self._last_original_obs = self._vec_normalize_env.get_original_obs()
         else:
-            if reset_num_timesteps or self._last_obs_a_a is None:
+            if reset_num_timesteps or self._last_obs_channels is None:
                 obs, _ = self.env.reset()
-                a_obs = obs[0]
-                a_obs_a = a_obs[0]
-                a_obs_d = a_obs[1]
-                a_obs_p = a_obs[2]
-                a_obs_r = a_obs[3]
-                a_obs = a_obs[4]
-                d_obs = obs[1]
-                self._last_obs_a = a_obs
-                self._last_obs_a_a = a_obs_a
-                self._last_obs_a_d = a_obs_d
-                self._last_obs_a_p = a_obs_p
-                self._last_obs_a_r = a_obs_r
-                self._last_obs_d = d_obs
+                # The channels are kept together, the last one is the attacker state
+                self._last_obs_channels = obs[0]
+                self._last_obs_a = obs[0][4]
+                self._last_obs_d = obs[1]
                 # Retrieve unnormalized observation for saving into the buffer
                 if self._vec_normalize_env is not None:
                     self._last_original_obs = self._vec_normalize_env.get_original_obs()
 
-        if eval_env is not None and self.seed is not None:
+        # Seed the eval env only once, consecutive calls to ``.learn()`` would otherwise reset its RNG
+        if eval_env is not None and self.seed is not None and self._eval_seed_applied != (id(eval_env), self.seed):
             eval_env.seed(self.seed)
+            self._eval_seed_applied = (id(eval_env), self.seed)
 
         eval_env = self._get_eval_env(eval_env)
 
@@ -761,26 +1519,47 @@ class BaseRLModel(ABC):
 
         return callback
 
+    def _push_ep_info(self, reward: float, length: int) -> None:
+        """
+        Writes the reward and length of a finished episode into the episode info ring buffers,
+        overwriting the oldest episode when the buffers are full
+
+        :param reward: the episode reward
+        :param length: the episode length
+        :return: None
+        """
+        i = self._ep_buf_i
+        self._ep_r_buf[i] = reward
+        self._ep_l_buf[i] = length
+        self._ep_buf_i = (i + 1) % len(self._ep_r_buf)
+        self._ep_buf_n = min(self._ep_buf_n + 1, len(self._ep_r_buf))
+
     def _update_info_buffer(self, infos: List[Dict[str, Any]], dones: Optional[np.ndarray] = None) -> None:
         """
         Retrieve reward and episode length and update the buffer
         if using Monitor wrapper.
 
         :param infos: ([dict])
+        :param dones: (np.ndarray) done flags of the envs, successes are only recorded for finished episodes
         """
+        # The Monitor only adds the episode info at the end of an episode, so on most steps this is a
+        # membership test per env
+        for info in infos:
+            if "episode" in info:
+                maybe_ep_info = info["episode"]
+                if maybe_ep_info is not None:
+                    self._push_ep_info(maybe_ep_info['r'], maybe_ep_info['l'])
         if dones is None:
-            dones = np.array([False] * len(infos))
-        for idx, info in enumerate(infos):
-            maybe_ep_info = info.get('episode')
-            maybe_is_success = info.get('is_success')
-            if maybe_ep_info is not None:
-                self.ep_info_buffer.extend([maybe_ep_info])
-            if maybe_is_success is not None and dones[idx]:
+            return
+        for idx in np.flatnonzero(dones):
+            maybe_is_success = infos[idx].get('is_success')
+            if maybe_is_success is not None:
                 self.ep_success_buffer.append(maybe_is_success)
 
     @staticmethod
     def _save_to_file_zip(save_path: str, data: Dict[str, Any] = None,
-                          params: Dict[str, Any] = None, tensors: Dict[str, Any] = None) -> None:
+                          params: Dict[str, Any] = None, tensors: Dict[str, Any] = None,
+                          coalesce_params: bool = False, use_safetensors: bool = False) -> None:
         """
         Save model to a zip archive.
 
@@ -789,7 +1568,13 @@ class BaseRLModel(ABC):
         :param params: Model parameters being stored expected to contain an entry for every
                        state_dict with its name and the state_dict
         :param tensors: Extra tensor variables expected to contain name and value of tensors
+        :param coalesce_params: whether to store all state dicts in a single "params.pth" member (together with a
+                                "params_manifest" listing their names) instead of one member per state dict
+        :param use_safetensors: whether to store the flat tensor dicts as ".safetensors" members instead of with
+                                ``th.save`` (ignored if the safetensors package is not installed, which save()
+                                logs as a warning)
         """
+        use_safetensors = use_safetensors and safetensors is not None
 
         # data/params can be None, so do not
         # try to serialize them blindly
@@ -804,18 +1589,63 @@ class BaseRLModel(ABC):
 
         # Create a zip-archive and write our objects
         # there. This works when save_path is either
-        # str or a file-like
-        with zipfile.ZipFile(save_path, "w") as archive:
+        # str or a file-like. Files are opened with a large buffer so that the many small writes of the
+        # serialized members reach the disk as large writes
+        if isinstance(save_path, str):
+            save_file = open(save_path, "wb", buffering=ZIP_WRITE_BUFFER_SIZE)
+        else:
+            save_file = contextlib.nullcontext(save_path)
+        with save_file as file, zipfile.ZipFile(file, "w", compression=zipfile.ZIP_STORED,
+                                                allowZip64=True) as archive:
             # Do not try to save "None" elements
             if data is not None:
                 archive.writestr("data", serialized_data)
-            if tensors is not None:
-                with archive.open('tensors.pth', mode="w") as tensors_file:
-                    th.save(tensors, tensors_file)
-            if params is not None:
+            # The members are written with the legacy (non-zip) torch serialization, which streams the storages
+            # into the archive instead of buffering the whole serialized member in memory first
+            if tensors is not None and use_safetensors and _is_flat_tensor_dict(tensors):
+                archive.writestr("tensors.safetensors",
+                                 safetensors.torch.save({name: t.contiguous() for name, t in tensors.items()}))
+            elif tensors is not None:
+                with archive.open('tensors.pth', mode="w", force_zip64=True) as tensors_file:
+                    th.save(tensors, tensors_file, _use_new_zipfile_serialization=False)
+            if params is not None and coalesce_params:
+                archive.writestr("params_manifest", json.dumps(list(params.keys())))
+                with archive.open('params.pth', mode="w", force_zip64=True) as param_file:
+                    th.save(params, param_file, _use_new_zipfile_serialization=False)
+            elif params is not None:
                 for file_name, dict_ in params.items():
-                    with archive.open(file_name + '.pth', mode="w") as param_file:
-                        th.save(dict_, param_file)
+                    if use_safetensors and _is_flat_tensor_dict(dict_):
+                        archive.writestr(file_name + ".safetensors",
+                                         safetensors.torch.save({name: t.contiguous() for name, t in dict_.items()}))
+                        continue
+                    with archive.open(file_name + '.pth', mode="w", force_zip64=True) as param_file:
+                        th.save(dict_, param_file, _use_new_zipfile_serialization=False)
+
+    @staticmethod
+    def _save_to_file_torch(save_path: str, data: Dict[str, Any] = None,
+                            params: Dict[str, Any] = None, tensors: Dict[str, Any] = None) -> None:
+        """
+        Save model to a native torch checkpoint. The class parameters are stored as the same JSON-string
+        as in the zip-archive format, the state dicts and tensors are serialized by a single ``th.save``.
+
+        :param save_path: Where to store the model
+        :param data: Class parameters being stored
+        :param params: Model parameters being stored expected to contain an entry for every
+                       state_dict with its name and the state_dict
+        :param tensors: Extra tensor variables expected to contain name and value of tensors
+        """
+        # Check postfix if save_path is a string
+        if isinstance(save_path, str):
+            _, ext = os.path.splitext(save_path)
+            if ext == "":
+                save_path += ".zip"
+
+        checkpoint = {
+            "data": data_to_json(data) if data is not None else None,
+            "params": params,
+            "tensors": tensors
+        }
+        th.save(checkpoint, save_path)
 
     def excluded_save_params(self) -> List[str]:
         """
@@ -824,7 +1654,7 @@ class BaseRLModel(ABC):
 
         :return: ([str]) List of parameters that should be excluded from save
         """
-        return ["policy", "device", "env", "eval_env", "replay_buffer", "rollout_buffer", "_vec_normalize_env"]
+        return list(EXCLUDED_SAVE_PARAMS)
 
     def save(self, path: str, exclude: Optional[List[str]] = None, include: Optional[List[str]] = None,
              attacker : bool = True) -> None:
@@ -835,18 +1665,16 @@ class BaseRLModel(ABC):
         :param exclude: name of parameters that should be excluded in addition to the default one
         :param include: name of parameters that might be excluded but should be included anyway
         """
-        # copy parameter list so we don't mutate the original dict
-        data = self.__dict__.copy()
-        # use standard list of excluded parameters if none given
+        # use standard set of excluded parameters if none given
         if exclude is None:
-            exclude = self.excluded_save_params()
+            exclude = set(self.excluded_save_params())
         else:
-            # append standard exclude params to the given params
-            exclude.extend([param for param in self.excluded_save_params() if param not in exclude])
+            # add standard exclude params to the given params, without mutating the given list
+            exclude = set(exclude).union(self.excluded_save_params())
 
         # do not exclude params if they are specifically included
         if include is not None:
-            exclude = [param_name for param_name in exclude if param_name not in include]
+            exclude.difference_update(include)
 
         state_dicts_names, tensors_names = self.get_torch_variables(attacker=attacker)
         # any params that are in the save vars must not be saved by data
@@ -854,29 +1682,39 @@ class BaseRLModel(ABC):
         for torch_var in torch_variables:
             # we need to get only the name of the top most module as we'll remove that
             var_name = torch_var.split('.')[0]
-            exclude.append(var_name)
+            exclude.add(var_name)
 
-        # Remove parameter entries of parameters which are to be excluded
-        for param_name in exclude:
-            if param_name in data:
-                data.pop(param_name, None)
+        # Collect the remaining attributes in a single pass instead of copying the whole dict and popping
+        data = {key: value for key, value in self.__dict__.items() if key not in exclude}
 
         # Build dict of tensor variables
         tensors = None
         if tensors_names is not None:
             tensors = {}
             for name in tensors_names:
-                attr = recursive_getattr(self, name)
+                attr = _attr_getter(name)(self)
                 tensors[name] = attr
 
         # Build dict of state_dicts
+        checkpoint_dtype = self.pg_agent_config.checkpoint_dtype
         params_to_save = {}
         for name in state_dicts_names:
-            attr = recursive_getattr(self, name)
+            attr = _attr_getter(name)(self)
             # Retrieve state dict
-            params_to_save[name] = attr.state_dict()
+            params_to_save[name] = _quantize_state_dict(attr.state_dict(), checkpoint_dtype)
 
-        self._save_to_file_zip(path, data=data, params=params_to_save, tensors=tensors)
+        if self.pg_agent_config.pinned_save_staging and th.cuda.is_available():
+            params_to_save, tensors = _stage_to_pinned_cpu((params_to_save, tensors))
+
+        if self.pg_agent_config.torch_checkpoint:
+            self._save_to_file_torch(path, data=data, params=params_to_save, tensors=tensors)
+        else:
+            if self.pg_agent_config.use_safetensors and safetensors is None:
+                self.pg_agent_config.logger.warning("The safetensors package is not installed, saving the tensors "
+                                                    "with th.save instead")
+            self._save_to_file_zip(path, data=data, params=params_to_save, tensors=tensors,
+                                   coalesce_params=self.pg_agent_config.coalesce_zip_params,
+                                   use_safetensors=self.pg_agent_config.use_safetensors)
 
 
 class OffPolicyRLModel(BaseRLModel):
@@ -1017,18 +1855,37 @@ class OffPolicyRLModel(BaseRLModel):
         callback.on_rollout_start()
         continue_training = True
 
+        # Loop invariants, decided once per rollout instead of on every step
+        resample_sde_noise = self.use_sde and self.sde_sample_freq > 0 and n_steps % self.sde_sample_freq == 0
+        sde_at_warmup = self.use_sde and self.use_sde_at_warmup
+        box_action_space = isinstance(self.attacker_action_space, gym.spaces.Box)
+        if type(action_noise) is NormalActionNoise:
+            # Gaussian noise is stateless, so its samples can be drawn in batches
+            action_noise = _NormalNoiseBuffer(action_noise)
+        vec_normalize_env = self._vec_normalize_env
+        env_step = env.step
+        callback_on_step = callback.on_step
+        # Transitions not yet inserted into the replay buffer, one list per field of the buffer
+        pending = ([], [], [], [], [])
+
+        def flush_pending():
+            if len(pending[0]) > 0:
+                replay_buffer.add_batch(*pending)
+                for field in pending:
+                    field.clear()
+
         while total_steps < n_steps or total_episodes < n_episodes:
             done = False
             episode_reward, episode_timesteps = 0.0, 0
 
             while not done:
 
-                if self.use_sde and self.sde_sample_freq > 0 and n_steps % self.sde_sample_freq == 0:
+                if resample_sde_noise:
                     # Sample a new noise matrix
                     self.actor.reset_noise()
 
                 # Select action randomly or according to policy
-                if self.num_timesteps < learning_starts and not (self.use_sde and self.use_sde_at_warmup):
+                if self.num_timesteps < learning_starts and not sde_at_warmup:
                     # Warmup phase
                     unscaled_action = np.array([self.attacker_action_space.sample()])
                 else:
@@ -1037,7 +1894,7 @@ class OffPolicyRLModel(BaseRLModel):
                     unscaled_action, _ = self.predict(self._last_obs, deterministic=False)
 
                 # Rescale the action from [low, high] to [-1, 1]
-                if isinstance(self.attacker_action_space, gym.spaces.Box):
+                if box_action_space:
                     scaled_action = self.policy.scale_action(unscaled_action)
 
                     # Add noise to the action (improve exploration)
@@ -1055,10 +1912,11 @@ class OffPolicyRLModel(BaseRLModel):
                     action = buffer_action
 
                 # Rescale and perform action
-                new_obs, reward, done, infos = env.step(action)
+                new_obs, reward, done, infos = env_step(action)
 
                 # Only stop training if return value is False, not when it is None.
-                if callback.on_step() is False:
+                if callback_on_step() is False:
+                    flush_pending()
                     return RolloutReturn(0.0, total_steps, total_episodes, continue_training=False)
 
                 episode_reward += reward
@@ -1069,18 +1927,23 @@ class OffPolicyRLModel(BaseRLModel):
                 # Store data in replay buffer
                 if replay_buffer is not None:
                     # Store only the unnormalized version
-                    if self._vec_normalize_env is not None:
-                        new_obs_ = self._vec_normalize_env.get_original_obs()
-                        reward_ = self._vec_normalize_env.get_original_reward()
+                    if vec_normalize_env is not None:
+                        new_obs_ = vec_normalize_env.get_original_obs()
+                        reward_ = vec_normalize_env.get_original_reward()
                     else:
                         # Avoid changing the original ones
                         self._last_original_obs, new_obs_, reward_ = self._last_obs, new_obs, reward
 
-                    replay_buffer.add(self._last_original_obs, new_obs_, buffer_action, reward_, done)
+                    # Copy to avoid modification by reference
+                    for field, value in zip(pending, (self._last_original_obs, new_obs_, buffer_action, reward_,
+                                                      done)):
+                        field.append(np.array(value))
+                    if len(pending[0]) == REPLAY_INSERT_BATCH_SIZE:
+                        flush_pending()
 
                 self._last_obs = new_obs
                 # Save the unnormalized observation
-                if self._vec_normalize_env is not None:
+                if vec_normalize_env is not None:
                     self._last_original_obs = new_obs_
 
                 self.num_timesteps += 1
@@ -1102,9 +1965,9 @@ class OffPolicyRLModel(BaseRLModel):
                 if self.verbose >= 1 and log_interval is not None and self._episode_num % log_interval == 0:
                     fps = int(self.num_timesteps / (time.time() - self.start_time))
                     logger.logkv("episodes", self._episode_num)
-                    if len(self.ep_info_buffer) > 0 and len(self.ep_info_buffer[0]) > 0:
-                        logger.logkv('ep_rew_mean', self.safe_mean([ep_info['r'] for ep_info in self.ep_info_buffer]))
-                        logger.logkv('ep_len_mean', self.safe_mean([ep_info['l'] for ep_info in self.ep_info_buffer]))
+                    if self._ep_buf_n > 0:
+                        logger.logkv('ep_rew_mean', self._ep_r_buf[:self._ep_buf_n].mean())
+                        logger.logkv('ep_len_mean', self._ep_l_buf[:self._ep_buf_n].mean())
                     logger.logkv("fps", fps)
                     logger.logkv('time_elapsed', int(time.time() - self.start_time))
                     logger.logkv("total timesteps", self.num_timesteps)
@@ -1115,6 +1978,7 @@ class OffPolicyRLModel(BaseRLModel):
                         logger.logkv('success rate', self.safe_mean(self.ep_success_buffer))
                     logger.dumpkvs()
 
+        flush_pending()
         mean_reward = np.mean(episode_rewards) if total_episodes > 0 else 0.0
 
         callback.on_rollout_end()
@@ -207,6 +207,57 @@ class BaselineEnvWrapper(gym.Env):
                         return False
                 return True
 
+    def attack_legal_mask(self) -> np.ndarray:
+        """
+        Checks the legality of all attack actions of a (non-autoregressive) policy at once
+
+        :return: a boolean array where the index corresponds to the attack action, True if the attack is legal, or
+                 None if the actions must be checked one by one
+        """
+        if self.pg_agent_config.ar_policy:
+            return None
+        legal_mask = self.idsgame_env.attack_legal_mask()
+        if self.idsgame_env.local_view_features():
+            legal_mask = self.local_attack_legal_mask(legal_mask, self.latest_obs[0])
+        if legal_mask is None or len(legal_mask) != self.num_attack_actions:
+            return None
+        return legal_mask
+
+    def local_attack_legal_mask(self, global_legal_mask: np.ndarray, attacker_obs) -> np.ndarray:
+        """
+        Converts the legality mask of the global attack actions to the local attack actions of a local view
+        observation, i.e. the vectorized equivalent of convert_local_attacker_action_to_global for all actions
+
+        :param global_legal_mask: the legality mask of the global attack actions
+        :param attacker_obs: the local view observation of the attacker, one row per neighbor
+        :return: a boolean array where the index corresponds to the local attack action, True if the attack is legal,
+                 or None if the observation can not be converted
+        """
+        game_config = self.idsgame_env.idsgame_config.game_config
+        attacker_obs = np.asarray(attacker_obs)
+        # Local actions address the attack types and the reconnaissance activity of every neighbor
+        if not game_config.reconnaissance_actions or attacker_obs.ndim != 2:
+            return None
+        types_per_node = game_config.num_attack_types + 1
+        target_ids = attacker_obs[:, game_config.num_attack_types].astype(np.int64)
+        global_ids = target_ids[:, np.newaxis] * types_per_node + np.arange(types_per_node)
+        # Neighbor slots without a node (id -1) are never legal, their (wrapped-around) global ids are masked out
+        return (global_legal_mask[global_ids] & (target_ids != -1)[:, np.newaxis]).ravel()
+
+    def defense_legal_mask(self) -> np.ndarray:
+        """
+        Checks the legality of all defense actions of a (non-autoregressive) policy at once
+
+        :return: a boolean array where the index corresponds to the defense action, True if the defense is legal, or
+                 None if the actions must be checked one by one
+        """
+        if self.pg_agent_config.ar_policy:
+            return None
+        legal_mask = self.idsgame_env.defense_legal_mask()
+        if len(legal_mask) != self.num_defense_actions:
+            return None
+        return legal_mask
+
     def hack_probability(self):
         if self.num_games > 0:
             return self.num_hacks / self.num_games
@@ -384,7 +435,7 @@ class BaselineEnvWrapper(gym.Env):
                 if self.pg_agent_config.state_length == 1:
                     return features
                 if len(state) == 0:
-                    s = np.array([features] * self.pg_agent_config.state_length)
+                    s = np.repeat(np.asarray(features)[np.newaxis], self.pg_agent_config.state_length, axis=0)
                     return s
                 state = np.append(state[1:], np.array([features]), axis=0)
                 return state
@@ -421,7 +472,7 @@ class BaselineEnvWrapper(gym.Env):
                 if self.pg_agent_config.state_length == 1:
                     return f
                 if len(state) == 0:
-                    s = np.array([f] * self.pg_agent_config.state_length)
+                    s = np.repeat(np.asarray(f)[np.newaxis], self.pg_agent_config.state_length, axis=0)
                     return s
                 # if not self.idsgame_env.local_view_features() or not attacker:
                 #     temp = np.append(attacker_obs, defender_obs)
@@ -437,9 +488,9 @@ class BaselineEnvWrapper(gym.Env):
                     return np.array(defender_obs)
             if len(state) == 0:
                 if attacker:
-                    return np.array([attacker_obs] * self.pg_agent_config.state_length)
+                    return np.repeat(np.asarray(attacker_obs)[np.newaxis], self.pg_agent_config.state_length, axis=0)
                 else:
-                    return np.array([defender_obs] * self.pg_agent_config.state_length)
+                    return np.repeat(np.asarray(defender_obs)[np.newaxis], self.pg_agent_config.state_length, axis=0)
             if attacker:
                 state = np.append(state[1:], np.array([attacker_obs]), axis=0)
             else:
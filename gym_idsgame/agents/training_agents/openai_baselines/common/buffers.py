@@ -1,4 +1,4 @@
-from typing import Union, Optional, Generator
+from typing import Union, Optional, Generator, Tuple
 
 import numpy as np
 import torch as th
@@ -11,6 +11,34 @@ from gym_idsgame.agents.training_agents.openai_baselines.common.type_aliases imp
     RolloutBufferSamplesARRecurrent, RolloutBufferSamplesARRecurrentMultiHead
 from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
 
+def _compute_gae(rewards: np.ndarray, values: np.ndarray, dones: np.ndarray, last_value: np.ndarray,
+                 last_dones: np.ndarray, gamma: float, gae_lambda: float, advantages: np.ndarray) -> np.ndarray:
+    """
+    Computes the GAE advantages (in-place) and the returns of a full rollout. The TD-residuals and the discount
+    factors of all steps are computed with vectorized operations, only the recurrence
+    ``advantage[t] = delta[t] + gamma * lambda * (1 - done[t+1]) * advantage[t+1]`` is iterated.
+
+    :param rewards: (np.ndarray) the rewards, shape (buffer_size, n_envs)
+    :param values: (np.ndarray) the value estimates, shape (buffer_size, n_envs)
+    :param dones: (np.ndarray) the episode starts, shape (buffer_size, n_envs)
+    :param last_value: (np.ndarray) the value estimate of the observation after the last step
+    :param last_dones: (np.ndarray) the done flags of the last step
+    :param gamma: (float) discount factor
+    :param gae_lambda: (float) factor for trade-off of bias vs variance for Generalized Advantage Estimator
+    :param advantages: (np.ndarray) the array to write the advantages to, shape (buffer_size, n_envs)
+    :return: (np.ndarray) the returns
+    """
+    next_non_terminal = 1.0 - dones[1:]
+    deltas = rewards[:-1] + gamma * values[1:] * next_non_terminal - values[:-1]
+    discounts = gamma * gae_lambda * next_non_terminal
+    last_gae_lam = rewards[-1] + gamma * last_value * (1.0 - last_dones) - values[-1]
+    advantages[-1] = last_gae_lam
+    for step in range(len(deltas) - 1, -1, -1):
+        last_gae_lam = deltas[step] + discounts[step] * last_gae_lam
+        advantages[step] = last_gae_lam
+    return advantages + values
+
+
 class BaseBuffer(object):
     """
     Base class that represent a buffer (rollout or replay)
@@ -23,6 +51,9 @@ class BaseBuffer(object):
     :param n_envs: (int) Number of parallel environments
     """
 
+    # Names of the stored arrays that are flattened for minibatch sampling (rollout buffers)
+    _minibatch_arrays: Tuple[str, ...] = ()
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -84,6 +115,23 @@ class BaseBuffer(object):
         self.pos = 0
         self.full = False
 
+    def normalize_advantages(self) -> None:
+        """
+        Normalize the advantages of the rollout in-place to zero mean and unit (sample) standard deviation,
+        done once for the whole buffer instead of for every minibatch
+
+        :return: None
+        """
+        for name in ["advantages", "node_advantages", "at_advantages"]:
+            advantages = getattr(self, name, None)
+            if advantages is not None:
+                if isinstance(advantages, th.Tensor):
+                    # Already moved to the device by prefetch(), torch.std is the sample standard deviation
+                    std = advantages.std()
+                else:
+                    std = advantages.std(ddof=1)
+                setattr(self, name, (advantages - advantages.mean()) / (std + 1e-8))
+
     def sample(self,
                batch_size: int,
                env: Optional[VecNormalize] = None
@@ -123,6 +171,68 @@ class BaseBuffer(object):
             return th.tensor(array).to(self.device)
         return th.as_tensor(array).to(self.device)
 
+    def prefetch(self) -> None:
+        """
+        Flattens a full rollout for minibatch sampling ahead of the first call to get(). On CUDA devices this
+        enqueues the asynchronous upload of the rollout to the device, so that it overlaps with the work that is
+        already queued on the device, e.g. the optimization of the other agent.
+
+        :return: None
+        """
+        if self.full and not self.generator_ready:
+            self._flatten_for_minibatches(self._minibatch_arrays)
+
+    def _flatten_for_minibatches(self, names: Tuple[str, ...]) -> None:
+        """
+        Flatten the stored arrays of a full rollout for minibatch sampling. On CUDA devices, the flattened arrays
+        are moved to the device once, so that the minibatches of all epochs are gathered on the device instead of
+        being transferred one by one.
+
+        :param names: (Tuple[str, ...]) the names of the stored arrays
+        :return: None
+        """
+        arrays = tuple(self.swap_and_flatten(self.__dict__[name]) for name in names)
+        if th.device(self.device).type == "cuda":
+            arrays = self.batch_to_torch(arrays)
+        for name, array in zip(names, arrays):
+            self.__dict__[name] = array
+        self.generator_ready = True
+
+    def _minibatch_permutation(self) -> Union[np.ndarray, th.Tensor]:
+        """
+        :return: a random permutation of the indices of the stored transitions, on the device on CUDA devices
+            (where the flattened arrays are stored on the device as well)
+        """
+        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        if th.device(self.device).type == "cuda":
+            return th.as_tensor(indices, device=self.device)
+        return indices
+
+    def batch_to_torch(self, data: Tuple[np.ndarray, ...]) -> Tuple[th.Tensor, ...]:
+        """
+        Convert the arrays of a sampled minibatch to PyTorch tensors on the device of the buffer.
+        On CUDA devices, the arrays of each dtype are packed into one pinned host buffer so that the whole
+        minibatch is transferred with a few large (asynchronous) copies instead of one small copy per array.
+
+        :param data: (Tuple[np.ndarray, ...]) the arrays of the minibatch
+        :return: (Tuple[th.Tensor, ...]) the tensors, in the same order and with the same shapes as the arrays
+        """
+        if isinstance(data[0], th.Tensor):
+            # Gathered from arrays that are already stored on the device
+            return tuple(data)
+        if th.device(self.device).type != "cuda":
+            return tuple(map(self.to_torch, data))
+        tensors = [None] * len(data)
+        groups = {}
+        for i, array in enumerate(data):
+            groups.setdefault(array.dtype, []).append(i)
+        for indices in groups.values():
+            flat = np.concatenate([data[i].ravel() for i in indices])
+            device_flat = th.from_numpy(flat).pin_memory().to(self.device, non_blocking=True)
+            for i, chunk in zip(indices, th.split(device_flat, [data[i].size for i in indices])):
+                tensors[i] = chunk.view(data[i].shape)
+        return tuple(tensors)
+
     @staticmethod
     def _normalize_obs(obs: np.ndarray,
                        env: Optional[VecNormalize] = None) -> np.ndarray:
@@ -172,18 +282,44 @@ class ReplayBuffer(BaseBuffer):
             action: np.ndarray,
             reward: np.ndarray,
             done: np.ndarray) -> None:
-        # Copy to avoid modification by reference
-        self.observations[self.pos] = np.array(obs).copy()
-        self.next_observations[self.pos] = np.array(next_obs).copy()
-        self.actions[self.pos] = np.array(action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
+        # Assigning into the preallocated storage copies the data, avoiding modification by reference
+        self.observations[self.pos] = obs
+        self.next_observations[self.pos] = next_obs
+        self.actions[self.pos] = action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
 
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
             self.pos = 0
 
+    def add_batch(self,
+                  obs: np.ndarray,
+                  next_obs: np.ndarray,
+                  action: np.ndarray,
+                  reward: np.ndarray,
+                  done: np.ndarray) -> None:
+        """
+        Add a batch of consecutive transitions with a single assignment per array (wrapping around the end of the
+        buffer), instead of one ``add`` call per transition
+
+        :param obs: (np.ndarray) the observations, the first axis is the batch axis
+        :param next_obs: (np.ndarray) the next observations
+        :param action: (np.ndarray) the actions
+        :param reward: (np.ndarray) the rewards
+        :param done: (np.ndarray) the done flags
+        """
+        n_transitions = len(obs)
+        indices = (self.pos + np.arange(n_transitions)) % self.buffer_size
+        for buffer, values in ((self.observations, obs), (self.next_observations, next_obs),
+                               (self.actions, action), (self.rewards, reward), (self.dones, done)):
+            buffer[indices] = np.asarray(values).reshape((n_transitions,) + buffer.shape[1:])
+
+        if self.pos + n_transitions >= self.buffer_size:
+            self.full = True
+        self.pos = (self.pos + n_transitions) % self.buffer_size
+
     def _get_samples(self,
                      batch_inds: np.ndarray,
                      env: Optional[VecNormalize] = None
@@ -193,7 +329,7 @@ class ReplayBuffer(BaseBuffer):
                 self._normalize_obs(self.next_observations[batch_inds, 0, :], env),
                 self.dones[batch_inds],
                 self._normalize_reward(self.rewards[batch_inds], env))
-        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
+        return ReplayBufferSamples(*self.batch_to_torch(data))
 
 
 class RolloutBuffer(BaseBuffer):
@@ -210,6 +346,8 @@ class RolloutBuffer(BaseBuffer):
     :param n_envs: (int) Number of parallel environments
     """
 
+    _minibatch_arrays = ('observations', 'actions', 'values', 'log_probs', 'advantages', 'returns')
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -258,20 +396,10 @@ class RolloutBuffer(BaseBuffer):
 
         """
         # convert to numpy
-        last_value = last_value.clone().cpu().numpy().flatten()
-
-        last_gae_lam = 0
-        for step in reversed(range(self.buffer_size)):
-            if step == self.buffer_size - 1:
-                next_non_terminal = 1.0 - dones
-                next_value = last_value
-            else:
-                next_non_terminal = 1.0 - self.dones[step + 1]
-                next_value = self.values[step + 1]
-            delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.values[step]
-            last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-            self.advantages[step] = last_gae_lam
-        self.returns = self.advantages + self.values
+        last_value = last_value.cpu().numpy().ravel()
+
+        self.returns = _compute_gae(self.rewards, self.values, self.dones, last_value, dones,
+                                    self.gamma, self.gae_lambda, self.advantages)
 
     def add(self,
             obs: np.ndarray,
@@ -294,25 +422,23 @@ class RolloutBuffer(BaseBuffer):
             # Reshape 0-d tensor to avoid error
             log_prob = log_prob.reshape(-1, 1)
 
-        self.observations[self.pos] = np.array(obs).copy()
-        self.actions[self.pos] = np.array(action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
-        self.values[self.pos] = value.clone().cpu().numpy().flatten()
-        self.log_probs[self.pos] = log_prob.clone().cpu().numpy()
+        # Assigning into the preallocated storage already copies the data, so no intermediate copies are made
+        self.observations[self.pos] = obs
+        self.actions[self.pos] = action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        self.values[self.pos] = value.cpu().numpy().ravel()
+        self.log_probs[self.pos] = log_prob.cpu().numpy()
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
 
     def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamples, None, None]:
         assert self.full, ''
-        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        indices = self._minibatch_permutation()
         # Prepare the data
         if not self.generator_ready:
-            for tensor in ['observations', 'actions', 'values',
-                           'log_probs', 'advantages', 'returns']:
-                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
-            self.generator_ready = True
+            self._flatten_for_minibatches(self._minibatch_arrays)
 
         # Return everything, don't create minibatches
         if batch_size is None:
@@ -331,7 +457,7 @@ class RolloutBuffer(BaseBuffer):
                 self.log_probs[batch_inds].flatten(),
                 self.advantages[batch_inds].flatten(),
                 self.returns[batch_inds].flatten())
-        return RolloutBufferSamples(*tuple(map(self.to_torch, data)))
+        return RolloutBufferSamples(*self.batch_to_torch(data))
 
 
 class RolloutBufferRecurrent(BaseBuffer):
@@ -348,6 +474,9 @@ class RolloutBufferRecurrent(BaseBuffer):
     :param n_envs: (int) Number of parallel environments
     """
 
+    _minibatch_arrays = ('observations', 'actions', 'values', 'log_probs', 'advantages', 'returns', 'h_states',
+                         'c_states', 'dones')
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -402,20 +531,10 @@ class RolloutBufferRecurrent(BaseBuffer):
 
         """
         # convert to numpy
-        last_value = last_value.clone().cpu().numpy().flatten()
-
-        last_gae_lam = 0
-        for step in reversed(range(self.buffer_size)):
-            if step == self.buffer_size - 1:
-                next_non_terminal = 1.0 - dones
-                next_value = last_value
-            else:
-                next_non_terminal = 1.0 - self.dones[step + 1]
-                next_value = self.values[step + 1]
-            delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.values[step]
-            last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-            self.advantages[step] = last_gae_lam
-        self.returns = self.advantages + self.values
+        last_value = last_value.cpu().numpy().ravel()
+
+        self.returns = _compute_gae(self.rewards, self.values, self.dones, last_value, dones,
+                                    self.gamma, self.gae_lambda, self.advantages)
 
     def add(self,
             obs: np.ndarray,
@@ -439,27 +558,24 @@ class RolloutBufferRecurrent(BaseBuffer):
             # Reshape 0-d tensor to avoid error
             log_prob = log_prob.reshape(-1, 1)
 
-        self.observations[self.pos] = np.array(obs).copy()
-        self.actions[self.pos] = np.array(action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
-        self.values[self.pos] = value.clone().cpu().numpy().flatten()
-        self.log_probs[self.pos] = log_prob.clone().cpu().numpy()
-        self.h_states[self.pos] = state[0].clone().cpu().numpy()
-        self.c_states[self.pos] = state[1].clone().cpu().numpy()
+        self.observations[self.pos] = obs
+        self.actions[self.pos] = action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        self.values[self.pos] = value.cpu().numpy().ravel()
+        self.log_probs[self.pos] = log_prob.cpu().numpy()
+        self.h_states[self.pos] = state[0].cpu().numpy()
+        self.c_states[self.pos] = state[1].cpu().numpy()
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
 
     def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesRecurrent, None, None]:
         assert self.full, ''
-        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        indices = self._minibatch_permutation()
         # Prepare the data
         if not self.generator_ready:
-            for tensor in ['observations', 'actions', 'values',
-                           'log_probs', 'advantages', 'returns', 'h_states', 'c_states', 'dones']:
-                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
-            self.generator_ready = True
+            self._flatten_for_minibatches(self._minibatch_arrays)
 
         # Return everything, don't create minibatches
         if batch_size is None:
@@ -482,7 +598,7 @@ class RolloutBufferRecurrent(BaseBuffer):
                 self.c_states[batch_inds],
                 self.dones[batch_inds]
                 )
-        return RolloutBufferSamplesRecurrent(*tuple(map(self.to_torch, data)))
+        return RolloutBufferSamplesRecurrent(*self.batch_to_torch(data))
 
 
 class RolloutBufferRecurrentMultiHead(BaseBuffer):
@@ -499,6 +615,9 @@ class RolloutBufferRecurrentMultiHead(BaseBuffer):
     :param n_envs: (int) Number of parallel environments
     """
 
+    _minibatch_arrays = ('observations_1', 'observations_2', 'observations_3', 'observations_4', 'actions', 'values',
+                         'log_probs', 'advantages', 'returns', 'h_states', 'c_states', 'dones')
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -557,20 +676,10 @@ class RolloutBufferRecurrentMultiHead(BaseBuffer):
 
         """
         # convert to numpy
-        last_value = last_value.clone().cpu().numpy().flatten()
-
-        last_gae_lam = 0
-        for step in reversed(range(self.buffer_size)):
-            if step == self.buffer_size - 1:
-                next_non_terminal = 1.0 - dones
-                next_value = last_value
-            else:
-                next_non_terminal = 1.0 - self.dones[step + 1]
-                next_value = self.values[step + 1]
-            delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.values[step]
-            last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-            self.advantages[step] = last_gae_lam
-        self.returns = self.advantages + self.values
+        last_value = last_value.cpu().numpy().ravel()
+
+        self.returns = _compute_gae(self.rewards, self.values, self.dones, last_value, dones,
+                                    self.gamma, self.gae_lambda, self.advantages)
 
     def add(self,
             obs_1: np.ndarray,
@@ -597,31 +706,27 @@ class RolloutBufferRecurrentMultiHead(BaseBuffer):
             # Reshape 0-d tensor to avoid error
             log_prob = log_prob.reshape(-1, 1)
 
-        self.observations_1[self.pos] = np.array(obs_1).copy()
-        self.observations_2[self.pos] = np.array(obs_2).copy()
-        self.observations_3[self.pos] = np.array(obs_3).copy()
-        self.observations_4[self.pos] = np.array(obs_4).copy()
-        self.actions[self.pos] = np.array(action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
-        self.values[self.pos] = value.clone().cpu().numpy().flatten()
-        self.log_probs[self.pos] = log_prob.clone().cpu().numpy()
-        self.h_states[self.pos] = state[0].clone().cpu().numpy()
-        self.c_states[self.pos] = state[1].clone().cpu().numpy()
+        self.observations_1[self.pos] = obs_1
+        self.observations_2[self.pos] = obs_2
+        self.observations_3[self.pos] = obs_3
+        self.observations_4[self.pos] = obs_4
+        self.actions[self.pos] = action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        self.values[self.pos] = value.cpu().numpy().ravel()
+        self.log_probs[self.pos] = log_prob.cpu().numpy()
+        self.h_states[self.pos] = state[0].cpu().numpy()
+        self.c_states[self.pos] = state[1].cpu().numpy()
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
 
     def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesRecurrentMultiHead, None, None]:
         assert self.full, ''
-        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        indices = self._minibatch_permutation()
         # Prepare the data
         if not self.generator_ready:
-            for tensor in ['observations_1', 'observations_2', 'observations_3', 'observations_4',
-                           'actions', 'values',
-                           'log_probs', 'advantages', 'returns', 'h_states', 'c_states', 'dones']:
-                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
-            self.generator_ready = True
+            self._flatten_for_minibatches(self._minibatch_arrays)
 
         # Return everything, don't create minibatches
         if batch_size is None:
@@ -647,7 +752,7 @@ class RolloutBufferRecurrentMultiHead(BaseBuffer):
                 self.c_states[batch_inds],
                 self.dones[batch_inds]
                 )
-        return RolloutBufferSamplesRecurrentMultiHead(*tuple(map(self.to_torch, data)))
+        return RolloutBufferSamplesRecurrentMultiHead(*self.batch_to_torch(data))
 
 
 class RolloutBufferAR(BaseBuffer):
@@ -664,6 +769,10 @@ class RolloutBufferAR(BaseBuffer):
     :param n_envs: (int) Number of parallel environments
     """
 
+    _minibatch_arrays = ('node_observations', 'node_actions', 'node_values', 'node_log_probs', 'node_advantages',
+                         'node_returns', 'at_actions', 'at_log_probs', 'at_observations', 'at_values', 'at_returns',
+                         'at_advantages')
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -727,33 +836,14 @@ class RolloutBufferAR(BaseBuffer):
 
         """
         # convert to numpy
-        last_value = last_value.clone().cpu().numpy().flatten()
+        last_value = last_value.cpu().numpy().ravel()
 
-        last_gae_lam = 0
         if node:
-            for step in reversed(range(self.buffer_size)):
-                if step == self.buffer_size - 1:
-                    next_non_terminal = 1.0 - dones
-                    next_value = last_value
-                else:
-                    next_non_terminal = 1.0 - self.dones[step + 1]
-                    next_value = self.node_values[step + 1]
-                delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.node_values[step]
-                last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-                self.node_advantages[step] = last_gae_lam
-            self.node_returns = self.node_advantages + self.node_values
+            self.node_returns = _compute_gae(self.rewards, self.node_values, self.dones, last_value, dones,
+                                             self.gamma, self.gae_lambda, self.node_advantages)
         else:
-            for step in reversed(range(self.buffer_size)):
-                if step == self.buffer_size - 1:
-                    next_non_terminal = 1.0 - dones
-                    next_value = last_value
-                else:
-                    next_non_terminal = 1.0 - self.dones[step + 1]
-                    next_value = self.at_values[step + 1]
-                delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.at_values[step]
-                last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-                self.at_advantages[step] = last_gae_lam
-            self.at_returns = self.at_advantages + self.at_values
+            self.at_returns = _compute_gae(self.rewards, self.at_values, self.dones, last_value, dones,
+                                           self.gamma, self.gae_lambda, self.at_advantages)
 
     def add(self,
             node_obs: np.ndarray,
@@ -781,30 +871,26 @@ class RolloutBufferAR(BaseBuffer):
             # Reshape 0-d tensor to avoid error
             node_log_prob = node_log_prob.reshape(-1, 1)
 
-        self.node_observations[self.pos] = np.array(node_obs).copy()
-        self.at_observations[self.pos] = np.array(at_obs).copy()
-        self.node_actions[self.pos] = np.array(node_action).copy()
-        self.at_actions[self.pos] = np.array(at_action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
-        self.node_values[self.pos] = node_value.clone().cpu().numpy().flatten()
-        self.at_values[self.pos] = at_value.clone().cpu().numpy().flatten()
-        self.node_log_probs[self.pos] = node_log_prob.clone().cpu().numpy()
-        self.at_log_probs[self.pos] = at_log_prob.clone().cpu().numpy()
+        self.node_observations[self.pos] = node_obs
+        self.at_observations[self.pos] = at_obs
+        self.node_actions[self.pos] = node_action
+        self.at_actions[self.pos] = at_action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        self.node_values[self.pos] = node_value.cpu().numpy().ravel()
+        self.at_values[self.pos] = at_value.cpu().numpy().ravel()
+        self.node_log_probs[self.pos] = node_log_prob.cpu().numpy()
+        self.at_log_probs[self.pos] = at_log_prob.cpu().numpy()
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
 
     def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesAR, None, None]:
         assert self.full, ''
-        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        indices = self._minibatch_permutation()
         # Prepare the data
         if not self.generator_ready:
-            for tensor in ['node_observations', 'node_actions', 'node_values',
-                           'node_log_probs', 'node_advantages', 'node_returns', 'at_actions', 'at_log_probs', 'at_observations',
-                           'at_values', 'at_returns', 'at_advantages']:
-                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
-            self.generator_ready = True
+            self._flatten_for_minibatches(self._minibatch_arrays)
 
         # Return everything, don't create minibatches
         if batch_size is None:
@@ -830,7 +916,7 @@ class RolloutBufferAR(BaseBuffer):
                 self.at_returns[batch_inds].flatten(),
                 self.at_advantages[batch_inds].flatten()
                 )
-        return RolloutBufferSamplesAR(*tuple(map(self.to_torch, data)))
+        return RolloutBufferSamplesAR(*self.batch_to_torch(data))
 
 
 class RolloutBufferARRecurrent(BaseBuffer):
@@ -847,6 +933,10 @@ class RolloutBufferARRecurrent(BaseBuffer):
     :param n_envs: (int) Number of parallel environments
     """
 
+    _minibatch_arrays = ('node_observations', 'node_actions', 'node_values', 'node_log_probs', 'node_advantages',
+                         'node_returns', 'at_actions', 'at_log_probs', 'at_observations', 'at_values', 'at_returns',
+                         'at_advantages', 'node_h_states', 'node_c_states', 'dones', 'at_h_states', 'at_c_states')
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -924,33 +1014,14 @@ class RolloutBufferARRecurrent(BaseBuffer):
 
         """
         # convert to numpy
-        last_value = last_value.clone().cpu().numpy().flatten()
+        last_value = last_value.cpu().numpy().ravel()
 
-        last_gae_lam = 0
         if node:
-            for step in reversed(range(self.buffer_size)):
-                if step == self.buffer_size - 1:
-                    next_non_terminal = 1.0 - dones
-                    next_value = last_value
-                else:
-                    next_non_terminal = 1.0 - self.dones[step + 1]
-                    next_value = self.node_values[step + 1]
-                delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.node_values[step]
-                last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-                self.node_advantages[step] = last_gae_lam
-            self.node_returns = self.node_advantages + self.node_values
+            self.node_returns = _compute_gae(self.rewards, self.node_values, self.dones, last_value, dones,
+                                             self.gamma, self.gae_lambda, self.node_advantages)
         else:
-            for step in reversed(range(self.buffer_size)):
-                if step == self.buffer_size - 1:
-                    next_non_terminal = 1.0 - dones
-                    next_value = last_value
-                else:
-                    next_non_terminal = 1.0 - self.dones[step + 1]
-                    next_value = self.at_values[step + 1]
-                delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.at_values[step]
-                last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-                self.at_advantages[step] = last_gae_lam
-            self.at_returns = self.at_advantages + self.at_values
+            self.at_returns = _compute_gae(self.rewards, self.at_values, self.dones, last_value, dones,
+                                           self.gamma, self.gae_lambda, self.at_advantages)
 
     def add(self,
             node_obs: np.ndarray,
@@ -979,37 +1050,32 @@ class RolloutBufferARRecurrent(BaseBuffer):
             # Reshape 0-d tensor to avoid error
             node_log_prob = node_log_prob.reshape(-1, 1)
 
-        self.node_observations[self.pos] = np.array(node_obs).copy()
-        self.at_observations[self.pos] = np.array(at_obs).copy()
-        self.node_actions[self.pos] = np.array(node_action).copy()
-        self.at_actions[self.pos] = np.array(at_action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
-        self.node_values[self.pos] = node_value.clone().cpu().numpy().flatten()
-        self.at_values[self.pos] = at_value.clone().cpu().numpy().flatten()
-        self.node_log_probs[self.pos] = node_log_prob.clone().cpu().numpy()
-        self.at_log_probs[self.pos] = at_log_prob.clone().cpu().numpy()
+        self.node_observations[self.pos] = node_obs
+        self.at_observations[self.pos] = at_obs
+        self.node_actions[self.pos] = node_action
+        self.at_actions[self.pos] = at_action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        self.node_values[self.pos] = node_value.cpu().numpy().ravel()
+        self.at_values[self.pos] = at_value.cpu().numpy().ravel()
+        self.node_log_probs[self.pos] = node_log_prob.cpu().numpy()
+        self.at_log_probs[self.pos] = at_log_prob.cpu().numpy()
         if node_state is not None:
-            self.node_h_states[self.pos] = node_state[0].clone().cpu().numpy()
-            self.node_c_states[self.pos] = node_state[1].clone().cpu().numpy()
+            self.node_h_states[self.pos] = node_state[0].cpu().numpy()
+            self.node_c_states[self.pos] = node_state[1].cpu().numpy()
         if at_state is not None:
-            self.at_h_states[self.pos] = at_state[0].clone().cpu().numpy()
-            self.at_c_states[self.pos] = at_state[1].clone().cpu().numpy()
+            self.at_h_states[self.pos] = at_state[0].cpu().numpy()
+            self.at_c_states[self.pos] = at_state[1].cpu().numpy()
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
 
     def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesARRecurrent, None, None]:
         assert self.full, ''
-        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        indices = self._minibatch_permutation()
         # Prepare the data
         if not self.generator_ready:
-            for tensor in ['node_observations', 'node_actions', 'node_values',
-                           'node_log_probs', 'node_advantages', 'node_returns', 'at_actions', 'at_log_probs', 'at_observations',
-                           'at_values', 'at_returns', 'at_advantages', 'node_h_states', 'node_c_states', 'dones',
-                           'at_h_states', 'at_c_states']:
-                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
-            self.generator_ready = True
+            self._flatten_for_minibatches(self._minibatch_arrays)
 
         # Return everything, don't create minibatches
         if batch_size is None:
@@ -1040,7 +1106,7 @@ class RolloutBufferARRecurrent(BaseBuffer):
                 self.at_h_states[batch_inds],
                 self.at_c_states[batch_inds]
                 )
-        return RolloutBufferSamplesARRecurrent(*tuple(map(self.to_torch, data)))
+        return RolloutBufferSamplesARRecurrent(*self.batch_to_torch(data))
 
 
 class RolloutBufferARRecurrentMultiHead(BaseBuffer):
@@ -1057,6 +1123,11 @@ class RolloutBufferARRecurrentMultiHead(BaseBuffer):
     :param n_envs: (int) Number of parallel environments
     """
 
+    _minibatch_arrays = ('node_observations_1', 'node_observations_2', 'node_observations_3', 'node_observations_4',
+                         'node_actions', 'node_values', 'node_log_probs', 'node_advantages', 'node_returns',
+                         'at_actions', 'at_log_probs', 'at_observations', 'at_values', 'at_returns', 'at_advantages',
+                         'node_h_states', 'node_c_states', 'dones', 'at_h_states', 'at_c_states')
+
     def __init__(self,
                  buffer_size: int,
                  observation_space: spaces.Space,
@@ -1128,33 +1199,14 @@ class RolloutBufferARRecurrentMultiHead(BaseBuffer):
 
         """
         # convert to numpy
-        last_value = last_value.clone().cpu().numpy().flatten()
+        last_value = last_value.cpu().numpy().ravel()
 
-        last_gae_lam = 0
         if node:
-            for step in reversed(range(self.buffer_size)):
-                if step == self.buffer_size - 1:
-                    next_non_terminal = 1.0 - dones
-                    next_value = last_value
-                else:
-                    next_non_terminal = 1.0 - self.dones[step + 1]
-                    next_value = self.node_values[step + 1]
-                delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.node_values[step]
-                last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-                self.node_advantages[step] = last_gae_lam
-            self.node_returns = self.node_advantages + self.node_values
+            self.node_returns = _compute_gae(self.rewards, self.node_values, self.dones, last_value, dones,
+                                             self.gamma, self.gae_lambda, self.node_advantages)
         else:
-            for step in reversed(range(self.buffer_size)):
-                if step == self.buffer_size - 1:
-                    next_non_terminal = 1.0 - dones
-                    next_value = last_value
-                else:
-                    next_non_terminal = 1.0 - self.dones[step + 1]
-                    next_value = self.at_values[step + 1]
-                delta = self.rewards[step] + self.gamma * next_value * next_non_terminal - self.at_values[step]
-                last_gae_lam = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae_lam
-                self.at_advantages[step] = last_gae_lam
-            self.at_returns = self.at_advantages + self.at_values
+            self.at_returns = _compute_gae(self.rewards, self.at_values, self.dones, last_value, dones,
+                                           self.gamma, self.gae_lambda, self.at_advantages)
 
     def add(self,
             node_obs_1: np.ndarray,
@@ -1186,41 +1238,35 @@ class RolloutBufferARRecurrentMultiHead(BaseBuffer):
             # Reshape 0-d tensor to avoid error
             node_log_prob = node_log_prob.reshape(-1, 1)
 
-        self.node_observations_1[self.pos] = np.array(node_obs_1).copy()
-        self.node_observations_2[self.pos] = np.array(node_obs_2).copy()
-        self.node_observations_3[self.pos] = np.array(node_obs_3).copy()
-        self.node_observations_4[self.pos] = np.array(node_obs_4).copy()
-        self.at_observations[self.pos] = np.array(at_obs).copy()
-        self.node_actions[self.pos] = np.array(node_action).copy()
-        self.at_actions[self.pos] = np.array(at_action).copy()
-        self.rewards[self.pos] = np.array(reward).copy()
-        self.dones[self.pos] = np.array(done).copy()
-        self.node_values[self.pos] = node_value.clone().cpu().numpy().flatten()
-        self.at_values[self.pos] = at_value.clone().cpu().numpy().flatten()
-        self.node_log_probs[self.pos] = node_log_prob.clone().cpu().numpy()
-        self.at_log_probs[self.pos] = at_log_prob.clone().cpu().numpy()
+        self.node_observations_1[self.pos] = node_obs_1
+        self.node_observations_2[self.pos] = node_obs_2
+        self.node_observations_3[self.pos] = node_obs_3
+        self.node_observations_4[self.pos] = node_obs_4
+        self.at_observations[self.pos] = at_obs
+        self.node_actions[self.pos] = node_action
+        self.at_actions[self.pos] = at_action
+        self.rewards[self.pos] = reward
+        self.dones[self.pos] = done
+        self.node_values[self.pos] = node_value.cpu().numpy().ravel()
+        self.at_values[self.pos] = at_value.cpu().numpy().ravel()
+        self.node_log_probs[self.pos] = node_log_prob.cpu().numpy()
+        self.at_log_probs[self.pos] = at_log_prob.cpu().numpy()
         if node_state is not None:
-            self.node_h_states[self.pos] = node_state[0].clone().cpu().numpy()
-            self.node_c_states[self.pos] = node_state[1].clone().cpu().numpy()
+            self.node_h_states[self.pos] = node_state[0].cpu().numpy()
+            self.node_c_states[self.pos] = node_state[1].cpu().numpy()
         if at_state is not None:
-            self.at_h_states[self.pos] = at_state[0].clone().cpu().numpy()
-            self.at_c_states[self.pos] = at_state[1].clone().cpu().numpy()
+            self.at_h_states[self.pos] = at_state[0].cpu().numpy()
+            self.at_c_states[self.pos] = at_state[1].cpu().numpy()
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
 
     def get(self, batch_size: Optional[int] = None) -> Generator[RolloutBufferSamplesARRecurrentMultiHead, None, None]:
         assert self.full, ''
-        indices = np.random.permutation(self.buffer_size * self.n_envs)
+        indices = self._minibatch_permutation()
         # Prepare the data
         if not self.generator_ready:
-            for tensor in ['node_observations_1', 'node_observations_2', 'node_observations_3', 'node_observations_4',
-                           'node_actions', 'node_values',
-                           'node_log_probs', 'node_advantages', 'node_returns', 'at_actions', 'at_log_probs', 'at_observations',
-                           'at_values', 'at_returns', 'at_advantages', 'node_h_states', 'node_c_states', 'dones',
-                           'at_h_states', 'at_c_states']:
-                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
-            self.generator_ready = True
+            self._flatten_for_minibatches(self._minibatch_arrays)
 
         # Return everything, don't create minibatches
         if batch_size is None:
@@ -1254,4 +1300,4 @@ class RolloutBufferARRecurrentMultiHead(BaseBuffer):
                 self.at_h_states[batch_inds],
                 self.at_c_states[batch_inds]
                 )
-        return RolloutBufferSamplesARRecurrentMultiHead(*tuple(map(self.to_torch, data)))
\ No newline at end of file
+        return RolloutBufferSamplesARRecurrentMultiHead(*self.batch_to_torch(data))
\ No newline at end of file
@@ -1,3 +1,4 @@
+import threading
 import time
 from typing import List, Tuple, Type, Union, Callable, Optional, Dict, Any
 
@@ -6,7 +7,6 @@ from gym import spaces
 import torch as th
 import torch.nn.functional as F
 import copy
-from scipy.special import softmax
 # Check if tensorboard is available for pytorch
 # TODO: finish tensorboard integration
 # try:
@@ -21,11 +21,14 @@ from gym_idsgame.agents.training_agents.openai_baselines.common.type_aliases imp
 from gym_idsgame.agents.training_agents.openai_baselines.common.buffers import RolloutBuffer, RolloutBufferRecurrent, \
     RolloutBufferRecurrentMultiHead, RolloutBufferAR, RolloutBufferARRecurrent, RolloutBufferARRecurrentMultiHead
 from gym_idsgame.agents.training_agents.openai_baselines.common.utils import get_schedule_fn
+from stable_baselines3.common.preprocessing import get_action_dim
 
 from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.base_vec_env import VecEnv
 from gym_idsgame.agents.training_agents.openai_baselines.common.callbacks import BaseCallback
 from gym_idsgame.agents.training_agents.openai_baselines.common.ppo.ppo_policies import PPOPolicy
 from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
+from gym_idsgame.agents.dao.experiment_result import ExperimentResult
+from gym_idsgame.agents.training_agents.common.opponent_pool import OpponentPool
 from gym_idsgame.agents.training_agents.openai_baselines.common.common_policies import (BasePolicy, register_policy, MlpExtractor,
                                                                                      create_sde_features_extractor, NatureCNN,
                                                                                      BaseFeaturesExtractor, FlattenExtractor)
@@ -109,9 +112,11 @@ class PPO(BaseRLModel):
                  device: Union[th.device, str] = 'auto',
                  _init_setup_model: bool = True,
                  pg_agent_config : PolicyGradientAgentConfig = None):
+        # The rollouts step a single, in-process idsgame env: the legality masks of the policies and the bot
+        # opponents of the pools query that env object directly, so it cannot be moved to worker processes
         super(PPO, self).__init__(policy, env, PPOPolicy, learning_rate, policy_kwargs=policy_kwargs,
                                   verbose=verbose, device=device, use_sde=use_sde, sde_sample_freq=sde_sample_freq,
-                                  create_eval_env=create_eval_env, support_multi_env=True, seed=seed,
+                                  create_eval_env=create_eval_env, support_multi_env=False, seed=seed,
                                   pg_agent_config=pg_agent_config)
 
         self.batch_size = batch_size
@@ -132,28 +137,27 @@ class PPO(BaseRLModel):
         self.iteration = 0
         self.train_attacker = True
         self.train_defender = True
+        # Whether the policies have been trained since they were last saved, and the thread that writes the results
+        # of the last checkpoint
+        self._attacker_updated = True
+        self._defender_updated = True
+        self._results_writer = None
         if self.pg_agent_config is not None and self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None:
-            self.attacker_pool = []
-            self.defender_pool = []
+            self.attacker_pool = OpponentPool(self.pg_agent_config.opponent_pool_config)
+            self.defender_pool = OpponentPool(self.pg_agent_config.opponent_pool_config)
             self.train_attacker = True
             self.train_defender = False
             if self.pg_agent_config.baselines_in_pool:
+                game_config = self.env.envs[0].idsgame_env.idsgame_config.game_config
                 if self.pg_agent_config.opponent_pool_config.quality_scores:
-                    self.defender_pool.append([DefendMinimalValueBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config), self.pg_agent_config.opponent_pool_config.initial_quality])
-                    self.defender_pool.append(
-                        [RandomDefenseBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config), self.pg_agent_config.opponent_pool_config.initial_quality])
-                    self.attacker_pool.append(
-                        [AttackMaximalValueBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config, self.env.envs[0].idsgame_env),
-                         self.pg_agent_config.opponent_pool_config.initial_quality])
-                    self.attacker_pool.append(
-                        [RandomAttackBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config,
-                                                    self.env.envs[0].idsgame_env),
-                         self.pg_agent_config.opponent_pool_config.initial_quality])
+                    self.defender_pool.append(DefendMinimalValueBotAgent(game_config))
+                    self.defender_pool.append(RandomDefenseBotAgent(game_config))
+                    self.attacker_pool.append(AttackMaximalValueBotAgent(game_config, self.env.envs[0].idsgame_env))
+                    self.attacker_pool.append(RandomAttackBotAgent(game_config, self.env.envs[0].idsgame_env))
                 else:
-                    self.defender_pool.append(DefendMinimalValueBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config))
-                    self.defender_pool.append([RandomDefenseBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config)])
-                    self.attacker_pool.append(RandomAttackBotAgent(self.env.envs[0].idsgame_env.idsgame_config.game_config,
-                                                    self.env.envs[0].idsgame_env))
+                    self.defender_pool.append(DefendMinimalValueBotAgent(game_config))
+                    self.defender_pool.append(RandomDefenseBotAgent(game_config))
+                    self.attacker_pool.append(RandomAttackBotAgent(game_config, self.env.envs[0].idsgame_env))
                 #self.attacker_pool.append()
         try:
             self.tensorboard_writer = SummaryWriter(self.pg_agent_config.tensorboard_dir)
@@ -333,6 +337,19 @@ class PPO(BaseRLModel):
                                                 **self.policy_kwargs)
             self.attacker_at_policy_opponent = self.attacker_at_policy_opponent.to(self.device)
 
+        self._maybe_compile_policies()
+        self._maybe_enable_cuda_graphs()
+
+        # The type of the action space is fixed during training, the joint actions are written to a reused buffer
+        self._clip_actions = isinstance(self.attacker_action_space, gym.spaces.Box)
+        self._discrete_actions = isinstance(self.attacker_action_space, gym.spaces.Discrete)
+        # Discrete actions are stored as floats in the rollout buffer and cast back to long when training
+        self._long_cast_actions = isinstance(self.attacker_action_space, spaces.Discrete)
+        # A single dtype that holds the actions of both agents, so the joint actions never degrade to an object array
+        joint_actions_dtype = np.result_type(self.attacker_action_space.dtype, self.defender_action_space.dtype)
+        self._joint_actions_buf = np.zeros((self.n_envs, 2, get_action_dim(self.attacker_action_space)),
+                                           dtype=joint_actions_dtype)
+
         self.clip_range = get_schedule_fn(self.clip_range)
         if self.clip_range_vf is not None:
             if isinstance(self.clip_range_vf, (float, int)):
@@ -341,21 +358,20 @@ class PPO(BaseRLModel):
 
             self.clip_range_vf = get_schedule_fn(self.clip_range_vf)
 
+        # The clip range schedules are evaluated from their start and end values like the learning rate schedules
+        self._clip_range_linear = self._linear_schedule_ends(self.clip_range)
+        self._clip_range_vf_linear = self._linear_schedule_ends(self.clip_range_vf) \
+            if self.clip_range_vf is not None else None
+
         if self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None:
             self.add_model_to_pool(attacker=True)
             self.add_model_to_pool(attacker=False)
 
-            self.defender_opponent_idx = self.sample_opponent(attacker=False)
-            if self.pg_agent_config.opponent_pool_config.quality_scores:
-                self.defender_opponent = self.defender_pool[self.defender_opponent_idx][0]
-            else:
-                self.defender_opponent = self.defender_pool[self.defender_opponent_idx]
+            self.defender_opponent_idx = self.defender_pool.sample()
+            self.defender_opponent = self._pool_opponent(self.defender_opponent_idx, attacker=False)
 
-            self.attacker_opponent_idx = self.sample_opponent(attacker=True)
-            if self.pg_agent_config.opponent_pool_config.quality_scores:
-                self.attacker_opponent = self.attacker_pool[self.attacker_opponent_idx][0]
-            else:
-                self.attacker_opponent = self.attacker_pool[self.attacker_opponent_idx]
+            self.attacker_opponent_idx = self.attacker_pool.sample()
+            self.attacker_opponent = self._pool_opponent(self.attacker_opponent_idx, attacker=True)
 
 
     def predict(self, observation: np.ndarray,
@@ -447,12 +463,10 @@ class PPO(BaseRLModel):
         if not self.pg_agent_config.multi_channel_obs:
             assert self._last_obs_a is not None, "No previous attacker observation was provided"
         else:
-            assert self._last_obs_a_a is not None, "No previous attacker observation was provided"
-            assert self._last_obs_a_d is not None, "No previous attacker observation was provided"
-            assert self._last_obs_a_p is not None, "No previous attacker observation was provided"
-            assert self._last_obs_a_r is not None, "No previous attacker observation was provided"
+            assert self._last_obs_channels is not None, "No previous attacker observation was provided"
         assert self._last_obs_d is not None, "No previous defender observation was provided"
         n_steps = 0
+        self._set_training_mode(False)
         if self.pg_agent_config.attacker:
             attacker_rollout_buffer.reset()
         if self.pg_agent_config.defender:
@@ -473,15 +487,19 @@ class PPO(BaseRLModel):
                     self.defender_node_policy.reset_noise(env.num_envs)
                     self.defender_at_policy.reset_noise(env.num_envs)
 
-        # Avg metrics
-        episode_attacker_rewards = []
-        episode_defender_rewards = []
-        episode_steps = []
+        # Per step metrics, reduced to per episode metrics at the end of the rollout
+        attacker_reward_buf = np.zeros((n_rollout_steps, env.num_envs), dtype=np.float32)
+        defender_reward_buf = np.zeros((n_rollout_steps, env.num_envs), dtype=np.float32)
+        done_buf = np.zeros((n_rollout_steps, env.num_envs), dtype=np.bool_)
 
-        # Per episode metrics
-        episode_attacker_reward = 0
-        episode_defender_reward = 0
-        episode_step = 0
+        batch_pool_updates = self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None \
+                             and self.pg_agent_config.batch_opponent_pool_updates
+        if batch_pool_updates:
+            # At most one attacker and one defender opponent draw per step
+            pool_draws = np.random.rand(2 * n_rollout_steps * env.num_envs)
+            pool_draw_idx = 0
+            attacker_quality_deltas = np.zeros(len(self.attacker_pool))
+            defender_quality_deltas = np.zeros(len(self.defender_pool))
 
         callback.on_rollout_start()
         force_rec = False
@@ -501,7 +519,9 @@ class PPO(BaseRLModel):
                         self.defender_node_policy.reset_noise(env.num_envs)
                         self.defender_at_policy.reset_noise(env.num_envs)
 
-            with th.no_grad():
+            # Inference mode also skips the version counter bookkeeping of no_grad, none of the tensors created
+            # here are used by autograd (the rollout buffers store numpy copies)
+            with th.inference_mode():
 
                 # Default actions
                 attacker_actions = [0]
@@ -509,16 +529,14 @@ class PPO(BaseRLModel):
 
                 # Convert to pytorch tensor
                 if not self.pg_agent_config.multi_channel_obs:
-                    obs_tensor_a = th.as_tensor(self._last_obs_a).to(self.device)
-                    obs_tensor_d = th.as_tensor(self._last_obs_d).to(self.device)
+                    obs_tensor_a = self._obs_as_tensor(self._last_obs_a, "attacker")
+                    obs_tensor_d = self._obs_as_tensor(self._last_obs_d, "defender")
                 else:
-                    obs_tensor_a = th.as_tensor(self._last_obs_a).to(self.device)
-                    obs_tensor_a_a = th.as_tensor(self._last_obs_a_a).to(self.device)
-                    obs_tensor_a_d = th.as_tensor(self._last_obs_a_d).to(self.device)
-                    obs_tensor_a_p = th.as_tensor(self._last_obs_a_p).to(self.device)
-                    obs_tensor_a_r = th.as_tensor(self._last_obs_a_r).to(self.device)
+                    obs_tensor_a = self._obs_as_tensor(self._last_obs_a, "attacker")
+                    obs_tensor_a_a, obs_tensor_a_d, obs_tensor_a_p, obs_tensor_a_r = \
+                        self._channels_as_tensors(self._last_obs_channels[0:4], "attacker_channels")
 
-                    obs_tensor_d = th.as_tensor(self._last_obs_d[0]).to(self.device)
+                    obs_tensor_d = self._obs_as_tensor(self._last_obs_d[0], "defender")
                 if self.pg_agent_config.attacker and self.train_attacker:
                     if not self.pg_agent_config.ar_policy:
                         if not self.pg_agent_config.multi_channel_obs:
@@ -528,7 +546,7 @@ class PPO(BaseRLModel):
                             attacker_actions, attacker_values, attacker_log_probs, lstm_state = self.attacker_policy.forward(
                                 (obs_tensor_a_a, obs_tensor_a_d, obs_tensor_a_p, obs_tensor_a_r), self.env.envs[0],
                                 device=self.device, attacker=True, force_rec=force_rec)
-                        attacker_actions = attacker_actions.cpu().numpy()
+                        attacker_actions = self._actions_as_numpy(attacker_actions, "attacker_actions")
                     else:
                         if not self.pg_agent_config.attacker_node_net_multi_channel:
                             attacker_node_actions, attacker_node_values, attacker_node_log_probs, attacker_node_lstm_state = self.attacker_node_policy.forward(
@@ -536,13 +554,13 @@ class PPO(BaseRLModel):
                         else:
                             attacker_node_actions, attacker_node_values, attacker_node_log_probs, attacker_node_lstm_state = self.attacker_node_policy.forward(
                                 (obs_tensor_a_a, obs_tensor_a_d, obs_tensor_a_p, obs_tensor_a_r), self.env.envs[0], device=self.device, attacker=True, force_rec=force_rec)
-                        attacker_node_actions = attacker_node_actions.cpu().numpy()
+                        attacker_node_actions = self._actions_as_numpy(attacker_node_actions, "attacker_node_actions")
                         node = attacker_node_actions[0]
                         obs_tensor_a_1 = obs_tensor_a.reshape(self.env.envs[0].idsgame_env.idsgame_config.game_config.num_nodes, self.pg_agent_config.attacker_at_net_input_dim)
                         obs_tensor_a_at = obs_tensor_a_1[node].float()
                         attacker_at_actions, attacker_at_values, attacker_at_log_probs, attacker_at_lstm_state = self.attacker_at_policy.forward(
                             obs_tensor_a_at, self.env.envs[0], device=self.device, attacker=True, force_rec=force_rec)
-                        attacker_at_actions = attacker_at_actions.cpu().numpy()
+                        attacker_at_actions = self._actions_as_numpy(attacker_at_actions, "attacker_at_actions")
                         attack_id = idsgame_util.get_attack_action_id(node, attacker_at_actions[0], self.env.envs[0].idsgame_env.idsgame_config.game_config)
                         attacker_actions = np.array([attack_id])
                     force_rec = False
@@ -551,11 +569,11 @@ class PPO(BaseRLModel):
                         if isinstance(self.defender_opponent, PPOPolicy):
                             defender_actions, defender_values, defender_log_probs, lstm_state = self.defender_opponent.forward(
                                 obs_tensor_d, self.env.envs[0], device=self.device, attacker=False)
-                            defender_actions = defender_actions.cpu().numpy()
+                            defender_actions = self._actions_as_numpy(defender_actions, "defender_actions")
                         elif isinstance(self.defender_opponent, tuple) and isinstance(self.defender_opponent[0], PPOPolicy):
                             defender_node_actions, defender_node_values, defender_node_log_probs, defender_node_lstm_state = self.defender_opponent[0].forward(
                                 obs_tensor_d, self.env.envs[0], device=self.device, attacker=False)
-                            defender_node_actions = defender_node_actions.cpu().numpy()
+                            defender_node_actions = self._actions_as_numpy(defender_node_actions, "defender_node_actions")
                             node = defender_node_actions[0]
                             obs_tensor_d_1 = obs_tensor_d.reshape(
                                 self.env.envs[0].idsgame_env.idsgame_config.game_config.num_nodes,
@@ -563,7 +581,7 @@ class PPO(BaseRLModel):
                             obs_tensor_d_at = obs_tensor_d_1[node].float()
                             defender_at_actions, defender_at_values, defender_at_log_probs, defender_at_lstm_state = self.defender_opponent[1].forward(
                                 obs_tensor_d_at, self.env.envs[0], device=self.device, attacker=False)
-                            defender_at_actions = defender_at_actions.cpu().numpy()
+                            defender_at_actions = self._actions_as_numpy(defender_at_actions, "defender_at_actions")
                             defense_id = idsgame_util.get_defense_action_id(node, defender_at_actions[0], self.env.envs[
                                 0].idsgame_env.idsgame_config.game_config)
                             defender_actions = np.array([defense_id])
@@ -575,11 +593,11 @@ class PPO(BaseRLModel):
                     if not self.pg_agent_config.ar_policy:
                         defender_actions, defender_values, defender_log_probs, lstm_state = self.defender_policy.forward(
                             obs_tensor_d,  self.env.envs[0], device=self.device, attacker=False)
-                        defender_actions = defender_actions.cpu().numpy()
+                        defender_actions = self._actions_as_numpy(defender_actions, "defender_actions")
                     else:
                         defender_node_actions, defender_node_values, defender_node_log_probs, defender_node_lstm_state = self.defender_node_policy.forward(
                             obs_tensor_d, self.env.envs[0], device=self.device, attacker=False)
-                        defender_node_actions = defender_node_actions.cpu().numpy()
+                        defender_node_actions = self._actions_as_numpy(defender_node_actions, "defender_node_actions")
                         node = defender_node_actions[0]
                         obs_tensor_d_1 = obs_tensor_d.reshape(
                             self.env.envs[0].idsgame_env.idsgame_config.game_config.num_nodes,
@@ -587,7 +605,7 @@ class PPO(BaseRLModel):
                         obs_tensor_d_at = obs_tensor_d_1[node].float()
                         defender_at_actions, defender_at_values, defender_at_log_probs, defender_at_lstm_state = self.defender_at_policy.forward(
                             obs_tensor_d_at, self.env.envs[0], device=self.device, attacker=False)
-                        defender_at_actions = defender_at_actions.cpu().numpy()
+                        defender_at_actions = self._actions_as_numpy(defender_at_actions, "defender_at_actions")
                         defense_id = idsgame_util.get_defense_action_id(node, defender_at_actions[0], self.env.envs[0].idsgame_env.idsgame_config.game_config)
                         defender_actions = np.array([defense_id])
 
@@ -600,7 +618,7 @@ class PPO(BaseRLModel):
                                 attacker_actions, attacker_values, attacker_log_probs, lstm_state = self.attacker_opponent.forward(
                                     (obs_tensor_a_a, obs_tensor_a_d, obs_tensor_a_p, obs_tensor_a_r),
                                     self.env.envs[0], device=self.device, attacker=True)
-                            attacker_actions = attacker_actions.cpu().numpy()
+                            attacker_actions = self._actions_as_numpy(attacker_actions, "attacker_actions")
                         elif isinstance(self.attacker_opponent, tuple) and isinstance(self.attacker_opponent[0], PPOPolicy):
                             if not self.pg_agent_config.attacker_node_net_multi_channel:
                                 attacker_node_actions, attacker_node_values, attacker_node_log_probs, attacker_node_lstm_state = self.attacker_opponent[0].forward(
@@ -610,7 +628,7 @@ class PPO(BaseRLModel):
                                 attacker_node_actions, attacker_node_values, attacker_node_log_probs, attacker_node_lstm_state = self.attacker_opponent[0].forward(
                                     (obs_tensor_a_a, obs_tensor_a_d, obs_tensor_a_p, obs_tensor_a_r), self.env.envs[0],
                                     device=self.device, attacker=True, force_rec=force_rec)
-                            attacker_node_actions = attacker_node_actions.cpu().numpy()
+                            attacker_node_actions = self._actions_as_numpy(attacker_node_actions, "attacker_node_actions")
                             node = attacker_node_actions[0]
                             obs_tensor_a_1 = obs_tensor_a.reshape(
                                 self.env.envs[0].idsgame_env.idsgame_config.game_config.num_nodes,
@@ -618,7 +636,7 @@ class PPO(BaseRLModel):
                             obs_tensor_a_at = obs_tensor_a_1[node].float()
                             attacker_at_actions, attacker_at_values, attacker_at_log_probs, attacker_at_lstm_state = self.attacker_opponent[1].forward(
                                 obs_tensor_a_at, self.env.envs[0], device=self.device, attacker=True, force_rec=force_rec)
-                            attacker_at_actions = attacker_at_actions.cpu().numpy()
+                            attacker_at_actions = self._actions_as_numpy(attacker_at_actions, "attacker_at_actions")
                             attack_id = idsgame_util.get_attack_action_id(node, attacker_at_actions[0], self.env.envs[
                                 0].idsgame_env.idsgame_config.game_config)
                             attacker_actions = np.array([attack_id])
@@ -627,14 +645,16 @@ class PPO(BaseRLModel):
                             attacker_actions = np.array([action])
 
             # Rescale and perform action
-            clipped_attacker_actions = attacker_actions
-            clipped_defender_actions = defender_actions
-            # Clip the attacker_actions to avoid out of bound error
-            if isinstance(self.attacker_action_space, gym.spaces.Box):
-                clipped_attacker_actions = np.clip(attacker_actions, self.attacker_action_space.low, self.attacker_action_space.high)
-                clipped_defender_actions = np.clip(defender_actions, self.attacker_action_space.low, self.attacker_action_space.high)
-
-            joint_actions = np.array([[clipped_attacker_actions, clipped_defender_actions]])
+            joint_actions = self._joint_actions_buf
+            if self._clip_actions:
+                # Clip the attacker_actions to avoid out of bound error
+                np.clip(np.reshape(attacker_actions, -1), self.attacker_action_space.low,
+                        self.attacker_action_space.high, out=joint_actions[0, 0])
+                np.clip(np.reshape(defender_actions, -1), self.attacker_action_space.low,
+                        self.attacker_action_space.high, out=joint_actions[0, 1])
+            else:
+                joint_actions[0, 0] = attacker_actions
+                joint_actions[0, 1] = defender_actions
             new_a_obs, new_d_obs, a_rewards, d_rewards, dones, infos = env.step(joint_actions, update_stats=True)
             #print("infos:{}".format(infos))
             if self.pg_agent_config.force_exploration and infos[0]["moved"] == True:
@@ -642,18 +662,21 @@ class PPO(BaseRLModel):
                     force_rec = True
 
             if callback.on_step() is False:
+                if batch_pool_updates:
+                    self.attacker_pool.apply_quality_score_deltas(attacker_quality_deltas)
+                    self.defender_pool.apply_quality_score_deltas(defender_quality_deltas)
                 return False
 
 
             # Record step metrics
             self._update_info_buffer(infos)
+            attacker_reward_buf[n_steps] = a_rewards
+            defender_reward_buf[n_steps] = d_rewards
+            done_buf[n_steps] = dones
             n_steps += 1
             self.num_timesteps += env.num_envs
-            episode_attacker_reward += a_rewards
-            episode_defender_reward += d_rewards
-            episode_step +=1
 
-            if isinstance(self.attacker_action_space, gym.spaces.Discrete):
+            if self._discrete_actions:
                 # Reshape in case of discrete action
                 if self.pg_agent_config.attacker:
                     attacker_actions = attacker_actions.reshape(-1, 1)
@@ -669,8 +692,7 @@ class PPO(BaseRLModel):
                             elif self.pg_agent_config.lstm_core and not self.pg_agent_config.multi_channel_obs:
                                 attacker_rollout_buffer.add(self._last_obs_a, attacker_actions, a_rewards, dones, attacker_values, attacker_log_probs, lstm_state)
                             else:
-                                attacker_rollout_buffer.add(self._last_obs_a_a, self._last_obs_a_d, self._last_obs_a_p,
-                                                            self._last_obs_a_r,
+                                attacker_rollout_buffer.add(*self._last_obs_channels[0:4],
                                                             attacker_actions, a_rewards, dones,
                                                             attacker_values, attacker_log_probs, lstm_state)
                         else:
@@ -690,8 +712,7 @@ class PPO(BaseRLModel):
                                                             attacker_node_lstm_state,
                                                             attacker_at_lstm_state)
                             else:
-                                attacker_rollout_buffer.add(self._last_obs_a_a, self._last_obs_a_d,
-                                                            self._last_obs_a_p, self._last_obs_a_r,
+                                attacker_rollout_buffer.add(*self._last_obs_channels[0:4],
                                                             obs_tensor_a_at.cpu(), attacker_node_actions,
                                                             a_rewards, dones,
                                                             attacker_node_values, attacker_node_log_probs,
@@ -708,8 +729,7 @@ class PPO(BaseRLModel):
                             attacker_rollout_buffer.add(self._last_obs_a, attacker_actions, a_rewards, dones,
                                                         attacker_values, attacker_log_probs, lstm_state)
                         else:
-                            attacker_rollout_buffer.add(self._last_obs_a_a, self._last_obs_a_d,
-                                                        self._last_obs_a_p, self._last_obs_a_r,
+                            attacker_rollout_buffer.add(*self._last_obs_channels[0:4],
                                                         attacker_actions, a_rewards, dones,
                                                         attacker_values, attacker_log_probs, lstm_state)
                     else:
@@ -725,8 +745,7 @@ class PPO(BaseRLModel):
                                                         attacker_at_log_probs, attacker_at_values, attacker_node_lstm_state,
                                                         attacker_at_lstm_state)
                         else:
-                            attacker_rollout_buffer.add(self._last_obs_a_a, self._last_obs_a_d,
-                                                        self._last_obs_a_p, self._last_obs_a_r, obs_tensor_a_at.cpu(), attacker_node_actions,
+                            attacker_rollout_buffer.add(*self._last_obs_channels[0:4], obs_tensor_a_at.cpu(), attacker_node_actions,
                                                         a_rewards, dones,
                                                         attacker_node_values, attacker_node_log_probs,
                                                         attacker_at_actions,
@@ -771,27 +790,60 @@ class PPO(BaseRLModel):
                 self._last_obs_a = new_a_obs
                 self._last_obs_d = new_d_obs
             else:
-                self._last_obs_a_a = new_a_obs[0]
-                self._last_obs_a_d = new_a_obs[1]
-                self._last_obs_a_p = new_a_obs[2]
-                self._last_obs_a_r = new_a_obs[3]
+                self._last_obs_channels = new_a_obs
                 self._last_obs_a = new_a_obs[4]
 
                 self._last_obs_d = new_d_obs[0]
 
-            if dones:
-                # Record episode metrics
-                self.num_train_games += 1
-                self.num_train_games_total += 1
-                if env.envs[0].prev_episode_hacked:
-                    self.num_train_hacks += 1
-                    self.num_train_hacks_total += 1
-                episode_attacker_rewards.append(episode_attacker_reward)
-                episode_defender_rewards.append(episode_defender_reward)
-                episode_steps.append(episode_step)
-                episode_attacker_reward = 0
-                episode_defender_reward = 0
-                episode_step = 0
+            # Episode accounting is done per finished environment, the attribute lookups are only done for the
+            # environments whose episode ended
+            done_idxs = np.flatnonzero(dones)
+            if len(done_idxs) > 0:
+                for episode_hacked in env.get_attr("prev_episode_hacked", indices=done_idxs):
+                    # Record episode metrics
+                    self.num_train_games += 1
+                    self.num_train_games_total += 1
+                    if episode_hacked:
+                        self.num_train_hacks += 1
+                        self.num_train_hacks_total += 1
+
+                    # Update opponent pool qualities
+                    if self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None \
+                            and self.pg_agent_config.opponent_pool_config.quality_scores:
+                        if self.train_attacker and self.defender_opponent_idx is not None and episode_hacked:
+                            if batch_pool_updates:
+                                defender_quality_deltas[self.defender_opponent_idx] += \
+                                    self.defender_pool.quality_score_delta(self.defender_opponent_idx)
+                            else:
+                                self.defender_pool.update_quality_score(self.defender_opponent_idx)
+                        if self.train_defender and self.attacker_opponent_idx is not None and not episode_hacked:
+                            if batch_pool_updates:
+                                attacker_quality_deltas[self.attacker_opponent_idx] += \
+                                    self.attacker_pool.quality_score_delta(self.attacker_opponent_idx)
+                            else:
+                                self.attacker_pool.update_quality_score(self.attacker_opponent_idx)
+
+                    # Sample new opponents
+                    if self.pg_agent_config.alternating_optimization and self.pg_agent_config.opponent_pool:
+                        if self.pg_agent_config.attacker and self.train_attacker:
+                            if batch_pool_updates:
+                                pool_draw = pool_draws[pool_draw_idx]
+                                pool_draw_idx += 1
+                            else:
+                                pool_draw = np.random.rand()
+                            if pool_draw < self.pg_agent_config.opponent_pool_config.pool_prob:
+                                self.defender_opponent_idx = self.defender_pool.sample()
+                                self.defender_opponent = self._pool_opponent(self.defender_opponent_idx, attacker=False)
+
+                        if self.pg_agent_config.defender and self.train_defender:
+                            if batch_pool_updates:
+                                pool_draw = pool_draws[pool_draw_idx]
+                                pool_draw_idx += 1
+                            else:
+                                pool_draw = np.random.rand()
+                            if pool_draw < self.pg_agent_config.opponent_pool_config.pool_prob:
+                                self.attacker_opponent_idx = self.attacker_pool.sample()
+                                self.attacker_opponent = self._pool_opponent(self.attacker_opponent_idx, attacker=True)
 
                 if self.pg_agent_config.lstm_core:
                     # Reset LSTM state
@@ -811,33 +863,6 @@ class PPO(BaseRLModel):
                         self.defender_node_policy.mlp_extractor.lstm_hidden = (th.zeros(self.pg_agent_config.num_lstm_layers, 1, self.pg_agent_config.lstm_hidden_dim),th.zeros(self.pg_agent_config.num_lstm_layers, 1, self.pg_agent_config.lstm_hidden_dim))
                         self.defender_at_policy.mlp_extractor.lstm_hidden = (th.zeros(self.pg_agent_config.num_lstm_layers, 1, self.pg_agent_config.lstm_hidden_dim),th.zeros(self.pg_agent_config.num_lstm_layers, 1, self.pg_agent_config.lstm_hidden_dim))
 
-                # Update opponent pool qualities
-                if self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None \
-                        and self.pg_agent_config.opponent_pool_config.quality_scores:
-                    if self.train_attacker and self.defender_opponent_idx is not None and env.envs[0].prev_episode_hacked:
-                        self.update_quality_score(self.defender_opponent_idx, attacker=False)
-                    if self.train_defender and self.attacker_opponent_idx is not None and not env.envs[0].prev_episode_hacked:
-                        self.update_quality_score(self.attacker_opponent_idx, attacker=True)
-
-                # Sample new opponents
-                if self.pg_agent_config.alternating_optimization and self.pg_agent_config.opponent_pool:
-                    if self.pg_agent_config.attacker and self.train_attacker:
-                        if np.random.rand() < self.pg_agent_config.opponent_pool_config.pool_prob:
-                            self.defender_opponent_idx = self.sample_opponent(attacker=False)
-                            if self.pg_agent_config.opponent_pool_config.quality_scores:
-                                self.defender_opponent = self.defender_pool[self.defender_opponent_idx][0]
-                            else:
-                                self.defender_opponent = self.defender_pool[self.defender_opponent_idx]
-
-                    if self.pg_agent_config.defender and self.train_defender:
-                        if np.random.rand() < self.pg_agent_config.opponent_pool_config.pool_prob:
-                            self.attacker_opponent_idx = self.sample_opponent(attacker=True)
-                            if self.pg_agent_config.opponent_pool_config.quality_scores:
-                                self.attacker_opponent = self.attacker_pool[self.attacker_opponent_idx][0]
-                            else:
-                                self.attacker_opponent = self.attacker_pool[self.attacker_opponent_idx]
-
-
         if self.pg_agent_config.attacker:
             if not self.pg_agent_config.ar_policy:
                 if self.pg_agent_config.alternating_optimization and self.pg_agent_config.opponent_pool:
@@ -871,9 +896,43 @@ class PPO(BaseRLModel):
 
         callback.on_rollout_end()
 
+        if batch_pool_updates:
+            self.attacker_pool.apply_quality_score_deltas(attacker_quality_deltas)
+            self.defender_pool.apply_quality_score_deltas(defender_quality_deltas)
+
+        episode_attacker_rewards, episode_defender_rewards, episode_steps = \
+            self._episode_metrics(attacker_reward_buf, defender_reward_buf, done_buf)
         return True, episode_attacker_rewards, episode_defender_rewards, episode_steps
 
+    @staticmethod
+    def _episode_metrics(attacker_rewards: np.ndarray, defender_rewards: np.ndarray,
+                         dones: np.ndarray) -> Tuple[List[float], List[float], List[int]]:
+        """
+        Computes the rewards and lengths of the episodes that finished during a rollout from the per-step metrics.
+        The first episode is only counted from the start of the rollout, and the unfinished episode at the end of
+        the rollout is not included.
+
+        :param attacker_rewards: (np.ndarray) attacker rewards of the rollout steps, shape (n_steps, 1)
+        :param defender_rewards: (np.ndarray) defender rewards of the rollout steps, shape (n_steps, 1)
+        :param dones: (np.ndarray) done flags of the rollout steps, shape (n_steps, 1)
+        :return: the attacker rewards, defender rewards and number of steps of the finished episodes
+        """
+        episode_ends = np.flatnonzero(dones.reshape(-1))
+        if len(episode_ends) == 0:
+            return [], [], []
+        episode_starts = np.concatenate(([0], episode_ends[:-1] + 1))
+        n_steps = episode_ends[-1] + 1
+        episode_attacker_rewards = np.add.reduceat(attacker_rewards.reshape(-1)[:n_steps], episode_starts)
+        episode_defender_rewards = np.add.reduceat(defender_rewards.reshape(-1)[:n_steps], episode_starts)
+        episode_steps = episode_ends - episode_starts + 1
+        return episode_attacker_rewards.tolist(), episode_defender_rewards.tolist(), episode_steps.tolist()
+
     def train(self, n_epochs: int, batch_size: int = 64, attacker=True) -> None:
+        self._set_training_mode(True)
+        if attacker:
+            self._attacker_updated = True
+        else:
+            self._defender_updated = True
         # Update optimizer learning rate
         if attacker:
             if not self.pg_agent_config.ar_policy:
@@ -895,12 +954,19 @@ class PPO(BaseRLModel):
                 lr = self.defender_at_policy.optimizer.param_groups[0]["lr"]
 
         # Compute current clip range
-        clip_range = self.clip_range(self._current_progress)
+        clip_range = self._scheduled_value(self._clip_range_linear, self.clip_range)
         # Optional: clip range for the value function
         if self.clip_range_vf is not None:
-            clip_range_vf = self.clip_range_vf(self._current_progress)
+            clip_range_vf = self._scheduled_value(self._clip_range_vf_linear, self.clip_range_vf)
 
-        entropy_losses, all_kl_divs = [], []
+        rollout_advantage_normalization = self.pg_agent_config.rollout_advantage_normalization
+        if rollout_advantage_normalization:
+            if attacker:
+                self.attacker_rollout_buffer.normalize_advantages()
+            else:
+                self.defender_rollout_buffer.normalize_advantages()
+
+        entropy_losses = []
         pg_losses, value_losses = [], []
         clip_fractions = []
 
@@ -915,7 +981,7 @@ class PPO(BaseRLModel):
             for rollout_data in rollout_buffer.get(batch_size):
                 if not self.pg_agent_config.ar_policy:
                     actions = rollout_data.actions
-                    if isinstance(self.attacker_action_space, spaces.Discrete):
+                    if self._long_cast_actions:
                         # Convert discrete action from float to long
                         actions = rollout_data.actions.long().flatten()
                 else:
@@ -1019,47 +1085,42 @@ class PPO(BaseRLModel):
                     values = values.flatten()
                     # Normalize advantage
                     advantages = rollout_data.advantages
-                    advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
+                    if not rollout_advantage_normalization:
+                        advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
 
                     # ratio between old and new policy, should be one at the first iteration
                     ratio = th.exp(log_prob - rollout_data.old_log_prob)
                     # clipped surrogate loss
-                    policy_loss_1 = advantages * ratio
-                    policy_loss_2 = advantages * th.clamp(ratio, 1 - clip_range, 1 + clip_range)
-                    policy_loss = -th.min(policy_loss_1, policy_loss_2).mean()
+                    policy_loss = self._clipped_surrogate_loss(advantages, ratio, clip_range)
 
                     # Logging
-                    pg_losses.append(policy_loss.item())
-                    clip_fraction = th.mean((th.abs(ratio - 1) > clip_range).float()).item()
+                    pg_losses.append(policy_loss.detach())
+                    clip_fraction = th.mean((th.abs(ratio - 1) > clip_range).float())
                     clip_fractions.append(clip_fraction)
                 else:
                     node_values = node_values.flatten()
                     at_values = at_values.flatten()
                     # Normalize advantage
                     node_advantages = rollout_data.node_advantages
-                    node_advantages = (node_advantages - node_advantages.mean()) / (node_advantages.std() + 1e-8)
-
                     at_advantages = rollout_data.at_advantages
-                    at_advantages = (at_advantages - at_advantages.mean()) / (at_advantages.std() + 1e-8)
+                    if not rollout_advantage_normalization:
+                        node_advantages = (node_advantages - node_advantages.mean()) / (node_advantages.std() + 1e-8)
+                        at_advantages = (at_advantages - at_advantages.mean()) / (at_advantages.std() + 1e-8)
 
 
                     # node loss
                     node_ratio = th.exp(node_log_prob - rollout_data.node_old_log_prob)
 
-                    node_loss_1 = node_advantages * node_ratio
-                    node_loss_2 = node_advantages * th.clamp(node_ratio, 1 - clip_range, 1 + clip_range)
-                    node_loss = -th.min(node_loss_1, node_loss_2).mean()
+                    node_loss = self._clipped_surrogate_loss(node_advantages, node_ratio, clip_range)
 
                     # at loss
                     at_ratio = th.exp(at_log_prob - rollout_data.at_old_log_prob)
 
-                    at_loss_1 = at_advantages * at_ratio
-                    at_loss_2 = at_advantages * th.clamp(at_ratio, 1 - clip_range, 1 + clip_range)
-                    at_loss = -th.min(at_loss_1, at_loss_2).mean()
+                    at_loss = self._clipped_surrogate_loss(at_advantages, at_ratio, clip_range)
 
                     # Logging
-                    pg_losses.append(node_loss.item() + at_loss.item())
-                    clip_fraction = th.mean((th.abs(at_ratio - 1) > clip_range).float()).item()
+                    pg_losses.append(th.stack([node_loss, at_loss]).detach())
+                    clip_fraction = th.mean((th.abs(at_ratio - 1) > clip_range).float())
                     clip_fractions.append(clip_fraction)
 
 
@@ -1074,7 +1135,7 @@ class PPO(BaseRLModel):
                                                                          clip_range_vf)
                     # Value loss using the TD(gae_lambda) target
                     value_loss = F.mse_loss(rollout_data.returns, values_pred)
-                    value_losses.append(value_loss.item())
+                    value_losses.append(value_loss.detach())
                 else:
                     if self.clip_range_vf is None:
                         # No clipping
@@ -1091,7 +1152,7 @@ class PPO(BaseRLModel):
                     node_value_loss = F.mse_loss(rollout_data.node_returns, node_values_pred)
                     at_value_loss = F.mse_loss(rollout_data.at_returns, at_values_pred)
 
-                    value_losses.append(node_value_loss.item() + at_value_loss.item())
+                    value_losses.append(th.stack([node_value_loss, at_value_loss]).detach())
 
                 # Entropy loss favor exploration
                 if not self.pg_agent_config.ar_policy:
@@ -1101,66 +1162,100 @@ class PPO(BaseRLModel):
                     else:
                         entropy_loss = -th.mean(entropy)
 
-                    entropy_losses.append(entropy_loss.item())
+                    entropy_losses.append(entropy_loss.detach())
                     loss = policy_loss + self.ent_coef * entropy_loss + self.vf_coef * value_loss
                 else:
                     entropy_loss_node = -th.mean(node_entropy)
                     entropy_loss_at = -th.mean(at_entropy)
 
-                    entropy_losses.append(entropy_loss_node.item() + entropy_loss_at.item())
+                    entropy_losses.append(th.stack([entropy_loss_node, entropy_loss_at]).detach())
                     node_loss = node_loss + self.ent_coef * entropy_loss_node + self.vf_coef * node_value_loss
                     at_loss = at_loss + self.ent_coef * entropy_loss_at + self.vf_coef * at_value_loss
 
                 # Optimization step
                 if attacker:
                     if not self.pg_agent_config.ar_policy:
-                        self.attacker_policy.optimizer.zero_grad()
+                        self.attacker_policy.optimizer.zero_grad(set_to_none=True)
                     else:
-                        self.attacker_node_policy.optimizer.zero_grad()
-                        self.attacker_at_policy.optimizer.zero_grad()
+                        self.attacker_node_policy.optimizer.zero_grad(set_to_none=True)
+                        self.attacker_at_policy.optimizer.zero_grad(set_to_none=True)
                 else:
                     if not self.pg_agent_config.ar_policy:
-                        self.defender_policy.optimizer.zero_grad()
+                        self.defender_policy.optimizer.zero_grad(set_to_none=True)
                     else:
-                        self.defender_node_policy.optimizer.zero_grad()
-                        self.defender_at_policy.optimizer.zero_grad()
+                        self.defender_node_policy.optimizer.zero_grad(set_to_none=True)
+                        self.defender_at_policy.optimizer.zero_grad(set_to_none=True)
 
                 if not self.pg_agent_config.ar_policy:
                     loss.backward()
                     # Clip grad norm
                     if attacker:
-                        th.nn.utils.clip_grad_norm_(self.attacker_policy.parameters(), self.max_grad_norm)
+                        th.nn.utils.clip_grad_norm_(self.attacker_policy.parameters(), self.max_grad_norm, foreach=True)
                         self.attacker_policy.optimizer.step()
                     else:
-                        th.nn.utils.clip_grad_norm_(self.defender_policy.parameters(), self.max_grad_norm)
+                        th.nn.utils.clip_grad_norm_(self.defender_policy.parameters(), self.max_grad_norm, foreach=True)
                         self.defender_policy.optimizer.step()
-                    approx_kl_divs.append(th.mean(rollout_data.old_log_prob - log_prob).detach().cpu().numpy())
+                    approx_kl_divs.append(th.mean(rollout_data.old_log_prob - log_prob).detach())
                 else:
                     node_loss.backward()
                     if attacker:
-                        th.nn.utils.clip_grad_norm_(self.attacker_node_policy.parameters(), self.max_grad_norm)
+                        th.nn.utils.clip_grad_norm_(self.attacker_node_policy.parameters(), self.max_grad_norm, foreach=True)
                         self.attacker_node_policy.optimizer.step()
                     else:
-                        th.nn.utils.clip_grad_norm_(self.defender_node_policy.parameters(), self.max_grad_norm)
+                        th.nn.utils.clip_grad_norm_(self.defender_node_policy.parameters(), self.max_grad_norm, foreach=True)
                         self.defender_node_policy.optimizer.step()
                     at_loss.backward()
                     if attacker:
-                        th.nn.utils.clip_grad_norm_(self.attacker_at_policy.parameters(), self.max_grad_norm)
+                        th.nn.utils.clip_grad_norm_(self.attacker_at_policy.parameters(), self.max_grad_norm, foreach=True)
                         self.attacker_at_policy.optimizer.step()
                     else:
-                        th.nn.utils.clip_grad_norm_(self.defender_at_policy.parameters(), self.max_grad_norm)
+                        th.nn.utils.clip_grad_norm_(self.defender_at_policy.parameters(), self.max_grad_norm, foreach=True)
                         self.defender_at_policy.optimizer.step()
 
-                    approx_kl_divs.append(th.mean(rollout_data.node_old_log_prob - node_log_prob).detach().cpu().numpy())
+                    approx_kl_divs.append(th.mean(rollout_data.node_old_log_prob - node_log_prob).detach())
 
-            all_kl_divs.append(np.mean(approx_kl_divs))
-
-            if self.target_kl is not None and np.mean(approx_kl_divs) > 1.5 * self.target_kl:
-                print(f"Early stopping at step {epoch} due to reaching max kl: {np.mean(approx_kl_divs):.2f}")
-                break
+            # The statistics are kept as tensors during the epoch, the approximate KL divergence is only transferred
+            # from the device (a single sync per epoch) when it is needed for early stopping
+            if self.target_kl is not None:
+                approx_kl_div = np.mean(th.stack(approx_kl_divs).cpu().numpy())
+                if approx_kl_div > 1.5 * self.target_kl:
+                    print(f"Early stopping at step {epoch} due to reaching max kl: {approx_kl_div:.2f}")
+                    break
 
         self._n_updates += n_epochs
-        return np.mean(entropy_losses), np.mean(pg_losses), np.mean(value_losses), lr
+        return self._minibatch_mean(entropy_losses), self._minibatch_mean(pg_losses), \
+               self._minibatch_mean(value_losses), lr
+
+    @staticmethod
+    def _clipped_surrogate_loss(advantages: th.Tensor, ratio: th.Tensor, clip_range: float) -> th.Tensor:
+        """
+        Computes the clipped surrogate loss ``-min(advantages * ratio, advantages * clamp(ratio)).mean()`` of PPO.
+        The minimum of the two terms only depends on the sign of the advantage (the ratio is only clipped from above
+        for positive advantages and from below for negative ones), so it is selected with a single ``th.where``
+        instead of materializing both terms.
+
+        :param advantages: (th.Tensor) the (normalized) advantages
+        :param ratio: (th.Tensor) the probability ratios between the new and old policy
+        :param clip_range: (float) the clipping parameter
+        :return: (th.Tensor) the loss
+        """
+        clipped_ratio = th.where(advantages > 0, ratio.clamp(max=1 + clip_range), ratio.clamp(min=1 - clip_range))
+        return -(advantages * clipped_ratio).mean()
+
+    @staticmethod
+    def _minibatch_mean(stats: List[th.Tensor]) -> float:
+        """
+        Averages a training statistic over the minibatches, the per-minibatch values are transferred from the device
+        with a single sync. Statistics that are the sum of the node and attack-type networks (autoregressive policy)
+        are stacked per minibatch and summed here.
+
+        :param stats: the per-minibatch values of the statistic (0-d tensors, or pairs for the autoregressive policy)
+        :return: the mean of the statistic
+        """
+        stacked = th.stack(stats).cpu().numpy().astype(np.float64)
+        if stacked.ndim > 1:
+            stacked = stacked.sum(axis=1)
+        return np.mean(stacked)
 
     def learn(self,
               total_timesteps: int,
@@ -1187,31 +1282,47 @@ class PPO(BaseRLModel):
         print("Starting training, max time steps:{}".format(total_timesteps))
         self.pg_agent_config.logger.info(self.pg_agent_config.to_str())
 
+        # The training configuration does not change during training, so it is read once before the loop
+        attacker = self.pg_agent_config.attacker
+        defender = self.pg_agent_config.defender
+        opponent_pool = self.pg_agent_config.opponent_pool
+        update_opponent_pool = opponent_pool and self.pg_agent_config.opponent_pool_config is not None
+        if update_opponent_pool:
+            pool_increment_period = self.pg_agent_config.opponent_pool_config.pool_increment_period
+        alternating_optimization = self.pg_agent_config.alternating_optimization
+        alternating_period = self.pg_agent_config.alternating_period
+        train_log_frequency = self.pg_agent_config.train_log_frequency
+        checkpoint_freq = self.pg_agent_config.checkpoint_freq
+
         # Tracking metrics
+        num_log_ticks = total_timesteps // (self.n_steps * self.n_envs * train_log_frequency) + 1
+        self.train_result.preallocate(len(self.train_result.avg_episode_steps) + num_log_ticks)
 
-        # Avg metrics
-        episode_attacker_rewards = []
-        episode_defender_rewards = []
-        episode_steps = []
-        episode_avg_attacker_loss = []
-        episode_avg_defender_loss = []
+        # Avg metrics, the attacker rewards, defender rewards and lengths of the episodes since the last log tick are
+        # written to a preallocated array (a rollout finishes at most n_steps episodes per environment)
+        episode_metrics = np.zeros((3, self.n_steps * self.n_envs * train_log_frequency))
+        num_episodes = 0
         attacker_lr = 0.0
         defender_lr = 0.0
 
-        if self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None:
+        if update_opponent_pool:
             attacker_pool_iteration = 0
             defender_pool_iteration = 0
 
-        if self.pg_agent_config.alternating_optimization:
+        if alternating_optimization:
             optimization_iteration = 0
 
         while self.num_timesteps < total_timesteps:
             continue_training, rollouts_attacker_rewards, rollouts_defender_rewards, rollouts_steps = \
                 self.collect_rollouts(self.env, callback, self.attacker_rollout_buffer, self.defender_rollout_buffer,
                                       n_rollout_steps=self.n_steps)
-            episode_attacker_rewards.extend(rollouts_attacker_rewards)
-            episode_defender_rewards.extend(rollouts_defender_rewards)
-            episode_steps.extend(rollouts_defender_rewards)
+            num_rollout_episodes = len(rollouts_steps)
+            if num_episodes + num_rollout_episodes > episode_metrics.shape[1]:
+                episode_metrics = np.concatenate(
+                    (episode_metrics, np.zeros((3, max(episode_metrics.shape[1], num_rollout_episodes)))), axis=1)
+            episode_metrics[:, num_episodes:num_episodes + num_rollout_episodes] = \
+                (rollouts_attacker_rewards, rollouts_defender_rewards, rollouts_steps)
+            num_episodes += num_rollout_episodes
 
             if continue_training is False:
                 break
@@ -1220,7 +1331,7 @@ class PPO(BaseRLModel):
             self._update_current_progress(self.num_timesteps, total_timesteps)
 
             # Display training infos
-            if self.iteration % self.pg_agent_config.train_log_frequency == 0:
+            if self.iteration % train_log_frequency == 0:
                 if self.num_train_games > 0 and self.num_train_games_total > 0:
                     self.train_hack_probability = self.num_train_hacks / self.num_train_games
                     self.train_cumulative_hack_probability = self.num_train_hacks_total / self.num_train_games_total
@@ -1229,85 +1340,115 @@ class PPO(BaseRLModel):
                     self.train_cumulative_hack_probability = 0.0
                 a_pool = 0
                 d_pool = 0
-                if self.pg_agent_config.alternating_optimization and self.pg_agent_config.opponent_pool:
+                if alternating_optimization and opponent_pool:
                     a_pool = len(self.attacker_pool)
                     d_pool = len(self.defender_pool)
                 self.log_metrics(iteration=self.iteration, result=self.train_result,
-                                 attacker_episode_rewards=episode_attacker_rewards,
-                                 defender_episode_rewards=episode_defender_rewards, episode_steps=episode_steps,
-                                 episode_avg_attacker_loss=episode_avg_attacker_loss,
-                                 episode_avg_defender_loss=episode_avg_defender_loss,
-                                 eval=False, update_stats=True, lr_attacker=self.lr_schedule_a(self._current_progress),
-                                 lr_defender=self.lr_schedule_d(self._current_progress),
+                                 attacker_episode_rewards=episode_metrics[0, :num_episodes],
+                                 defender_episode_rewards=episode_metrics[1, :num_episodes],
+                                 episode_steps=episode_metrics[2, :num_episodes],
+                                 eval=False, update_stats=True, lr_attacker=self._current_lr(attacker=True),
+                                 lr_defender=self._current_lr(attacker=False),
                                  total_num_episodes=self.num_train_games_total,
-                                 train_attacker=(self.pg_agent_config.attacker and self.train_attacker),
-                                 train_defender=(self.pg_agent_config.defender and self.train_defender),
+                                 train_attacker=(attacker and self.train_attacker),
+                                 train_defender=(defender and self.train_defender),
                                  a_pool=a_pool, d_pool=d_pool
                                  )
-                episode_attacker_rewards = []
-                episode_defender_rewards = []
-                episode_avg_attacker_loss = []
-                episode_avg_defender_loss = []
-                episode_steps = []
+                num_episodes = 0
                 self.num_train_games = 0
                 self.num_train_hacks = 0
 
-                if self.pg_agent_config.alternating_optimization and self.pg_agent_config.opponent_pool:
+                if alternating_optimization and opponent_pool:
                     if self.train_attacker:
                         attacker_pool_iteration += 1
                     if self.train_defender:
                         defender_pool_iteration += 1
 
-                if self.pg_agent_config.alternating_optimization:
+                if alternating_optimization:
                     optimization_iteration += 1
 
                 # If using opponent pool, update the pool
-                if self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None:
+                if update_opponent_pool:
                     if self.train_defender:
-                        if defender_pool_iteration > self.pg_agent_config.opponent_pool_config.pool_increment_period:
+                        if defender_pool_iteration > pool_increment_period:
                             self.add_model_to_pool(attacker=False)
                             defender_pool_iteration = 0
 
                     if self.train_attacker:
-                        if attacker_pool_iteration > self.pg_agent_config.opponent_pool_config.pool_increment_period:
+                        if attacker_pool_iteration > pool_increment_period:
                             self.add_model_to_pool(attacker=True)
                             attacker_pool_iteration = 0
 
 
             # Save models every <self.config.checkpoint_frequency> iterations
-            if self.iteration % self.pg_agent_config.checkpoint_freq == 0:
+            if self.iteration % checkpoint_freq == 0:
                 self.save_model()
                 if self.pg_agent_config.save_dir is not None:
-                    time_str = str(time.time())
-                    self.train_result.to_csv(
-                        self.pg_agent_config.save_dir + "/" + time_str + "_train_results_checkpoint.csv")
-                    self.eval_result.to_csv(self.pg_agent_config.save_dir + "/" + time_str + "_eval_results_checkpoint.csv")
-
-            if self.pg_agent_config.attacker and self.train_attacker:
+                    self._save_results_checkpoint()
+
+            # Both rollouts are prepared before the first optimization starts, on CUDA devices the upload of the
+            # defender rollout thereby overlaps with the optimization of the attacker
+            if attacker and self.train_attacker:
+                self.attacker_rollout_buffer.prefetch()
+            if defender and self.train_defender:
+                self.defender_rollout_buffer.prefetch()
+            if attacker and self.train_attacker:
                 entropy_loss, pg_loss, value_loss, attacker_lr = self.train(self.n_epochs, batch_size=self.batch_size, attacker=True)
-                episode_avg_attacker_loss.append(entropy_loss + pg_loss + value_loss)
-            if self.pg_agent_config.defender and self.train_defender:
+                self.record_loss(entropy_loss + pg_loss + value_loss, attacker=True)
+            if defender and self.train_defender:
                 entropy_loss, pg_loss, value_loss, defender_lr = self.train(self.n_epochs, batch_size=self.batch_size, attacker=False)
-                episode_avg_defender_loss.append(entropy_loss + pg_loss + value_loss)
+                self.record_loss(entropy_loss + pg_loss + value_loss, attacker=False)
 
             # If doing alternating optimization and the alternating period is up, change agent that is optimized
-            if self.pg_agent_config.alternating_optimization:
+            if alternating_optimization:
                 print("optimization_iteration:{}".format(optimization_iteration))
-                if self.train_attacker and optimization_iteration > self.pg_agent_config.alternating_period:
+                if self.train_attacker and optimization_iteration > alternating_period:
                     print("switch training to defender")
                     self.train_attacker = False
                     self.train_defender = True
                     optimization_iteration = 0
-                elif self.train_defender and optimization_iteration > self.pg_agent_config.alternating_period:
+                elif self.train_defender and optimization_iteration > alternating_period:
                     print("switch training to attacker")
                     self.train_attacker = True
                     self.train_defender = False
                     optimization_iteration = 0
 
+        self._wait_for_results_writer()
         callback.on_training_end()
 
         return self
 
+    def _save_results_checkpoint(self) -> None:
+        """
+        Saves the train and eval results to csv files in the save directory. The results are copied on the calling
+        thread and written by a background thread, so that the training loop does not wait for the file I/O.
+
+        :return: None
+        """
+        self._wait_for_results_writer()
+        time_str = str(time.time())
+        checkpoints = [(self.pg_agent_config.save_dir + "/" + time_str + "_train_results_checkpoint.csv",)
+                       + tuple(self.train_result.csv_columns()),
+                       (self.pg_agent_config.save_dir + "/" + time_str + "_eval_results_checkpoint.csv",)
+                       + tuple(self.eval_result.csv_columns())]
+
+        def write_checkpoints():
+            for file_path, labels, columns in checkpoints:
+                ExperimentResult.write_csv(file_path, labels, columns)
+
+        self._results_writer = threading.Thread(target=write_checkpoints, daemon=True)
+        self._results_writer.start()
+
+    def _wait_for_results_writer(self) -> None:
+        """
+        Waits until the results of the last checkpoint have been written
+
+        :return: None
+        """
+        if getattr(self, "_results_writer", None) is not None:
+            self._results_writer.join()
+            self._results_writer = None
+
     def get_torch_variables(self, attacker:bool = True) -> Tuple[List[str], List[str]]:
         """
         cf base class
@@ -1327,13 +1468,15 @@ class PPO(BaseRLModel):
 
     def save_model(self) -> None:
         """
-        Saves the PyTorch Model Weights
+        Saves the PyTorch Model Weights. With checkpoint_updated_policies_only, the policy of an agent is only saved
+        if it has been trained since it was last saved.
 
         :return: None
         """
         time_str = str(time.time())
+        updated_only = self.pg_agent_config.checkpoint_updated_policies_only
         if self.pg_agent_config.save_dir is not None:
-            if self.pg_agent_config.attacker:
+            if self.pg_agent_config.attacker and (self._attacker_updated or not updated_only):
                 if not self.pg_agent_config.ar_policy:
                     path = self.pg_agent_config.save_dir + "/" + time_str + "_attacker_policy_network.zip"
                     self.pg_agent_config.logger.info("Saving attacker policy-network to: {}".format(path))
@@ -1342,7 +1485,8 @@ class PPO(BaseRLModel):
                     path = self.pg_agent_config.save_dir + "/" + time_str + "_attacker_node_at_policy_network.zip"
                     self.pg_agent_config.logger.info("Saving attacker node and at policy-network to: {}".format(path))
                     self.save(path, exclude=["tensorboard_writer", "attacker_pool", "defender_pool"], attacker=True)
-            if self.pg_agent_config.defender:
+                self._attacker_updated = False
+            if self.pg_agent_config.defender and (self._defender_updated or not updated_only):
                 if not self.pg_agent_config.ar_policy:
                     path = self.pg_agent_config.save_dir + "/" + time_str + "_defender_policy_network.zip"
                     self.pg_agent_config.logger.info("Saving defender policy-network to: {}".format(path))
@@ -1351,6 +1495,7 @@ class PPO(BaseRLModel):
                     path = self.pg_agent_config.save_dir + "/" + time_str + "_defender_node_policy_network.zip"
                     self.pg_agent_config.logger.info("Saving defender node and at policy-network to: {}".format(path))
                     self.save(path, exclude=["tensorboard_writer", "attacker_pool", "defender_pool"], attacker=False)
+                self._defender_updated = False
         else:
             self.pg_agent_config.logger.warning("Save path not defined, not saving policy-networks to disk")
             print("Save path not defined, not saving policy-networks to disk")
@@ -1364,104 +1509,85 @@ class PPO(BaseRLModel):
         :return: None
         """
         if self.pg_agent_config.opponent_pool and self.pg_agent_config.opponent_pool_config is not None:
+            # Only the parameters are kept in the pool, they are loaded into a scratch policy when sampled
             if attacker:
                 if not self.pg_agent_config.ar_policy:
-                    model_copy = copy.deepcopy(self.attacker_policy)
-                else:
-                    self.attacker_node_policy_opponent.load_state_dict(self.attacker_node_policy.state_dict())
-                    self.attacker_at_policy_opponent.load_state_dict(self.attacker_at_policy.state_dict())
-                    model_copy = (copy.deepcopy(self.attacker_node_policy_opponent),
-                                  copy.deepcopy(self.attacker_at_policy_opponent))
-                    #model_copy = (copy.deepcopy(self.attacker_node_policy), copy.deepcopy(self.attacker_at_policy))
-                if len(self.attacker_pool) >= self.pg_agent_config.opponent_pool_config.pool_maxsize:
-                    self.attacker_pool.pop(0)
-                if self.pg_agent_config.opponent_pool_config.quality_scores:
-                    if len(self.attacker_pool) == 0:
-                        self.attacker_pool.append([model_copy, self.pg_agent_config.opponent_pool_config.initial_quality])
-                    elif len(self.attacker_pool) > 0:
-                        qualities = self.get_attacker_pool_quality_scores()
-                        max_q = max(qualities)
-                        self.attacker_pool.append([model_copy, max_q])
+                    model_copy = self._policy_snapshot(self.attacker_policy)
                 else:
-                    self.attacker_pool.append(model_copy)
+                    model_copy = (self._policy_snapshot(self.attacker_node_policy),
+                                  self._policy_snapshot(self.attacker_at_policy))
+                self.attacker_pool.add(model_copy)
             else:
                 if not self.pg_agent_config.ar_policy:
-                    model_copy = copy.deepcopy(self.defender_policy)
-                else:
-                    self.defender_node_policy_opponent.load_state_dict(self.defender_node_policy.state_dict())
-                    self.defender_at_policy_opponent.load_state_dict(self.defender_at_policy.state_dict())
-                    model_copy = (copy.deepcopy(self.defender_node_policy_opponent),
-                                  copy.deepcopy(self.defender_at_policy_opponent))
-                    #model_copy = (copy.deepcopy(self.defender_node_policy.state_dict()), copy.deepcopy(self.defender_at_policy.state_dict()))
-                if len(self.defender_pool) >= self.pg_agent_config.opponent_pool_config.pool_maxsize:
-                    self.defender_pool.pop(0)
-                if self.pg_agent_config.opponent_pool_config.quality_scores:
-                    if len(self.defender_pool) == 0:
-                        self.defender_pool.append([model_copy, self.pg_agent_config.opponent_pool_config.initial_quality])
-                    elif len(self.defender_pool) > 0:
-                        qualities = self.get_defender_pool_quality_scores()
-                        max_q = max(qualities)
-                        self.defender_pool.append([model_copy, max_q])
+                    model_copy = self._policy_snapshot(self.defender_policy)
                 else:
-                    self.defender_pool.append(model_copy)
-
-    def sample_opponent(self, attacker=True):
-        if attacker:
-            if self.pg_agent_config.opponent_pool_config.quality_scores:
-                quality_scores = self.get_attacker_pool_quality_scores()
-                softmax_dist = self.get_softmax_distribution(quality_scores)
-                return np.random.choice(list(range(len(self.attacker_pool))), size=1, p=softmax_dist)[0]
-            else:
-                return np.random.choice(list(range(len(self.attacker_pool))), size=1)[0]
-        else:
-            if self.pg_agent_config.opponent_pool_config.quality_scores:
-                quality_scores = self.get_defender_pool_quality_scores()
-                softmax_dist = self.get_softmax_distribution(quality_scores)
-                return np.random.choice(list(range(len(self.defender_pool))), size=1, p=softmax_dist)[0]
-            else:
-                return np.random.choice(list(range(len(self.defender_pool))), size=1)[0]
+                    model_copy = (self._policy_snapshot(self.defender_node_policy),
+                                  self._policy_snapshot(self.defender_at_policy))
+                self.defender_pool.add(model_copy)
 
-    def get_attacker_pool_quality_scores(self):
+    @staticmethod
+    def _policy_snapshot(policy: PPOPolicy) -> Dict[str, th.Tensor]:
         """
-        :return: Returns the quality scores from the attacker pool
-        """
-        return list(map(lambda x: x[1], self.attacker_pool))
+        Takes a snapshot of a policy for the opponent pool
 
-    def get_defender_pool_quality_scores(self):
+        :param policy: the policy
+        :return: a copy of the state dict of the policy, stored on the CPU
         """
-        :return: Returns the quality scores from the defender pool
+        return {key: value.detach().to("cpu", copy=True) for key, value in policy.state_dict().items()}
+
+    def _pool_opponent(self, opponent_idx: int, attacker: bool = True):
         """
-        return list(map(lambda x: x[1], self.defender_pool))
+        Gets an opponent from the pool. Policy snapshots are loaded into the scratch policy of the attacker/defender,
+        bot agents are returned as-is.
 
-    def get_softmax_distribution(self, qualities) -> np.ndarray:
+        :param opponent_idx: the index of the opponent in the pool
+        :param attacker: boolean flag whether to get the opponent from the attacker or defender pool
+        :return: the opponent, either a bot agent, a policy or a (node policy, attack/defense policy) tuple
         """
-        Converts a list of quality scores into a distribution with softmax
+        opponent = self.attacker_pool[opponent_idx] if attacker else self.defender_pool[opponent_idx]
+        if isinstance(opponent, dict):
+            scratch = self._opponent_scratch(attacker)
+            scratch.load_state_dict(opponent)
+            return scratch
+        if isinstance(opponent, tuple) and isinstance(opponent[0], dict):
+            scratch = self._opponent_scratch(attacker)
+            for policy, state_dict in zip(scratch, opponent):
+                policy.load_state_dict(state_dict)
+            return scratch
+        return opponent
+
+    def _opponent_scratch(self, attacker: bool = True):
+        """
+        Gets the policy that the policy snapshots of the opponent pool are loaded into, one per role. The opponent
+        policies of the autoregressive policy are used for this purpose, otherwise a copy of the policy is created
+        on first use.
 
-        :param qualities: the list of quality scores
-        :return: the softmax distribution
+        :param attacker: boolean flag whether to get the scratch policy of the attacker or defender
+        :return: the scratch policy or (node policy, attack/defense policy) tuple
         """
-        return softmax(qualities)
+        name = "_attacker_opponent_scratch" if attacker else "_defender_opponent_scratch"
+        scratch = getattr(self, name, None)
+        if scratch is None:
+            if not self.pg_agent_config.ar_policy:
+                scratch = copy.deepcopy(self.attacker_policy if attacker else self.defender_policy)
+            elif attacker:
+                scratch = (self.attacker_node_policy_opponent, self.attacker_at_policy_opponent)
+            else:
+                scratch = (self.defender_node_policy_opponent, self.defender_at_policy_opponent)
+            self._freeze_opponent(scratch)
+            setattr(self, name, scratch)
+        return scratch
 
-    def update_quality_score(self, opponent_idx: int, attacker: bool = True) -> None:
+    @staticmethod
+    def _freeze_opponent(model) -> None:
         """
-        Updates the quality score of an opponent in the opponent pool. Using same update rule as was used in
-        "Dota 2 with Large Scale Deep Reinforcement Learning" by Berner et. al.
+        Puts an opponent policy in evaluation mode and disables gradients for its parameters, the opponents are only
+        used for inference
 
-        :param opponent_idx: the index of the opponent in the pool
-        :param attacker: boolean flag whether attacker or defender pool to be updated
+        :param model: the opponent, either a single policy or a (node policy, attack/defense policy) tuple
         :return: None
         """
-        if attacker:
-            N = len(self.attacker_pool)
-            qualities = self.get_attacker_pool_quality_scores()
-            dist = self.get_softmax_distribution(qualities)
-            p = dist[opponent_idx]
-            self.attacker_pool[opponent_idx][1] = self.attacker_pool[opponent_idx][1] - \
-                                                  (self.pg_agent_config.opponent_pool_config.quality_score_eta / (N * p))
-        else:
-            N = len(self.defender_pool)
-            qualities = self.get_defender_pool_quality_scores()
-            dist = self.get_softmax_distribution(qualities)
-            p = dist[opponent_idx]
-            self.defender_pool[opponent_idx][1] = self.defender_pool[opponent_idx][1] - \
-                                                  (self.pg_agent_config.opponent_pool_config.quality_score_eta / (N * p))
+        policies = model if isinstance(model, tuple) else (model,)
+        for policy in policies:
+            policy.eval()
+            policy.requires_grad_(False)
@@ -16,6 +16,7 @@ from gym_idsgame.agents.training_agents.openai_baselines.common.distributions im
 from gym_idsgame.envs.idsgame_env import IdsGameEnv
 from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
 from gym_idsgame.agents.training_agents.openai_baselines.common.baseline_env_wrapper import BaselineEnvWrapper
+from gym_idsgame.agents.training_agents.openai_baselines.common.utils import get_device
 
 class PPOPolicy(BasePolicy):
     """
@@ -80,6 +81,12 @@ class PPOPolicy(BasePolicy):
             # Small values to avoid NaN in ADAM optimizer
             if optimizer_class == th.optim.Adam:
                 optimizer_kwargs['eps'] = 1e-5
+                # Update all parameter tensors with multi-tensor (foreach) kernels, or with a single fused kernel
+                # on CUDA if enabled
+                if pg_agent_config.fused_adam and get_device(device, pg_agent_config).type == "cuda":
+                    optimizer_kwargs['fused'] = True
+                else:
+                    optimizer_kwargs['foreach'] = True
         super(PPOPolicy, self).__init__(pg_agent_config, observation_space, action_space,
                                         device,
                                         features_extractor_class,
@@ -149,6 +156,9 @@ class PPOPolicy(BasePolicy):
         self.action_dist = make_proba_distribution(action_space, use_sde=use_sde, dist_kwargs=dist_kwargs)
 
         self.device = device
+        # CUDA graphs of the tensor-only part of the forward pass, keyed by observation shape and dtype
+        self.use_cuda_graph = False
+        self._cuda_graphs = {}
         self._build(lr_schedule)
 
     def _get_data(self) -> Dict[str, Any]:
@@ -243,6 +253,7 @@ class PPOPolicy(BasePolicy):
         :param deterministic: (bool) Whether to sample or use deterministic actions
         :return: (Tuple[th.Tensor, th.Tensor, th.Tensor]) action, value and log probability of the action
         """
+        values = None
         if (self.pg_agent_config.multi_channel_obs and not self.pg_agent_config.ar_policy) or  \
                 (self.pg_agent_config.ar_policy and self.node_net and self.pg_agent_config.attacker_node_net_multi_channel):
             c_1_f, c_2_f, c_3_f, c_4_f = obs
@@ -254,10 +265,14 @@ class PPOPolicy(BasePolicy):
                                                                             channel_2_features=c_2_f,
                                                                             channel_3_features=c_3_f,
                                                                             channel_4_features=c_4_f)
+        elif self._cuda_graph_enabled(obs):
+            latent_pi, latent_sde, values = self._replay_cuda_graph(obs)
+            lstm_state = None
         else:
             latent_pi, latent_vf, latent_sde, lstm_state = self._get_latent(obs.to(device))
-        # Evaluate the values for the given observations
-        values = self.value_net(latent_vf)
+        if values is None:
+            # Evaluate the values for the given observations
+            values = self.value_net(latent_vf)
         if wrapper_env is not None:
             np_obs = obs.cpu().numpy()
         # Masking
@@ -273,12 +288,10 @@ class PPOPolicy(BasePolicy):
                         non_legal_actions = []
                 else:
                     actions = list(range(env.num_attack_actions))
-                    if wrapper_env is not None:
-                        legal_actions = list(filter(lambda action: env.is_attack_legal(
-                            wrapper_env.convert_local_attacker_action_to_global(action, np_obs), node=self.node_net), actions))
-                    else:
-                        legal_actions = list(filter(lambda action: env.is_attack_legal(action, node=self.node_net), actions))
-                    if wrapper_env is not None:
+                    legal_mask = env.attack_legal_mask() if wrapper_env is None else None
+                    if legal_mask is not None:
+                        non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                    elif wrapper_env is not None:
                         non_legal_actions = list(filter(lambda action: not env.is_attack_legal(
                             wrapper_env.convert_local_attacker_action_to_global(action, np_obs), node=self.node_net), actions))
                     else:
@@ -302,15 +315,19 @@ class PPOPolicy(BasePolicy):
                         non_legal_actions = []
                 else:
                     actions = list(range(env.num_defense_actions))
-                    non_legal_actions = list(filter(lambda action: not env.is_defense_legal(action), actions))
+                    legal_mask = env.defense_legal_mask()
+                    if legal_mask is not None:
+                        non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                    else:
+                        non_legal_actions = list(filter(lambda action: not env.is_defense_legal(action), actions))
                     if len(non_legal_actions) == len(actions):
                         non_legal_actions = []
 
         distribution = self. _get_action_dist_from_latent(latent_pi, latent_sde=latent_sde, device=device,
                                                          non_legal_actions=non_legal_actions)
-        actions = distribution.get_actions(deterministic=deterministic)
-        actions = th.tensor(np.array([actions]).astype(np.int32))
-        actions = actions.to(self.device)
+        # The sampled actions stay on the device instead of being round-tripped through numpy
+        actions = distribution.get_actions(deterministic=deterministic).unsqueeze(0)
+        actions = actions.to(device=self.device, dtype=th.int32)
         log_prob = distribution.log_prob(actions)
         return actions, values, log_prob, lstm_state
 
@@ -338,8 +355,7 @@ class PPOPolicy(BasePolicy):
                                                                             channel_4_features=c_4_f)
         else:
             latent_pi, latent_vf, latent_sde, lstm_state = self._get_latent(obs.to(device))
-        # Evaluate the values for the given observations
-        values = self.value_net(latent_vf)
+        # Only the action distribution is returned, so the value head is not evaluated
         if wrapper_env is not None:
             np_obs = obs.cpu().numpy()
         # Masking
@@ -356,14 +372,10 @@ class PPOPolicy(BasePolicy):
                         non_legal_actions = []
                 else:
                     actions = list(range(env.num_attack_actions))
-                    if wrapper_env is not None:
-                        legal_actions = list(filter(lambda action: env.is_attack_legal(
-                            wrapper_env.convert_local_attacker_action_to_global(action, np_obs), node=self.node_net),
-                                                    actions))
-                    else:
-                        legal_actions = list(
-                            filter(lambda action: env.is_attack_legal(action, node=self.node_net), actions))
-                    if wrapper_env is not None:
+                    legal_mask = env.attack_legal_mask() if wrapper_env is None else None
+                    if legal_mask is not None:
+                        non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                    elif wrapper_env is not None:
                         non_legal_actions = list(filter(lambda action: not env.is_attack_legal(
                             wrapper_env.convert_local_attacker_action_to_global(action, np_obs), node=self.node_net),
                                                         actions))
@@ -380,7 +392,11 @@ class PPOPolicy(BasePolicy):
                         non_legal_actions = []
                 else:
                     actions = list(range(env.num_defense_actions))
-                    non_legal_actions = list(filter(lambda action: not env.is_defense_legal(action), actions))
+                    legal_mask = env.defense_legal_mask()
+                    if legal_mask is not None:
+                        non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                    else:
+                        non_legal_actions = list(filter(lambda action: not env.is_defense_legal(action), actions))
                     if len(non_legal_actions) == len(actions):
                         non_legal_actions = []
 
@@ -388,6 +404,61 @@ class PPOPolicy(BasePolicy):
                                                          non_legal_actions=non_legal_actions, get_action_probs=True)
         return action_probs
 
+    def __getstate__(self):
+        # Captured CUDA graphs can not be copied, copies of the policy (e.g. in opponent pools) re-capture them
+        state = self.__dict__.copy()
+        state["_cuda_graphs"] = {}
+        return state
+
+    def _cuda_graph_enabled(self, obs: th.Tensor) -> bool:
+        """
+        :param obs: (th.Tensor) Observation
+        :return: True if the latent codes and values for the observation can be computed by replaying a CUDA graph
+        """
+        return self.use_cuda_graph and obs.is_cuda and not th.is_grad_enabled() \
+               and not hasattr(self.mlp_extractor, "core_lstm")
+
+    def _latent_and_values(self, obs: th.Tensor) -> Tuple[th.Tensor, th.Tensor, th.Tensor]:
+        """
+        Tensor-only part of the forward pass that is captured in CUDA graphs
+
+        :param obs: (th.Tensor) Observation
+        :return: (Tuple[th.Tensor, th.Tensor, th.Tensor]) latent code of the actor, latent code for gSDE and values
+        """
+        latent_pi, latent_vf, latent_sde, _ = self._get_latent(obs)
+        return latent_pi, latent_sde, self.value_net(latent_vf)
+
+    def _replay_cuda_graph(self, obs: th.Tensor) -> Tuple[th.Tensor, th.Tensor, th.Tensor]:
+        """
+        Computes the latent codes and values by replaying a CUDA graph, capturing it the first time an observation
+        shape is seen. The graph reads the parameters in-place, so optimizer updates are picked up by later replays.
+
+        :param obs: (th.Tensor) Observation (on the CUDA device)
+        :return: (Tuple[th.Tensor, th.Tensor, th.Tensor]) latent code of the actor, latent code for gSDE and values
+        """
+        # Tensors created in inference mode can not be updated in-place outside of it, hence separate graphs
+        key = (tuple(obs.shape), obs.dtype, th.is_inference_mode_enabled())
+        entry = self._cuda_graphs.get(key)
+        if entry is None:
+            static_obs = obs.clone()
+            # Warm up on a side stream before capturing, as required by th.cuda.graph
+            stream = th.cuda.Stream()
+            stream.wait_stream(th.cuda.current_stream())
+            with th.cuda.stream(stream):
+                for _ in range(3):
+                    self._latent_and_values(static_obs)
+            th.cuda.current_stream().wait_stream(stream)
+            graph = th.cuda.CUDAGraph()
+            with th.cuda.graph(graph):
+                static_outputs = self._latent_and_values(static_obs)
+            entry = (static_obs, graph, static_outputs)
+            self._cuda_graphs[key] = entry
+        static_obs, graph, (latent_pi, latent_sde, values) = entry
+        static_obs.copy_(obs)
+        graph.replay()
+        # The static outputs are overwritten by the next replay
+        return latent_pi.clone(), latent_sde.clone(), values.clone()
+
     def _get_latent(self, obs: th.Tensor, lstm_state = None, masks = None,
                     channel_1_features=None,
                     channel_2_features=None, channel_3_features=None, channel_4_features=None) -> Tuple[th.Tensor, th.Tensor, th.Tensor]:
@@ -436,8 +507,10 @@ class PPOPolicy(BasePolicy):
         else:
             raise AssertionError("Shape not recognized: {}".format(latent_pi.shape))
         mean_actions = mean_actions.to(device)
-        action_probs_1 = mean_actions.clone()
+        action_probs_1 = mean_actions
         if non_legal_actions is not None and len(non_legal_actions) > 0:
+            # Copy before masking in-place, when there is nothing to mask (e.g. in evaluate_actions) no copy is made
+            action_probs_1 = mean_actions.clone()
             if len(action_probs_1.shape) == 1:
                 #action_probs_1[non_legal_actions] = 0.00000000000001 # Don't set to zero due to invalid distribution errors
                 action_probs_1[non_legal_actions] = 0.0
@@ -497,18 +570,21 @@ class PPOPolicy(BasePolicy):
                     non_legal_actions = []
             else:
                 actions = list(range(env.num_attack_actions))
-                if wrapper_env is not None:
-                    legal_actions = list(filter(lambda action: env.is_attack_legal(wrapper_env.convert_local_attacker_action_to_global(action, observation), node=self.node_net), actions))
-                else:
-                    legal_actions = list(filter(lambda action: env.is_attack_legal(action, node=self.node_net), actions))
-                if wrapper_env is not None:
+                legal_mask = env.attack_legal_mask() if wrapper_env is None else None
+                if legal_mask is not None:
+                    non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                elif wrapper_env is not None:
                     non_legal_actions = list(filter(lambda action: not env.is_attack_legal(wrapper_env.convert_local_attacker_action_to_global(action, observation), node=self.node_net), actions))
                 else:
                     non_legal_actions = list(filter(lambda action: not env.is_attack_legal(action, node=self.node_net), actions))
         else:
             if not self.pg_agent_config.ar_policy:
                 actions = list(range(env.num_defense_actions))
-                non_legal_actions = list(filter(lambda action: not env.is_defense_legal(action), actions))
+                legal_mask = env.defense_legal_mask()
+                if legal_mask is not None:
+                    non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                else:
+                    non_legal_actions = list(filter(lambda action: not env.is_defense_legal(action), actions))
                 if len(non_legal_actions) == len(actions):
                     non_legal_actions = []
             else:
@@ -1,8 +1,18 @@
-from typing import Callable, Union
+from typing import Callable, Union, Dict, Any, Optional
 import random
+import json
+import base64
+import pickle
+import warnings
+from functools import lru_cache
 
 import numpy as np
 import torch as th
+import cloudpickle
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
 
 def set_random_seed(seed: int, using_cuda: bool = False) -> None:
@@ -89,6 +99,18 @@ def constant_fn(val: float) -> Callable:
     return func
 
 
+@lru_cache(maxsize=None)
+def _config_device(gpu: bool, gpu_id: int) -> th.device:
+    """
+    Memoized device of a config, resolved once per (gpu, gpu_id) pair
+
+    :param gpu: whether the config uses the gpu
+    :param gpu_id: the id of the gpu
+    :return: (th.device)
+    """
+    return th.device("cpu" if not gpu else "cuda:" + str(gpu_id))
+
+
 def get_device(device: Union[th.device, str] = 'auto', pg_agent_config : PolicyGradientAgentConfig = None) -> th.device:
     """
     Retrieve PyTorch device.
@@ -100,8 +122,7 @@ def get_device(device: Union[th.device, str] = 'auto', pg_agent_config : PolicyG
     :return: (th.device)
     """
     if pg_agent_config is not None:
-        device = "cpu" if not pg_agent_config.gpu else "cuda:" + str(pg_agent_config.gpu_id)
-        return th.device(device)
+        return _config_device(bool(pg_agent_config.gpu), pg_agent_config.gpu_id)
     # Cuda by default
     if device == 'auto':
         device = 'cuda'
@@ -113,4 +134,94 @@ def get_device(device: Union[th.device, str] = 'auto', pg_agent_config : PolicyG
     if device == th.device('cuda') and not th.cuda.is_available():
         return th.device('cpu')
 
-    return device
\ No newline at end of file
+    return device
+
+
+def data_to_json(data: Dict[str, Any]) -> str:
+    """
+    Turn data (class parameters) into a JSON string for storing, in the format of stable-baselines3's
+    ``data_to_json``: items that are not JSON serializable are pickled with cloudpickle and stored as base64
+    strings. Every item is serialized once and the document is assembled from the serialized items, instead of
+    serializing each item to test it and then serializing the whole dict again.
+
+    :param data: Dictionary of class parameters to be stored
+    :return: JSON string of the data serialized
+    """
+    items = []
+    for data_key, data_item in data.items():
+        try:
+            serialized_item = json.dumps(data_item)
+        except (TypeError, ValueError):
+            serialized_item = json.dumps(_cloudpickle_serialization(data_item))
+        items.append(json.dumps(data_key) + ": " + serialized_item)
+    return "{" + ", ".join(items) + "}"
+
+
+def _cloudpickle_serialization(data_item: Any) -> Dict[str, Any]:
+    """
+    Pickles an item that is not JSON serializable into a dict with its base64 encoding, its type and its
+    first-level JSON serializable attributes (the string representation of the others)
+
+    :param data_item: the item to serialize
+    :return: the JSON serializable dict describing the item
+    """
+    serialization = {
+        ":type:": str(type(data_item)),
+        ":serialized:": base64.b64encode(cloudpickle.dumps(data_item)).decode()
+    }
+    if hasattr(data_item, "__dict__") or isinstance(data_item, dict):
+        item_generator = data_item.items if isinstance(data_item, dict) else data_item.__dict__.items
+        for variable_name, variable_item in item_generator():
+            try:
+                json.dumps(variable_item)
+                serialization[variable_name] = variable_item
+            except (TypeError, ValueError):
+                serialization[variable_name] = str(variable_item)
+    return serialization
+
+
+def json_to_data(json_string: Union[str, bytes, memoryview], custom_objects: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Turn the JSON serialization of class-parameters (as written by ``data_to_json``) back into a dictionary.
+    The JSON envelope is parsed with orjson if it is installed, falling back to the standard library for
+    documents orjson rejects (e.g. NaN/Infinity literals written by ``json.dumps``).
+
+    :param json_string: JSON serialization of the class-parameters that should be loaded. Bytes-like objects
+                        (e.g. a slice of a memory-mapped archive) are parsed by orjson without a copy.
+    :param custom_objects: Dictionary of objects to replace upon loading. If a variable is present in this
+                           dictionary as a key, it will not be deserialized and the corresponding item will be
+                           used instead.
+    :return: Loaded class parameters.
+    """
+    if custom_objects is not None and not isinstance(custom_objects, dict):
+        raise ValueError("custom_objects argument must be a dict or None")
+
+    json_dict = None
+    if orjson is not None:
+        try:
+            json_dict = orjson.loads(json_string)
+        except orjson.JSONDecodeError:
+            json_dict = None
+    if json_dict is None:
+        # The standard library only parses str/bytes
+        if isinstance(json_string, (memoryview, bytearray)):
+            json_string = bytes(json_string)
+        json_dict = json.loads(json_string)
+
+    return_data = {}
+    for data_key, data_item in json_dict.items():
+        if custom_objects is not None and data_key in custom_objects:
+            return_data[data_key] = custom_objects[data_key]
+        elif isinstance(data_item, dict) and ":serialized:" in data_item:
+            # Item was serialized with cloudpickle and stored as a base64 string
+            try:
+                deserialized_object = pickle.loads(base64.b64decode(data_item[":serialized:"]))
+            except (RuntimeError, TypeError, AttributeError) as e:
+                warnings.warn(f"Could not deserialize object {data_key}. "
+                              "Consider using `custom_objects` argument to replace this object.\n"
+                              f"Exception: {e}")
+            else:
+                return_data[data_key] = deserialized_object
+        else:
+            return_data[data_key] = data_item
+    return return_data
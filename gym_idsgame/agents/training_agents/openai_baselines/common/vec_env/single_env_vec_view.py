@@ -0,0 +1,74 @@
+from typing import Sequence
+
+import numpy as np
+
+from gym_idsgame.agents.training_agents.openai_baselines.common.vec_env.base_vec_env import VecEnv
+
+
+class SingleEnvVecView(VecEnv):
+    """
+    Exposes a single, already instantiated, idsgame environment (``BaselineEnvWrapper``) through the ``VecEnv``
+    interface with ``num_envs == 1``. In contrast to ``DummyVecEnv``, steps and resets are forwarded directly to
+    the environment without copying the observations into intermediate buffers and without deep-copying the infos.
+
+    :param env: (Gym Environment) the environment to wrap
+    """
+
+    def __init__(self, env):
+        self.envs = [env]
+        VecEnv.__init__(self, 1, env.attacker_observation_space, env.attacker_action_space,
+                        env.defender_observation_space, env.defender_action_space)
+        self.buf_dones = np.zeros((1,), dtype=np.bool_)
+        self.buf_a_rews = np.zeros((1,), dtype=np.float32)
+        self.buf_d_rews = np.zeros((1,), dtype=np.float32)
+        self.actions = None
+        self.metadata = env.metadata
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self, update_stats : bool = False):
+        env = self.envs[0]
+        obs, rew, done, info = env.step(self.actions[0])
+        if done:
+            # save final observation where user can get it, then reset
+            info['terminal_observation'] = obs
+            r_obs = env.reset(update_stats=update_stats)
+            if r_obs is not None:
+                obs = r_obs
+        # The reward/done arrays are handed out to the caller, so new ones are created every step
+        return (obs[0], obs[1], np.array([rew[0]], dtype=np.float32), np.array([rew[1]], dtype=np.float32),
+                np.array([done], dtype=np.bool_), [info])
+
+    def seed(self, seed=None):
+        return [seed]
+
+    def reset(self, update_stats : bool = False):
+        obs = self.envs[0].reset(update_stats=update_stats)
+        return [obs[0], obs[1]], {}
+
+    def close(self):
+        self.envs[0].close()
+
+    def get_images(self, *args, **kwargs) -> Sequence[np.ndarray]:
+        return [self.envs[0].render(*args, mode='rgb_array', **kwargs)]
+
+    def render(self, *args, **kwargs):
+        return self.envs[0].render(*args, **kwargs)
+
+    def get_attr(self, attr_name, indices=None):
+        """Return attribute from vectorized environment (see base class)."""
+        return [getattr(env_i, attr_name) for env_i in self._get_target_envs(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        """Set attribute inside vectorized environments (see base class)."""
+        for env_i in self._get_target_envs(indices):
+            setattr(env_i, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Call instance methods of vectorized environments."""
+        return [getattr(env_i, method_name)(*method_args, **method_kwargs) for env_i in self._get_target_envs(indices)]
+
+    def _get_target_envs(self, indices):
+        indices = self._get_indices(indices)
+        return [self.envs[i] for i in indices]
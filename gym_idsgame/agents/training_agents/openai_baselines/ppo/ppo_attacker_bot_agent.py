@@ -65,7 +65,11 @@ class PPOBaselineAttackerBotAgent(BotAgent):
                                                attacker=True)
             if not self.config.ar_policy:
                 actions = list(range(self.idsgame_env.num_attack_actions))
-                non_legal_actions = list(filter(lambda action: not self.is_attack_legal(action, attacker_obs, game_state), actions))
+                if not self.idsgame_env.local_view_features():
+                    legal_mask = util.attack_legal_mask(self.game_config, game_state.attacker_pos, game_state)
+                    non_legal_actions = np.flatnonzero(~legal_mask).tolist()
+                else:
+                    non_legal_actions = list(filter(lambda action: not self.is_attack_legal(action, attacker_obs, game_state), actions))
                 obs_tensor_a = torch.as_tensor(attacker_state.flatten()).to(self.device)
                 attacker_actions, attacker_values, attacker_log_probs = self.model.attacker_policy.forward(
                     obs_tensor_a, self.idsgame_env, device=self.device, attacker=True, non_legal_actions=non_legal_actions)
@@ -63,8 +63,7 @@ class PPOBaselineDefenderBotAgent(BotAgent):
             defender_state = self.update_state(attacker_obs=attacker_obs, defender_obs=defender_obs, state=[],
                                                attacker=False)
             if not self.config.ar_policy:
-                actions = list(range(self.idsgame_env.num_defense_actions))
-                non_legal_actions = list(filter(lambda action: not self.idsgame_env.is_defense_legal(action), actions))
+                non_legal_actions = np.flatnonzero(~self.idsgame_env.defense_legal_mask()).tolist()
                 obs_tensor_d = torch.as_tensor(defender_state.flatten()).to(self.device)
                 defender_actions, defender_values, defender_log_probs = self.model.defender_policy.forward(
                     obs_tensor_d, self.idsgame_env, device=self.device, attacker=False, non_legal_actions=non_legal_actions)
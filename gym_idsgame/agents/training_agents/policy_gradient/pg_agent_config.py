@@ -8,6 +8,22 @@ class PolicyGradientAgentConfig:
     """
     DTO with configuration for PolicyGradientAgent
     """
+    # Defaults of the flags that were added after the first release, configs pickled by older versions (e.g. restored
+    # from checkpoints) do not have them as instance attributes and fall back to these
+    torch_checkpoint = False
+    torch_compile = False
+    use_cuda_graph = False
+    checkpoint_dtype = "fp32"
+    use_fast_loader = False
+    load_to_cpu_then_move = False
+    skip_zip_crc_check = False
+    coalesce_zip_params = False
+    pinned_save_staging = False
+    use_safetensors = False
+    rollout_advantage_normalization = False
+    fused_adam = False
+    batch_opponent_pool_updates = False
+    checkpoint_updated_policies_only = False
 
     def __init__(self, gamma :float = 0.8, alpha_attacker:float = 0.1, alpha_defender:float = 0.1,
                  epsilon :float =0.9, render :bool =False,
@@ -53,7 +69,21 @@ class PolicyGradientAgentConfig:
                  defender_node_input_dim: int = 64,
                  defender_at_net_input_dim: int = 64, defender_node_net_output_dim=4, defender_at_net_output_dim=4,
                  defender_node_net_multi_channel: bool = False, defender_at_net_multi_channel: bool = False,
-                 defender_node_net_lstm_core: bool = False, defender_at_net_lstm_core: bool = False
+                 defender_node_net_lstm_core: bool = False, defender_at_net_lstm_core: bool = False,
+                 torch_checkpoint : bool = False,
+                 torch_compile : bool = False,
+                 use_cuda_graph : bool = False,
+                 checkpoint_dtype : str = "fp32",
+                 use_fast_loader : bool = False,
+                 load_to_cpu_then_move : bool = False,
+                 skip_zip_crc_check : bool = False,
+                 coalesce_zip_params : bool = False,
+                 pinned_save_staging : bool = False,
+                 use_safetensors : bool = False,
+                 rollout_advantage_normalization : bool = False,
+                 fused_adam : bool = False,
+                 batch_opponent_pool_updates : bool = False,
+                 checkpoint_updated_policies_only : bool = False
                  ):
         """
         Initialize environment and hyperparameters
@@ -136,6 +166,20 @@ class PolicyGradientAgentConfig:
         :param grid_image_obs: if true, use grid image obs
         :param force_exploration: boolean flag whether to force exploration actions during training
         :param force_exp_p: probability of forceful exploration actions during training
+        :param torch_checkpoint: boolean flag whether to save models as native torch checkpoints instead of zip-archives
+        :param torch_compile: boolean flag whether to compile the policy networks with torch.compile
+        :param use_cuda_graph: boolean flag whether to replay the policy forward passes during rollouts with CUDA graphs
+        :param checkpoint_dtype: dtype of the saved Linear/Conv weights, one of 'fp32', 'bf16' and 'int8' (per-channel scales)
+        :param use_fast_loader: boolean flag whether to read zip-archived models with a single read of the file instead of per-member zipfile streams
+        :param load_to_cpu_then_move: boolean flag whether to load saved models to the cpu and move the tensors to the gpu afterwards
+        :param skip_zip_crc_check: boolean flag whether to skip the CRC32 verification of the members when reading zip-archived models
+        :param coalesce_zip_params: boolean flag whether to store all state dicts of a zip-archived model in a single params.pth member instead of one member per state dict
+        :param pinned_save_staging: boolean flag whether to copy the cuda tensors of a model into pinned cpu memory with asynchronous copies before serializing it
+        :param use_safetensors: boolean flag whether to store the flat tensor dicts (e.g. the policy state dicts) of zip-archived models in the safetensors format instead of with th.save, requires the safetensors package
+        :param rollout_advantage_normalization: boolean flag whether to normalize the advantages once over the whole rollout buffer instead of per minibatch
+        :param fused_adam: boolean flag whether to use the fused Adam implementation (single kernel per step) when training on CUDA
+        :param batch_opponent_pool_updates: boolean flag whether to draw the opponent sampling probabilities of a rollout in one batch and to apply the opponent pool quality score updates once at the end of the rollout
+        :param checkpoint_updated_policies_only: boolean flag whether to skip saving the policy of an agent that has not been trained since it was last saved
         """
         self.gamma = gamma
         self.alpha_attacker = alpha_attacker
@@ -252,6 +296,20 @@ class PolicyGradientAgentConfig:
         self.defender_at_net_multi_channel = defender_at_net_multi_channel
         self.defender_node_net_lstm_core = defender_node_net_lstm_core
         self.defender_at_net_lstm_core = defender_at_net_lstm_core
+        self.torch_checkpoint = torch_checkpoint
+        self.torch_compile = torch_compile
+        self.use_cuda_graph = use_cuda_graph
+        self.checkpoint_dtype = checkpoint_dtype
+        self.use_fast_loader = use_fast_loader
+        self.load_to_cpu_then_move = load_to_cpu_then_move
+        self.skip_zip_crc_check = skip_zip_crc_check
+        self.coalesce_zip_params = coalesce_zip_params
+        self.pinned_save_staging = pinned_save_staging
+        self.use_safetensors = use_safetensors
+        self.rollout_advantage_normalization = rollout_advantage_normalization
+        self.fused_adam = fused_adam
+        self.batch_opponent_pool_updates = batch_opponent_pool_updates
+        self.checkpoint_updated_policies_only = checkpoint_updated_policies_only
 
 
     def to_str(self) -> str:
@@ -368,6 +426,20 @@ class PolicyGradientAgentConfig:
             writer.writerow(["grid_image_obs", str(self.grid_image_obs)])
             writer.writerow(["force_exploration", str(self.force_exploration)])
             writer.writerow(["force_exp_p", str(self.force_exp_p)])
+            writer.writerow(["torch_checkpoint", str(self.torch_checkpoint)])
+            writer.writerow(["torch_compile", str(self.torch_compile)])
+            writer.writerow(["use_cuda_graph", str(self.use_cuda_graph)])
+            writer.writerow(["checkpoint_dtype", str(self.checkpoint_dtype)])
+            writer.writerow(["use_fast_loader", str(self.use_fast_loader)])
+            writer.writerow(["load_to_cpu_then_move", str(self.load_to_cpu_then_move)])
+            writer.writerow(["skip_zip_crc_check", str(self.skip_zip_crc_check)])
+            writer.writerow(["coalesce_zip_params", str(self.coalesce_zip_params)])
+            writer.writerow(["pinned_save_staging", str(self.pinned_save_staging)])
+            writer.writerow(["use_safetensors", str(self.use_safetensors)])
+            writer.writerow(["rollout_advantage_normalization", str(self.rollout_advantage_normalization)])
+            writer.writerow(["fused_adam", str(self.fused_adam)])
+            writer.writerow(["batch_opponent_pool_updates", str(self.batch_opponent_pool_updates)])
+            writer.writerow(["checkpoint_updated_policies_only", str(self.checkpoint_updated_policies_only)])
             if self.opponent_pool and self.opponent_pool_config is not None:
                 writer.writerow(["pool_maxsize", str(self.opponent_pool_config.pool_maxsize)])
                 writer.writerow(["pool_increment_period", str(self.opponent_pool_config.pool_increment_period)])
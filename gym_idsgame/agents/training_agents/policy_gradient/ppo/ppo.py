@@ -403,12 +403,13 @@ class PPOAgent(PolicyGradientAgent):
         attacker_state = self.update_state(attacker_obs=attacker_obs, defender_obs=defender_obs, state=[], attacker=True)
         defender_state = self.update_state(defender_obs=defender_obs, attacker_obs=attacker_obs, state=[], attacker=False)
 
-        # Tracking metrics
-        episode_attacker_rewards = []
-        episode_defender_rewards = []
-        episode_steps = []
-        episode_avg_attacker_loss = []
-        episode_avg_defender_loss = []
+        # Tracking metrics, the attacker rewards, defender rewards and lengths of the episodes since the last log tick
+        # and the average losses of all batches are written to preallocated arrays
+        episode_metrics = np.zeros((3, self.config.train_log_frequency))
+        num_episodes = 0
+        episode_avg_losses = np.zeros((2, self.config.num_episodes // self.config.batch_size + 1))
+        num_attacker_losses = 0
+        num_defender_losses = 0
 
         # Logging
         self.outer_train.set_description_str("[Train] epsilon:{:.2f},avg_a_R:{:.2f},avg_d_R:{:.2f},"
@@ -624,16 +625,12 @@ class PPOAgent(PolicyGradientAgent):
                 total_num_batches += 1
                 num_alt_iterations += 1
 
-                if episode_step > 0:
-                    if self.config.attacker:
-                        episode_avg_attacker_loss.append(episode_attacker_loss / episode_step)
-                    if self.config.defender:
-                        episode_avg_defender_loss.append(episode_defender_loss / episode_step)
-                else:
-                    if self.config.attacker:
-                        episode_avg_attacker_loss.append(episode_attacker_loss)
-                    if self.config.defender:
-                        episode_avg_defender_loss.append(episode_defender_loss)
+                if self.config.attacker:
+                    episode_avg_losses[0, num_attacker_losses] = episode_attacker_loss / max(episode_step, 1)
+                    num_attacker_losses += 1
+                if self.config.defender:
+                    episode_avg_losses[1, num_defender_losses] = episode_defender_loss / max(episode_step, 1)
+                    num_defender_losses += 1
 
             # Decay LR after every episode
             lr_attacker = self.config.alpha_attacker
@@ -663,9 +660,8 @@ class PPOAgent(PolicyGradientAgent):
                     num_defender_pool_iterations += 1
                     num_attacker_opponent_iterations += 1
 
-            episode_attacker_rewards.append(episode_attacker_reward)
-            episode_defender_rewards.append(episode_defender_reward)
-            episode_steps.append(episode_step)
+            episode_metrics[:, num_episodes] = (episode_attacker_reward, episode_defender_reward, episode_step)
+            num_episodes += 1
 
             # Update opponent pool qualities
             if self.config.opponent_pool and self.config.opponent_pool_config is not None \
@@ -688,16 +684,16 @@ class PPOAgent(PolicyGradientAgent):
                 if self.config.opponent_pool and self.config.opponent_pool_config is not None:
                     a_pool = len(self.attacker_pool)
                     d_pool = len(self.defender_pool)
-                self.log_metrics(episode, self.train_result, episode_attacker_rewards, episode_defender_rewards, episode_steps,
-                                 episode_avg_attacker_loss, episode_avg_defender_loss, lr_attacker=lr_attacker,
+                self.log_metrics(episode, self.train_result, episode_metrics[0, :num_episodes],
+                                 episode_metrics[1, :num_episodes], episode_metrics[2, :num_episodes],
+                                 episode_avg_losses[0, :num_attacker_losses],
+                                 episode_avg_losses[1, :num_defender_losses], lr_attacker=lr_attacker,
                                  lr_defender=lr_defender,
                                  train_attacker = (self.config.attacker and train_attacker),
                                  train_defender = (self.config.defender and train_defender),
                                  a_pool=a_pool, d_pool=d_pool, total_num_episodes=total_num_batches)
 
-                episode_attacker_rewards = []
-                episode_defender_rewards = []
-                episode_steps = []
+                num_episodes = 0
                 self.num_train_games = 0
                 self.num_train_hacks = 0
 
@@ -1,15 +1,28 @@
 """
 Game-specific configuration for the gym-idsgame environment
 """
+from typing import List
 import gymnasium as gym
 import numpy as np
 from gym_idsgame.envs.dao.game_state import GameState
 from gym_idsgame.envs.dao.network_config import NetworkConfig
+from gym_idsgame.envs.dao.node_type import NodeType
 
 class GameConfig():
     """
     DTO with game configuration parameters
     """
+    # Cached spaces and action tables, built on first access. The class-level defaults are used by configs pickled by
+    # older versions, which do not have the caches, so that the caches can be read as plain attributes on the hot paths
+    _observation_spaces = None
+    _attack_action_table = None
+    _attack_action_table_node_ids = None
+    _attack_action_table_key = None
+    _defense_action_table = None
+    _defense_action_table_node_ids = None
+    _defense_action_table_key = None
+    _defense_legal_mask = None
+
     def __init__(self, network_config: NetworkConfig = None, manual_attacker: bool = True, num_layers: int = 1,
                  num_servers_per_layer: int = 2, num_attack_types: int = 10, max_value: int = 9,
                  initial_state: GameState = None, manual_defender: bool = False, initial_state_path :str = None,
@@ -136,14 +149,10 @@ class GameConfig():
         :return: observation space
         """
         if not self.reconnaissance_actions:
-            high_row = np.array([self.max_value] * (self.num_attack_types + 1))
-            low = np.zeros((self.num_nodes, self.num_attack_types + 1))
+            num_features = self.num_attack_types + 1
         else:
-            high_row = np.array([self.max_value] * (self.num_attack_types*2 + 2))
-            low = np.zeros((self.num_nodes, self.num_attack_types*2 + 2))
-        high = np.array([high_row] * self.num_nodes)
-        observation_space = gym.spaces.Box(low=low, high=high, dtype=np.int32)
-        return observation_space
+            num_features = self.num_attack_types*2 + 2
+        return self.__observation_space(self.num_nodes, num_features)
 
     def get_defender_observation_space(self) -> gym.spaces.Box:
         """
@@ -151,11 +160,24 @@ class GameConfig():
 
         :return: observation space
         """
-        high_row = np.array([self.max_value] * (self.num_attack_types + 1))
-        high = np.array([high_row] * 1)
-        low = np.zeros((1, self.num_attack_types + 1))
-        observation_space = gym.spaces.Box(low=low, high=high, dtype=np.int32)
-        return observation_space
+        return self.__observation_space(1, self.num_attack_types + 1)
+
+    def __observation_space(self, num_rows: int, num_features: int) -> gym.spaces.Box:
+        """
+        Creates an observation space with values in [0, max_value], the spaces are cached per shape and max value
+
+        :param num_rows: the number of rows of the observation
+        :param num_features: the number of features per row
+        :return: observation space
+        """
+        if self._observation_spaces is None:
+            self._observation_spaces = {}
+        key = (num_rows, num_features, self.max_value)
+        if key not in self._observation_spaces:
+            high = np.full((num_rows, num_features), self.max_value, dtype=np.int32)
+            low = np.zeros_like(high)
+            self._observation_spaces[key] = gym.spaces.Box(low=low, high=high, dtype=np.int32)
+        return self._observation_spaces[key]
 
     def get_action_space(self, defender :bool = False) -> gym.spaces.Discrete:
         """
@@ -168,3 +190,61 @@ class GameConfig():
             return gym.spaces.Discrete(self.num_defense_actions)
         else:
             return gym.spaces.Discrete(self.num_attack_actions)
+
+    def get_attack_action_table(self) -> List:
+        """
+        Gets the interpretation of all (global) attack action ids, see util.interpret_attack_action. The table is
+        built on first access and re-built when the network layout or the attack types change, it is shared between
+        calls and should not be modified.
+
+        :return: a list where the index corresponds to the action id and the value to a tuple
+                 (server_id, server_pos, attack_type, reconnaissance)
+        """
+        node_ids = self.network_config.get_node_adjacency_matrix_ids()
+        key = (self.num_attack_types, self.reconnaissance_actions)
+        if self._attack_action_table_node_ids is not node_ids or self._attack_action_table_key != key:
+            types_per_node = self.num_attack_types + 1 if self.reconnaissance_actions else self.num_attack_types
+            self._attack_action_table = []
+            for server_id in range(len(node_ids)):
+                server_pos = self.network_config.get_node_pos(server_id)
+                for attack_type in range(types_per_node):
+                    reconnaissance = attack_type >= self.num_attack_types
+                    if reconnaissance:
+                        attack_type = attack_type - self.num_attack_types
+                    self._attack_action_table.append((server_id, server_pos, attack_type, reconnaissance))
+            self._attack_action_table_node_ids = node_ids
+            self._attack_action_table_key = key
+        return self._attack_action_table
+
+    def get_defense_action_table(self) -> List:
+        """
+        Gets the interpretation of all defense action ids, see util.interpret_defense_action. The table is built on
+        first access and re-built when the network layout or the attack types change, it is shared between calls and
+        should not be modified.
+
+        :return: a list where the index corresponds to the action id and the value to a tuple
+                 (server_id, server_pos, defense_type)
+        """
+        node_ids = self.network_config.get_node_adjacency_matrix_ids()
+        if self._defense_action_table_node_ids is not node_ids \
+                or self._defense_action_table_key != self.num_attack_types:
+            self._defense_action_table = [(server_id, self.network_config.get_node_pos(server_id), defense_type)
+                                          for server_id in range(len(node_ids))
+                                          for defense_type in range(self.num_attack_types + 1)]
+            node_types = self.network_config.get_node_types()
+            legal_nodes = (node_types == NodeType.SERVER.value) | (node_types == NodeType.DATA.value)
+            self._defense_legal_mask = np.repeat(legal_nodes, self.num_attack_types + 1)
+            self._defense_action_table_node_ids = node_ids
+            self._defense_action_table_key = self.num_attack_types
+        return self._defense_action_table
+
+    def get_defense_legal_mask(self) -> np.ndarray:
+        """
+        Gets the legality of all defense actions, a defense is legal if the defended node is a server or the data
+        node. The mask is built together with the defense action table, it is shared between calls and should not be
+        modified.
+
+        :return: a boolean array where the index corresponds to the defense action id, True if the defense is legal
+        """
+        self.get_defense_action_table()
+        return self._defense_legal_mask
@@ -9,6 +9,17 @@ class NetworkConfig:
     """
     DTO with configuration of the network for the game, i.e. the servers and their connectivity
     """
+    # Cached values derived from the graph layout (see _invalidate_cache). The class-level defaults are used by
+    # configs pickled by older versions, which do not have the caches, so that the caches can be read as plain
+    # attributes on the hot paths
+    _start_pos = None
+    _data_pos = None
+    _node_list = None
+    _id_to_pos = None
+    _pos_to_id = None
+    _node_adjacency_ids = None
+    _node_types = None
+
     def __init__(self, num_rows: int, num_cols: int, connected_layers : bool = False, fully_observed = False,
                  relative_neighbor_positions : List = None):
         """
@@ -25,72 +36,85 @@ class NetworkConfig:
         self.num_cols = num_cols
         self.connected_layers = connected_layers
         self.graph_layout = self.__default_graph_layout()
+        # The start/data positions and the node list are computed from the layout once, on first access
+        self._invalidate_cache()
         self.adjacency_matrix = self.__default_adjacency_matrix()
         self.fully_observed = fully_observed
         self.relative_neighbor_positions = relative_neighbor_positions
         self.max_neighbors = self.__max_num_neighbors()
 
     def __max_num_neighbors(self):
-        max_neighbors = 0
-        for node in range(len(self.node_list)):
-            num_neighbors = self.adjacency_matrix[node].sum()
-            max_neighbors = max(max_neighbors, num_neighbors)
-        return max_neighbors
+        num_neighbors = self.adjacency_matrix[:len(self.node_list)].sum(axis=1)
+        return num_neighbors.max(initial=0)
+
+    def _invalidate_cache(self) -> None:
+        """
+        Clears the cached start position, data position, node list, node types and id/position tables, must be called
+        after the graph layout has been modified. The cached values are re-computed from the layout on the next access.
+
+        :return: None
+        """
+        self._start_pos = None
+        self._data_pos = None
+        self._node_list = None
+        self._id_to_pos = None
+        self._pos_to_id = None
+        self._node_adjacency_ids = None
+        self._node_types = None
 
     def __default_graph_layout(self) -> np.ndarray:
         """
         Creates a default graph layout with a specific set of rows
 
-        :return: Numpy array with a grid and in each position in the grid there is a node-type:
+        :return: int8 Numpy array with a grid and in each position in the grid there is a node-type:
                 START, EMPTY, SERVER, or DATA
         """
-        graph_layout = np.zeros((self.num_rows, self.num_cols))
-        for i in range(self.num_rows):
-            for j in range(self.num_cols):
-                if i == self.num_rows - 1:
-                    if j == self.num_cols // 2:
-                        graph_layout[i][j] = NodeType.START.value
-                    else:
-                        graph_layout[i][j] = NodeType.EMPTY.value
-                elif i == 0:
-                    if j == self.num_cols // 2:
-                        graph_layout[i][j] = NodeType.DATA.value
-                    else:
-                        graph_layout[i][j] = NodeType.EMPTY.value
-                else:
-                    graph_layout[i][j] = NodeType.SERVER.value
+        graph_layout = np.full((self.num_rows, self.num_cols), NodeType.SERVER.value, dtype=np.int8)
+        graph_layout[0, :] = NodeType.EMPTY.value
+        graph_layout[-1, :] = NodeType.EMPTY.value
+        graph_layout[0, self.num_cols // 2] = NodeType.DATA.value
+        # Assigned last so that the start node takes precedence in a single-row layout
+        graph_layout[-1, self.num_cols // 2] = NodeType.START.value
         return graph_layout
 
     def __default_adjacency_matrix(self) -> np.ndarray:
         """
         Creates a default adjacency matrix for a given graph layout
 
-        :return: a numpy matrix representing the adjacency matrix with dimension (num_rows*num_cols, num_rows*num_cols)
-        """
-        adjacency_matrix = np.zeros((self.num_rows * self.num_cols,
-                                     self.num_cols * self.num_rows))
-        for i in range(self.num_rows * self.num_cols):
-            row_1 = i // self.num_cols
-            col_1 = i % self.num_cols
-            for j in range(self.num_rows * self.num_cols):
-                row_2 = j // self.num_cols
-                col_2 = j % self.num_cols
-                if row_1 == self.data_row:
-                    if row_2 == self.data_row+1 and col_1 == self.data_col:
-                        adjacency_matrix[i][j] = 1
-                        adjacency_matrix[j][i] = 1
-                elif row_1 == self.start_row:
-                    if row_2 == self.start_row-1 and col_1 == self.start_col:
-                        adjacency_matrix[i][j] = 1
-                        adjacency_matrix[j][i] = 1
-                elif row_2 == (row_1 + 1) and col_1 == col_2 and row_1 != self.start_row and row_2 != self.start_row:
-                    adjacency_matrix[i][j] = 1
-                    adjacency_matrix[j][i] = 1
-                elif self.connected_layers:
-                    if row_2 == row_1 and col_1 == col_2+1 and row_1 != self.start_row and row_1 != self.data_row:
-                        adjacency_matrix[i][j] = 1
-                        adjacency_matrix[j][i] = 1
-        return adjacency_matrix.astype(np.int32)
+        :return: an int8 numpy matrix representing the adjacency matrix with dimension
+                 (num_rows*num_cols, num_rows*num_cols)
+        """
+        num_nodes = self.num_rows * self.num_cols
+        adjacency_matrix = np.zeros((num_nodes, num_nodes), dtype=np.int8)
+        ids = np.arange(num_nodes)
+        rows = ids // self.num_cols
+        cols = ids % self.num_cols
+        data_row, data_col = self.data_pos
+        start_row, start_col = self.start_pos
+
+        # The data node is connected to all nodes in the row below it
+        data_id = self.get_adjacency_matrix_id(data_row, data_col)
+        neighbors = ids[rows == data_row + 1]
+        adjacency_matrix[data_id, neighbors] = 1
+        adjacency_matrix[neighbors, data_id] = 1
+
+        # The start node is connected to all nodes in the row above it
+        start_id = self.get_adjacency_matrix_id(start_row, start_col)
+        neighbors = ids[rows == start_row - 1]
+        adjacency_matrix[start_id, neighbors] = 1
+        adjacency_matrix[neighbors, start_id] = 1
+
+        # Vertical links between the server layers
+        upper = ids[(rows != data_row) & (rows != start_row) & (rows + 1 != start_row) & (rows + 1 < self.num_rows)]
+        adjacency_matrix[upper, upper + self.num_cols] = 1
+        adjacency_matrix[upper + self.num_cols, upper] = 1
+
+        # Horizontal links within the server layers
+        if self.connected_layers:
+            right = ids[(rows != data_row) & (rows != start_row) & (cols > 0)]
+            adjacency_matrix[right, right - 1] = 1
+            adjacency_matrix[right - 1, right] = 1
+        return adjacency_matrix
 
 
     def get_coords_of_adjacency_matrix_id(self, node_id: int) -> Union[int, int]:
@@ -151,35 +175,63 @@ class NetworkConfig:
         """
         :return: the starting position of the attacker
         """
-        for i in range(self.num_rows):
-            for j in range(self.num_cols):
-                if self.graph_layout[i][j] == NodeType.START.value:
-                    return i, j
-        raise AssertionError("Could not find start node in graph layout")
+        if self._start_pos is None:
+            self._start_pos = self.__find_node_pos(NodeType.START.value)
+            if self._start_pos is None:
+                raise AssertionError("Could not find start node in graph layout")
+        return self._start_pos
 
     @property
     def data_pos(self) -> int:
         """
         :return: the position of the data node in the graph
         """
+        if self._data_pos is None:
+            self._data_pos = self.__find_node_pos(NodeType.DATA.value)
+            if self._data_pos is None:
+                raise AssertionError("Could not find data node in graph layout")
+        return self._data_pos
+
+    def __find_node_pos(self, node_type: int) -> Union[int, int]:
+        """
+        Finds the first position in the graph layout with a given node type
+
+        :param node_type: the node type to look for
+        :return: the (row, col) position or None if there is no such node
+        """
         for i in range(self.num_rows):
             for j in range(self.num_cols):
-                if self.graph_layout[i][j] == NodeType.DATA.value:
+                if self.graph_layout[i][j] == node_type:
                     return i, j
-        raise AssertionError("Could not find data node in graph layout")
+        return None
 
 
     @property
     def node_list(self) -> List[int]:
         """
-        :return: a list of node-types where the index in the list corresponds to the node id.
+        :return: a list of node-types where the index in the list corresponds to the node id. The list is cached
+                 and shared between calls, it should not be modified.
         """
-        node_list = []
-        for i in range(self.num_rows):
-            for j in range(self.num_cols):
-                if self.graph_layout[i][j] != NodeType.EMPTY.value:
-                    node_list.append(self.graph_layout[i][j])
-        return node_list
+        if self._node_list is None:
+            # The layout is an int8 array, the node types are converted to plain ints since numpy scalars are slower
+            # to compare and hash in the per-node legality checks
+            graph_layout = np.asarray(self.graph_layout)
+            self._node_list = graph_layout[graph_layout != NodeType.EMPTY.value].tolist()
+        return self._node_list
+
+    def __node_id_tables(self):
+        """
+        Builds the lookup tables between node ids and grid positions. Node ids are assigned in row-major order to
+        the non-empty positions of the graph layout.
+
+        :return: None
+        """
+        non_empty = self.graph_layout != NodeType.EMPTY.value
+        self._id_to_pos = [(int(i), int(j)) for i, j in np.argwhere(non_empty)]
+        self._pos_to_id = np.full((self.num_rows, self.num_cols), -1, dtype=np.int64)
+        self._pos_to_id[non_empty] = np.arange(len(self._id_to_pos))
+        self._node_adjacency_ids = np.flatnonzero(non_empty)
+        self._node_types = np.take(np.asarray(self.graph_layout), self._node_adjacency_ids)
 
     def get_node_pos(self, node_id: int) -> Union[int, int]:
         """
@@ -190,13 +242,10 @@ class NetworkConfig:
 
         :raises ValueError when the node id cannot be recognized
         """
-        count = 0
-        for i in range(self.num_rows):
-            for j in range(self.num_cols):
-                if node_id == count and self.graph_layout[i][j] != NodeType.EMPTY.value:
-                    return (i, j)
-                if self.graph_layout[i][j] != NodeType.EMPTY.value:
-                    count += 1
+        if self._id_to_pos is None:
+            self.__node_id_tables()
+        if 0 <= node_id < len(self._id_to_pos) and int(node_id) == node_id:
+            return self._id_to_pos[int(node_id)]
         raise ValueError("Invalid node id: {}".format(node_id))
 
     def get_node_id(self, pos: Union[int, int]) -> int:
@@ -209,17 +258,34 @@ class NetworkConfig:
         :raises ValueError when the position could not be found
         """
         row, col = pos
-        count = 0
-        for i in range(self.num_rows):
-            for j in range(self.num_cols):
-                if row == i and col == j:
-                    if self.graph_layout[i][j] == NodeType.EMPTY.value:
-                        return -1
-                    return count
-                if self.graph_layout[i][j] != NodeType.EMPTY.value:
-                    count += 1
+        if self._pos_to_id is None:
+            self.__node_id_tables()
+        if 0 <= row < self.num_rows and 0 <= col < self.num_cols and int(row) == row and int(col) == col:
+            return int(self._pos_to_id[int(row), int(col)])
         raise ValueError("Invalid node position")
 
+    def get_node_adjacency_matrix_ids(self) -> np.ndarray:
+        """
+        Gets the adjacency matrix ids of all nodes
+
+        :return: an array where the index corresponds to the node id and the value to the adjacency matrix id of the
+                 node. The array is cached and shared between calls, it should not be modified.
+        """
+        if self._node_adjacency_ids is None:
+            self.__node_id_tables()
+        return self._node_adjacency_ids
+
+    def get_node_types(self) -> np.ndarray:
+        """
+        Gets the node types of all nodes as an array, for vectorized lookups of many nodes at once (single lookups
+        are cheaper with node_list)
+
+        :return: an array where the index corresponds to the node id and the value to the node type. The array is
+                 cached and shared between calls, it should not be modified.
+        """
+        if self._node_types is None:
+            self.__node_id_tables()
+        return self._node_types
 
     def get_row_ids(self, row):
         ids = []
@@ -122,6 +122,9 @@ class IdsGameEnv(gym.Env, ABC):
                                             100*constants.GAME_CONFIG.NEGATIVE_REWARD), True, True, info
 
         attack_action, defense_action = action
+        # The configs are looked up once per step instead of through the attribute chain at every use
+        game_config = self.idsgame_config.game_config
+        network_config = game_config.network_config
 
         # 1. Interpret attacker action
         attacker_pos = self.state.attacker_pos
@@ -134,20 +137,19 @@ class IdsGameEnv(gym.Env, ABC):
         trajectory.append([defense_node_id, defense_pos, defense_type])
 
         # 3. Defend
-        detect = defense_type == self.idsgame_config.game_config.num_attack_types
-        defense_successful = self.state.defend(defense_node_id, defense_type, self.idsgame_config.game_config.max_value,
-                          self.idsgame_config.game_config.network_config, detect=detect)
+        detect = defense_type == game_config.num_attack_types
+        defense_successful = self.state.defend(defense_node_id, defense_type, game_config.max_value, network_config,
+                                               detect=detect)
         if defense_successful:
             self.defenses.append((defense_node_id, defense_type, detect, self.state.game_step))
         self.state.add_defense_event(defense_pos, defense_type)
 
-        if attack_action != -1 and util.is_attack_legal(target_pos, attacker_pos, self.idsgame_config.game_config.network_config,
-                                past_positions=self.past_positions):
+        if attack_action != -1 and util.is_attack_legal(target_pos, attacker_pos, network_config,
+                                                        past_positions=self.past_positions):
             self.past_moves.append(target_node_id)
             if not reconnaissance:
                 # 4. Attack
-                self.state.attack(target_node_id, attack_type, self.idsgame_config.game_config.max_value,
-                                  self.idsgame_config.game_config.network_config,
+                self.state.attack(target_node_id, attack_type, game_config.max_value, network_config,
                                   reconnaissance_enabled=self.idsgame_config.reconnaissance_actions)
             else:
                 rec_reward = self.state.reconnaissance(target_node_id, attack_type, reconnaissance_reward=self.idsgame_config.reconnaissance_reward)
@@ -160,8 +162,7 @@ class IdsGameEnv(gym.Env, ABC):
             attack_successful = False
             if not reconnaissance:
                 # 5. Simulate attack outcome
-                attack_successful = self.state.simulate_attack(target_node_id, attack_type,
-                                                               self.idsgame_config.game_config.network_config)
+                attack_successful = self.state.simulate_attack(target_node_id, attack_type, network_config)
             if self.idsgame_config.save_attack_stats:
                 self.total_attacks.append([target_node_id, attack_successful, reconnaissance])
 
@@ -172,7 +173,7 @@ class IdsGameEnv(gym.Env, ABC):
                     self.past_positions.append(target_pos)
                     self.state.attacker_pos = target_pos
                     self.hacked_nodes.append(target_node_id)
-                    if target_pos == self.idsgame_config.game_config.network_config.data_pos:
+                    if target_pos == network_config.data_pos:
                         self.state.done = True
                         self.state.hacked = True
                         reward = self.get_hack_reward(attack_type, target_node_id)
@@ -352,6 +353,24 @@ class IdsGameEnv(gym.Env, ABC):
         import gym_idsgame.envs.util.idsgame_util as util
         return util.is_defense_id_legal(defense_action, self.idsgame_config.game_config, self.state)
 
+    def attack_legal_mask(self) -> np.ndarray:
+        """
+        Checks the legality of all attack actions at once
+
+        :return: a boolean array where the index corresponds to the attack action, True if the attack is legal
+        """
+        import gym_idsgame.envs.util.idsgame_util as util
+        return util.attack_legal_mask(self.idsgame_config.game_config, self.state.attacker_pos, self.state)
+
+    def defense_legal_mask(self) -> np.ndarray:
+        """
+        Checks the legality of all defense actions at once
+
+        :return: a boolean array where the index corresponds to the defense action, True if the defense is legal
+        """
+        import gym_idsgame.envs.util.idsgame_util as util
+        return util.defense_legal_mask(self.idsgame_config.game_config)
+
     def save_initial_state(self) -> None:
         """
         Saves initial state to disk in binary npy format
@@ -583,11 +602,12 @@ class IdsGameEnv(gym.Env, ABC):
         :param idsgame_config: the config to validate
         :return: None
         """
-        if idsgame_config.game_config.num_layers < 0:
+        game_config = idsgame_config.game_config
+        if game_config.num_layers < 0:
             raise AssertionError("The number of layers cannot be less than 0")
-        if idsgame_config.game_config.num_attack_types < 1:
+        if game_config.num_attack_types < 1:
             raise AssertionError("The number of attack types cannot be less than 1")
-        if idsgame_config.game_config.max_value < 1:
+        if game_config.max_value < 1:
             raise AssertionError("The max attack/defense value cannot be less than 1")
 
     def get_blocked_attack_reward(self, target_node_id : int, attack_type : int) -> Union[int, int]:
@@ -1,7 +1,7 @@
 """
 Utility functions for the gym-idsgame environment
 """
-from typing import Union, List
+from typing import Tuple, List, Optional
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
@@ -13,6 +13,9 @@ import cv2
 from gym_idsgame.envs.dao.node_type import NodeType
 #from gym_idsgame.envs.dao.network_config import NetworkConfig
 
+# Node types that can be attacked and defended, looked up once instead of resolving the enum values on every check
+RESOURCE_NODE_TYPES = frozenset((NodeType.SERVER.value, NodeType.DATA.value))
+
 # def validate_config(idsgame_config: IdsGameConfig) -> None:
 #     """
 #     Validates the configuration for the environment
@@ -37,6 +40,9 @@ def is_defense_id_legal(defense_id: int, game_config, state) -> bool:
     :param state: the game state
     :return: True if legal otherwise False
     """
+    defense_legal_mask = game_config.get_defense_legal_mask()
+    if 0 <= defense_id < len(defense_legal_mask) and int(defense_id) == defense_id:
+        return defense_legal_mask.item(int(defense_id))
     server_id, server_pos, defense_type = interpret_defense_action(defense_id, game_config)
 
     # if defense_type < game_config.num_attack_types:
@@ -47,39 +53,10 @@ def is_defense_id_legal(defense_id: int, game_config, state) -> bool:
     #     if state.defense_det[server_id] >= game_config.max_value:
     #         return False
 
-    if (game_config.network_config.node_list[server_id] == NodeType.SERVER.value
-        or game_config.network_config.node_list[server_id] == NodeType.DATA.value):
-        return True
-    return False
-
-
-def is_attack_legal(target_pos: Union[int, int], attacker_pos: Union[int, int], network_config,
-                    past_positions: List[int] = None) -> bool:
-    """
-    Checks whether an attack is legal. That is, can the attacker reach the target node from its current
-    position in 1 step given the network configuration?
-
-    :param attacker_pos: the position of the attacker
-    :param target_pos: the position of the target node
-    :param network_config: the network configuration
-    :param past_positions: if not None, used to check whether the agent is in a periodic policy, e.g. a circle.
-    :return: True if the attack is legal, otherwise False
-    """
-    if target_pos == attacker_pos:
-        return False
-    target_row, target_col = target_pos
-    attacker_row, attacker_col = attacker_pos
-    if target_row > attacker_row:
-        return False
-    # if past_positions is not None and len(past_positions) >=2:
-    #     if target_pos in past_positions[-3:]:
-    #         return False
-    attacker_adjacency_matrix_id = attacker_row * network_config.num_cols + attacker_col
-    target_adjacency_matrix_id = target_row * network_config.num_cols + target_col
-    return network_config.adjacency_matrix[attacker_adjacency_matrix_id][target_adjacency_matrix_id] == int(1)
+    return game_config.network_config.node_list[server_id] in RESOURCE_NODE_TYPES
 
 
-def is_node_attack_legal(target_node : int, attacker_pos : Union[int, int], network_config) -> bool:
+def is_node_attack_legal(target_node : int, attacker_pos : Tuple[int, int], network_config) -> bool:
     target_pos = network_config.get_node_pos(target_node)
 
     target_row, target_col = target_pos
@@ -88,12 +65,14 @@ def is_node_attack_legal(target_node : int, attacker_pos : Union[int, int], netw
     attacker_adjacency_matrix_id = attacker_row * network_config.num_cols + attacker_col
     target_adjacency_matrix_id = target_row * network_config.num_cols + target_col
 
-    return network_config.adjacency_matrix[attacker_adjacency_matrix_id][target_adjacency_matrix_id] == int(1)
+    adjacency_matrix = network_config.adjacency_matrix
+    # The adjacency matrix is square, so its length is also the row stride (cheaper than building the shape tuple)
+    return adjacency_matrix.item(attacker_adjacency_matrix_id * len(adjacency_matrix)
+                                 + target_adjacency_matrix_id) == 1
 
 
 def is_node_defense_legal(target_node : int, network_config, state, max_value:int) -> bool:
-    if (network_config.node_list[target_node] == NodeType.SERVER.value
-            or network_config.node_list[target_node] == NodeType.DATA.value):
+    if network_config.node_list[target_node] in RESOURCE_NODE_TYPES:
         if state.defense_det[target_node] < max_value:
             return True
         for i in range(len(state.defense_values[target_node])):
@@ -102,8 +81,8 @@ def is_node_defense_legal(target_node : int, network_config, state, max_value:in
         return False
     return False
 
-def is_attack_legal(target_pos: Union[int, int], attacker_pos: Union[int, int], network_config,
-                    past_positions: List[int] = None) -> bool:
+def is_attack_legal(target_pos: Tuple[int, int], attacker_pos: Tuple[int, int], network_config,
+                    past_positions: Optional[List[int]] = None) -> bool:
     """
     Checks whether an attack is legal. That is, can the attacker reach the target node from its current
     position in 1 step given the network configuration?
@@ -114,22 +93,25 @@ def is_attack_legal(target_pos: Union[int, int], attacker_pos: Union[int, int],
     :param past_positions: if not None, used to check whether the agent is in a periodic policy, e.g. a circle.
     :return: True if the attack is legal, otherwise False
     """
-    if target_pos == attacker_pos:
-        return False
     target_row, target_col = target_pos
     attacker_row, attacker_col = attacker_pos
-    if target_row > attacker_row:
+    if target_row > attacker_row or (target_row == attacker_row and target_col == attacker_col):
         return False
     # if past_positions is not None and len(past_positions) >=2:
     #     if target_pos in past_positions[-3:]:
     #         return False
-    attacker_adjacency_matrix_id = attacker_row * network_config.num_cols + attacker_col
-    target_adjacency_matrix_id = target_row * network_config.num_cols + target_col
-    return network_config.adjacency_matrix[attacker_adjacency_matrix_id][target_adjacency_matrix_id] == int(1)
-
-
-def is_attack_id_legal(attack_id: int, game_config, attacker_pos: Union[int, int], game_state,
-                       past_positions: List[int] = None, past_reconnaissance_activities: List = None) -> bool:
+    num_cols = network_config.num_cols
+    adjacency_matrix = network_config.adjacency_matrix
+    # The (C-contiguous) adjacency matrix is read with a single flat-indexed item() lookup, which returns a python
+    # int directly, without materializing the row of the attacker or a numpy scalar first. The matrix is square, so
+    # its length is also the row stride (cheaper than building the shape tuple)
+    return adjacency_matrix.item((attacker_row * num_cols + attacker_col) * len(adjacency_matrix)
+                                 + target_row * num_cols + target_col) == 1
+
+
+def is_attack_id_legal(attack_id: int, game_config, attacker_pos: Tuple[int, int], game_state,
+                       past_positions: Optional[List[int]] = None,
+                       past_reconnaissance_activities: Optional[List[Tuple[int, int]]] = None) -> bool:
     """
     Check if a given attack is legal or not.
 
@@ -140,9 +122,14 @@ def is_attack_id_legal(attack_id: int, game_config, attacker_pos: Union[int, int
     :param past_positions: if not None, used to check whether the agent is in a periodic policy, e.g. a circle.
     :return: True if legal otherwise False
     """
-    server_id, server_pos, attack_type, reconnaissance = interpret_attack_action(attack_id, game_config)
+    # Looked up in the action table directly, the call to interpret_attack_action is only made for ids outside of it
+    attack_action_table = game_config.get_attack_action_table()
+    if 0 <= attack_id < len(attack_action_table) and int(attack_id) == attack_id:
+        server_id, server_pos, attack_type, reconnaissance = attack_action_table[int(attack_id)]
+    else:
+        server_id, server_pos, attack_type, reconnaissance = interpret_attack_action(attack_id, game_config)
     if not reconnaissance:
-        if game_state.attack_values[server_id][attack_type] >= game_config.max_value:
+        if game_state.attack_values.item(server_id, attack_type) >= game_config.max_value:
             return False
     # if reconnaissance and past_reconnaissance_activities is not None:
     #     for rec_act in past_reconnaissance_activities[-5:]:
@@ -153,14 +140,55 @@ def is_attack_id_legal(attack_id: int, game_config, attacker_pos: Union[int, int
     return is_attack_legal(server_pos, attacker_pos, game_config.network_config, past_positions)
 
 
-def interpret_attack_action(action: int, game_config) -> Union[int, Union[int, int], int, bool]:
+def attack_legal_mask(game_config, attacker_pos: Tuple[int, int], game_state) -> np.ndarray:
+    """
+    Checks the legality of all attack actions at once, the vectorized equivalent of calling is_attack_id_legal for
+    every attack action id.
+
+    :param game_config: game configuration
+    :param attacker_pos: the current position of the attacker
+    :param game_state: the game state
+    :return: a boolean array where the index corresponds to the attack action id, True if the attack is legal
+    """
+    network_config = game_config.network_config
+    num_attack_types = game_config.num_attack_types
+    types_per_node = num_attack_types + 1 if game_config.reconnaissance_actions else num_attack_types
+    node_ids = network_config.get_node_adjacency_matrix_ids()
+    attacker_row, attacker_col = attacker_pos
+    attacker_id = attacker_row * network_config.num_cols + attacker_col
+    # A target node must be a neighbor of the attacker that is not below it in the network
+    reachable = (network_config.adjacency_matrix[attacker_id, node_ids] == 1) & (node_ids != attacker_id) \
+                & (node_ids // network_config.num_cols <= attacker_row)
+    legal = np.repeat(reachable[:, np.newaxis], types_per_node, axis=1)
+    # Attacks (but not reconnaissance activities) are only legal until the attack value is maxed out
+    legal[:, :num_attack_types] &= np.asarray(game_state.attack_values)[:, :num_attack_types] \
+                                   < game_config.max_value
+    return legal.ravel()
+
+
+def defense_legal_mask(game_config) -> np.ndarray:
+    """
+    Checks the legality of all defense actions at once, the vectorized equivalent of calling is_defense_id_legal for
+    every defense action id.
+
+    :param game_config: game configuration
+    :return: a boolean array where the index corresponds to the defense action id, True if the defense is legal. The
+             array is cached on the game config and should not be modified.
+    """
+    return game_config.get_defense_legal_mask()
+
+
+def interpret_attack_action(action: int, game_config) -> Tuple[int, Tuple[int, int], int, bool]:
     """
     Utility method for interpreting the given attack action, converting it into server_id,pos,type
 
     :param action: the attack action-id
     :param game_config: game configuration
-    :return: server-id, server-position, attack-type
+    :return: server-id, server-position, attack-type, whether the action is a reconnaissance activity
     """
+    attack_action_table = game_config.get_attack_action_table()
+    if 0 <= action < len(attack_action_table) and int(action) == action:
+        return attack_action_table[int(action)]
     if not game_config.reconnaissance_actions:
         server_id = action // game_config.num_attack_types
     else:
@@ -175,21 +203,24 @@ def interpret_attack_action(action: int, game_config) -> Union[int, Union[int, i
     #print("server:{},pos:{},a_type:{},rec:{}".format(server_id, server_pos, attack_type, reconnaissance))
     return server_id, server_pos, attack_type, reconnaissance
 
-def interpret_defense_action(action: int, game_config) -> Union[int, Union[int, int], int]:
+def interpret_defense_action(action: int, game_config) -> Tuple[int, Tuple[int, int], int]:
     """
     Utility method for interpreting the given action, converting it into server_id,pos,type
 
     :param action: the attack action-id
     :param game_config: game configuration
-    :return: server-id, server-position, attack-type
+    :return: server-id, server-position, defense-type
     """
+    defense_action_table = game_config.get_defense_action_table()
+    if 0 <= action < len(defense_action_table) and int(action) == action:
+        return defense_action_table[int(action)]
     server_id = action // (game_config.num_attack_types+1) # +1 for detection type attack
     server_pos = game_config.network_config.get_node_pos(server_id)
     defense_type = get_defense_type(action, game_config)
     return server_id, server_pos, defense_type
 
 
-def get_attack_action_id(server_id, attack_type, game_config):
+def get_attack_action_id(server_id: int, attack_type: int, game_config) -> int:
     """
     Gets the attack action id from a given server position, attack_type, and game config
 
@@ -205,7 +236,7 @@ def get_attack_action_id(server_id, attack_type, game_config):
     return action_id
 
 
-def get_defense_action_id(server_id, defense_type, game_config):
+def get_defense_action_id(server_id: int, defense_type: int, game_config) -> int:
     """
     Gets the defense action id from a given server position, defense_type, and game config
 
@@ -245,7 +276,7 @@ def get_defense_type(action: int, game_config) -> int:
     return defense_type
 
 
-def get_img_from_fig(fig, dpi=180):
+def get_img_from_fig(fig, dpi: int = 180) -> np.ndarray:
     """
     Convert matplotlib fig to numpy array
 
@@ -265,7 +296,7 @@ def get_img_from_fig(fig, dpi=180):
 
 def action_dist_hist(data: np.ndarray,
                            title: str = "Test", xlabel: str = "test", ylabel: str = "test",
-                           file_name: str = "test.eps", xlims: Union[float, float] = None) -> np.ndarray:
+                           file_name: str = "test.eps", xlims: Optional[Tuple[float, float]] = None) -> np.ndarray:
     """
     Plot a distribution of the policy
 
@@ -316,14 +347,14 @@ def action_dist_hist(data: np.ndarray,
     return data
 
 
-def defense_score(game_sate, network_config, game_config):
+def defense_score(game_sate, network_config, game_config) -> float:
     total_min_def = 0
+    node_list = game_config.network_config.node_list
     for row in range(network_config.num_rows):
         min_def = float("inf")
         for col in range(network_config.num_cols):
             node_id = network_config.get_node_id((row, col))
-            if (game_config.network_config.node_list[node_id] == NodeType.SERVER.value
-                    or game_config.network_config.node_list[node_id] == NodeType.DATA.value):
+            if node_list[node_id] in RESOURCE_NODE_TYPES:
                 d = np.min(game_sate.defense_values[node_id])
                 if d < min_def:
                     min_def = d
@@ -0,0 +1,38 @@
+"""
+Tests for baseline_env_wrapper.py
+"""
+
+import pytest
+import logging
+import numpy as np
+import gym_idsgame.envs.util.idsgame_util as util
+from gym_idsgame.agents.training_agents.openai_baselines.common.baseline_env_wrapper import BaselineEnvWrapper
+from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
+
+class TestBaselineEnvWrapperSuite():
+    pytest.logger = logging.getLogger("baseline_env_wrapper_tests")
+
+    def test_local_attack_legal_mask(self):
+        env_wrapper = BaselineEnvWrapper("idsgame-v18", pg_agent_config=PolicyGradientAgentConfig(
+            output_dim_attacker=10))
+        env = env_wrapper.idsgame_env
+        game_config = env.idsgame_config.game_config
+        assert env.local_view_features() and game_config.reconnaissance_actions
+        env.reset()
+        np.random.seed(0)
+        for _ in range(200):
+            attacker_obs, _ = env.get_observation()
+            global_legal_mask = util.attack_legal_mask(game_config, env.state.attacker_pos, env.state)
+            local_legal_mask = env_wrapper.local_attack_legal_mask(global_legal_mask, attacker_obs)
+            assert len(local_legal_mask) == game_config.num_attack_actions
+            for local_attack_id in range(game_config.num_attack_actions):
+                attack_id = env_wrapper.convert_local_attacker_action_to_global(local_attack_id, attacker_obs)
+                legal = attack_id != -1 and util.is_attack_id_legal(attack_id, game_config, env.state.attacker_pos,
+                                                                    env.state)
+                assert local_legal_mask[local_attack_id] == legal
+            local_attack_id = np.random.choice(np.flatnonzero(local_legal_mask)) if local_legal_mask.any() else 0
+            attack_id = env_wrapper.convert_local_attacker_action_to_global(local_attack_id, attacker_obs)
+            defense_id = np.random.choice(np.flatnonzero(util.defense_legal_mask(game_config)))
+            _, _, done, _, _ = env.step((int(attack_id), int(defense_id)))
+            if done:
+                env.reset()
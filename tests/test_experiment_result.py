@@ -0,0 +1,76 @@
+"""
+Tests for experiment_result.py
+"""
+
+import csv
+import pytest
+import logging
+import numpy as np
+from gym_idsgame.agents.dao.experiment_result import ExperimentResult
+
+class TestExperimentResultSuite():
+    pytest.logger = logging.getLogger("experiment_result_tests")
+
+    @staticmethod
+    def metrics(i):
+        return {metric: float(i + j) for j, metric in enumerate(ExperimentResult.RECORDED_METRICS)}
+
+    def test_record(self):
+        result = ExperimentResult()
+        for i in range(3):
+            result.record(**TestExperimentResultSuite.metrics(i))
+        assert result.avg_episode_steps == [0.0, 1.0, 2.0]
+        assert result.lr_list == [10.0, 11.0, 12.0]
+
+    def test_record_invalid_metrics(self):
+        for preallocate in [False, True]:
+            result = ExperimentResult()
+            if preallocate:
+                result.preallocate(4)
+            metrics = TestExperimentResultSuite.metrics(0)
+            del metrics["lr_list"]
+            with pytest.raises(ValueError):
+                result.record(**metrics)
+            metrics["lr_list"] = 0.0
+            metrics["unknown_metric"] = 0.0
+            with pytest.raises(ValueError):
+                result.record(**metrics)
+            assert len(result.avg_episode_steps) == 0
+            assert len(result.lr_list) == 0
+
+    def test_preallocate(self):
+        result = ExperimentResult()
+        result.record(**TestExperimentResultSuite.metrics(0))
+        result.preallocate(2)
+        assert list(result.avg_episode_steps) == [0.0]
+        # Records past the capacity grow the buffers
+        for i in range(1, 5):
+            result.record(**TestExperimentResultSuite.metrics(i))
+        expected = ExperimentResult()
+        for i in range(5):
+            expected.record(**TestExperimentResultSuite.metrics(i))
+        for metric in ExperimentResult.RECORDED_METRICS:
+            assert isinstance(getattr(result, metric), np.ndarray)
+            assert list(getattr(result, metric)) == getattr(expected, metric)
+
+    def test_to_csv(self, tmpdir):
+        list_result = ExperimentResult()
+        preallocated_result = ExperimentResult()
+        preallocated_result.preallocate(1)
+        for i in range(3):
+            list_result.record(**TestExperimentResultSuite.metrics(i))
+            preallocated_result.record(**TestExperimentResultSuite.metrics(i))
+        list_path = str(tmpdir.join("list.csv"))
+        preallocated_path = str(tmpdir.join("preallocated.csv"))
+        list_result.to_csv(list_path)
+        preallocated_result.to_csv(preallocated_path)
+        with open(list_path) as f:
+            list_rows = list(csv.reader(f))
+        with open(preallocated_path) as f:
+            preallocated_rows = list(csv.reader(f))
+        assert len(list_rows) == 4
+        assert "avg_episode_steps" in list_rows[0] and "attacker_wins" not in list_rows[0]
+        assert [float(v) for v in list_rows[1]] == [float(v) for v in preallocated_rows[1]]
+        assert [float(v) for v in list_rows[3]] == [float(v) for v in preallocated_rows[3]]
+        assert list_rows[0] == preallocated_rows[0]
+        assert not tmpdir.join("list.csv.tmp").exists()
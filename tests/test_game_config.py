@@ -5,6 +5,7 @@ Tests for game_config.py
 import pytest
 import logging
 from gym_idsgame.envs.dao.game_config import GameConfig
+from gym_idsgame.envs.dao.node_type import NodeType
 
 class TestConfigSuite():
     pytest.logger = logging.getLogger("gameconfig_tests")
@@ -12,4 +13,34 @@ class TestConfigSuite():
     def test_initialization(self):
         game_config = GameConfig()
         assert game_config.initial_state is not None
-        assert game_config.network_config is not None
\ No newline at end of file
+        assert game_config.network_config is not None
+
+    def test_observation_space(self):
+        game_config = GameConfig(num_layers=2, num_servers_per_layer=3, num_attack_types=4, max_value=9)
+        attacker_obs_space = game_config.get_attacker_observation_space()
+        assert attacker_obs_space.shape == (game_config.num_nodes, 5)
+        assert (attacker_obs_space.high == 9).all()
+        assert game_config.get_attacker_observation_space() is attacker_obs_space
+        defender_obs_space = game_config.get_defender_observation_space()
+        assert defender_obs_space.shape == (1, 5)
+        assert (defender_obs_space.low == 0).all()
+
+    def test_action_tables(self):
+        game_config = GameConfig(num_layers=2, num_servers_per_layer=3, num_attack_types=4, max_value=9)
+        attack_action_table = game_config.get_attack_action_table()
+        assert len(attack_action_table) == game_config.num_attack_actions
+        assert attack_action_table[5] == (1, game_config.network_config.get_node_pos(1), 1, False)
+        assert game_config.get_attack_action_table() is attack_action_table
+        defense_action_table = game_config.get_defense_action_table()
+        assert len(defense_action_table) == game_config.num_defense_actions
+        assert defense_action_table[9] == (1, game_config.network_config.get_node_pos(1), 4)
+        game_config.reconnaissance_actions = True
+        assert game_config.get_attack_action_table()[9] == (1, game_config.network_config.get_node_pos(1), 0, True)
+
+    def test_defense_legal_mask(self):
+        game_config = GameConfig(num_layers=1, num_servers_per_layer=3, num_attack_types=2, max_value=9)
+        defense_legal_mask = game_config.get_defense_legal_mask()
+        assert len(defense_legal_mask) == game_config.num_defense_actions
+        for defense_id, (server_id, _, _) in enumerate(game_config.get_defense_action_table()):
+            node_type = game_config.network_config.node_list[server_id]
+            assert defense_legal_mask[defense_id] == (node_type != NodeType.START.value)
@@ -0,0 +1,39 @@
+"""
+Tests for idsgame_util.py
+"""
+
+import pytest
+import logging
+import numpy as np
+import gymnasium as gym
+import gym_idsgame
+import gym_idsgame.envs.util.idsgame_util as util
+
+class TestIdsGameUtilSuite():
+    pytest.logger = logging.getLogger("idsgame_util_tests")
+
+    @pytest.mark.parametrize("env_name", ["idsgame-v0", "idsgame-v4", "idsgame-v16", "idsgame-v18", "idsgame-v19",
+                                          "idsgame-v21"])
+    def test_legal_masks(self, env_name):
+        env = gym.make(env_name).unwrapped
+        game_config = env.idsgame_config.game_config
+        env.reset()
+        np.random.seed(0)
+        for _ in range(200):
+            attack_legal_mask = util.attack_legal_mask(game_config, env.state.attacker_pos, env.state)
+            # The mask covers the global attack actions, also in local view environments
+            num_nodes = game_config.num_nodes
+            assert len(attack_legal_mask) == num_nodes * (game_config.num_attack_types
+                                                          + int(game_config.reconnaissance_actions))
+            for attack_id in range(len(attack_legal_mask)):
+                assert attack_legal_mask[attack_id] == util.is_attack_id_legal(attack_id, game_config,
+                                                                               env.state.attacker_pos, env.state)
+            defense_legal_mask = util.defense_legal_mask(game_config)
+            assert len(defense_legal_mask) == game_config.num_defense_actions
+            for defense_id in range(game_config.num_defense_actions):
+                assert defense_legal_mask[defense_id] == util.is_defense_id_legal(defense_id, game_config, env.state)
+            attack_id = np.random.choice(np.flatnonzero(attack_legal_mask)) if attack_legal_mask.any() else 0
+            defense_id = np.random.choice(np.flatnonzero(defense_legal_mask))
+            _, _, done, _, _ = env.step((int(attack_id), int(defense_id)))
+            if done:
+                env.reset()
@@ -0,0 +1,143 @@
+"""
+Tests for saving and loading models in base_class.py
+"""
+
+import io
+import zipfile
+import pytest
+import logging
+import torch as th
+from stable_baselines3.common.save_util import data_to_json as sb3_data_to_json
+from gym_idsgame.agents.training_agents.policy_gradient.pg_agent_config import PolicyGradientAgentConfig
+from gym_idsgame.agents.training_agents.openai_baselines.common.base_class import BaseRLModel
+
+try:
+    import safetensors
+except ImportError:
+    safetensors = None
+
+class TestModelCheckpointSuite():
+    pytest.logger = logging.getLogger("model_checkpoint_tests")
+
+    @staticmethod
+    def model():
+        th.manual_seed(0)
+        policy = th.nn.Linear(4, 3)
+        optimizer = th.optim.Adam(policy.parameters())
+        policy(th.ones(2, 4)).sum().backward()
+        optimizer.step()
+        data = {"gamma": 0.99, "n_steps": 128, "policy_kwargs": {"net_arch": [32, 32]}}
+        params = {"attacker_policy": policy.state_dict(), "attacker_policy.optimizer": optimizer.state_dict()}
+        tensors = {"log_std": th.arange(3, dtype=th.float32)}
+        return data, params, tensors
+
+    @staticmethod
+    def config(**flags):
+        return PolicyGradientAgentConfig(gpu=False, **flags)
+
+    @staticmethod
+    def assert_loaded(loaded, expected):
+        data, params, tensors = loaded
+        expected_data, expected_params, expected_tensors = expected
+        assert data == expected_data
+        assert set(params.keys()) == set(expected_params.keys())
+        for name, value in expected_params["attacker_policy"].items():
+            assert th.equal(params["attacker_policy"][name], value)
+        optimizer_state = params["attacker_policy.optimizer"]["state"]
+        for idx, state in expected_params["attacker_policy.optimizer"]["state"].items():
+            for name, value in state.items():
+                assert th.equal(optimizer_state[idx][name], value)
+        assert th.equal(tensors["log_std"], expected_tensors["log_std"])
+
+    @pytest.mark.parametrize("coalesce_params", [False, True])
+    @pytest.mark.parametrize("use_fast_loader", [False, True])
+    @pytest.mark.parametrize("skip_zip_crc_check", [False, True])
+    def test_zip_round_trip(self, tmpdir, coalesce_params, use_fast_loader, skip_zip_crc_check):
+        data, params, tensors = TestModelCheckpointSuite.model()
+        path = str(tmpdir.join("model.zip"))
+        BaseRLModel._save_to_file_zip(path, data=data, params=params, tensors=tensors,
+                                      coalesce_params=coalesce_params)
+        names = zipfile.ZipFile(path).namelist()
+        if coalesce_params:
+            assert "params.pth" in names and "params_manifest" in names
+        else:
+            assert "attacker_policy.pth" in names and "attacker_policy.optimizer.pth" in names
+        config = TestModelCheckpointSuite.config(use_fast_loader=use_fast_loader,
+                                                 skip_zip_crc_check=skip_zip_crc_check,
+                                                 load_to_cpu_then_move=True)
+        TestModelCheckpointSuite.assert_loaded(BaseRLModel._load_from_file(path, pg_agent_config=config),
+                                               (data, params, tensors))
+        # The ".zip" suffix is optional and file-like objects are read as well
+        TestModelCheckpointSuite.assert_loaded(BaseRLModel._load_from_file(path[:-len(".zip")],
+                                                                           pg_agent_config=config),
+                                               (data, params, tensors))
+        with open(path, "rb") as f:
+            TestModelCheckpointSuite.assert_loaded(BaseRLModel._load_from_file(io.BytesIO(f.read()),
+                                                                               pg_agent_config=config),
+                                                   (data, params, tensors))
+
+    @pytest.mark.parametrize("use_fast_loader", [False, True])
+    def test_zip_crc_check(self, tmpdir, use_fast_loader):
+        data, params, tensors = TestModelCheckpointSuite.model()
+        path = str(tmpdir.join("model.zip"))
+        BaseRLModel._save_to_file_zip(path, data=data, params=params, tensors=tensors)
+        with open(path, "rb") as f:
+            content = f.read()
+        # Changes the stored gamma without updating the CRC32 of the data member
+        assert content.count(b"0.99") == 1
+        with open(path, "wb") as f:
+            f.write(content.replace(b"0.99", b"0.98"))
+        # The CRC mismatch is detected when the member is read
+        with pytest.raises(ValueError, match="zip-file"):
+            BaseRLModel._load_from_file(path, pg_agent_config=TestModelCheckpointSuite.config(
+                use_fast_loader=use_fast_loader))
+        loaded = BaseRLModel._load_from_file(path, pg_agent_config=TestModelCheckpointSuite.config(
+            use_fast_loader=use_fast_loader, skip_zip_crc_check=True))
+        data["gamma"] = 0.98
+        TestModelCheckpointSuite.assert_loaded(loaded, (data, params, tensors))
+
+    def test_torch_checkpoint_round_trip(self, tmpdir):
+        data, params, tensors = TestModelCheckpointSuite.model()
+        path = str(tmpdir.join("model.zip"))
+        BaseRLModel._save_to_file_torch(path, data=data, params=params, tensors=tensors)
+        assert BaseRLModel._is_torch_checkpoint(path)
+        for use_fast_loader in [False, True]:
+            config = TestModelCheckpointSuite.config(use_fast_loader=use_fast_loader)
+            TestModelCheckpointSuite.assert_loaded(BaseRLModel._load_from_file(path, pg_agent_config=config),
+                                                   (data, params, tensors))
+
+    def test_safetensors_round_trip(self, tmpdir):
+        data, params, tensors = TestModelCheckpointSuite.model()
+        path = str(tmpdir.join("model.zip"))
+        BaseRLModel._save_to_file_zip(path, data=data, params=params, tensors=tensors, use_safetensors=True)
+        names = zipfile.ZipFile(path).namelist()
+        if safetensors is None:
+            # Without the package the archive falls back to th.save members
+            assert "tensors.pth" in names and "attacker_policy.pth" in names
+        else:
+            assert "tensors.safetensors" in names and "attacker_policy.safetensors" in names
+            # Optimizer states are not flat tensor dicts and are always stored with th.save
+            assert "attacker_policy.optimizer.pth" in names
+        for use_fast_loader in [False, True]:
+            config = TestModelCheckpointSuite.config(use_fast_loader=use_fast_loader)
+            TestModelCheckpointSuite.assert_loaded(BaseRLModel._load_from_file(path, pg_agent_config=config),
+                                                   (data, params, tensors))
+
+    @pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+    def test_load_legacy_archive(self, tmpdir, compression):
+        data, params, tensors = TestModelCheckpointSuite.model()
+        path = str(tmpdir.join("legacy.zip"))
+        # Written like the archives of earlier versions, with the zip-based torch serialization of each member
+        with zipfile.ZipFile(path, "w", compression=compression) as archive:
+            archive.writestr("data", sb3_data_to_json(data))
+            with archive.open("tensors.pth", mode="w") as tensors_file:
+                th.save(tensors, tensors_file)
+            for file_name, dict_ in params.items():
+                with archive.open(file_name + ".pth", mode="w") as param_file:
+                    th.save(dict_, param_file)
+        for use_fast_loader in [False, True]:
+            for skip_zip_crc_check in [False, True]:
+                config = TestModelCheckpointSuite.config(use_fast_loader=use_fast_loader,
+                                                         skip_zip_crc_check=skip_zip_crc_check)
+                TestModelCheckpointSuite.assert_loaded(BaseRLModel._load_from_file(path, pg_agent_config=config),
+                                                       (data, params, tensors))
@@ -5,6 +5,7 @@ Tests for network_config.py
 import pytest
 import logging
 from gym_idsgame.envs.dao.network_config import NetworkConfig
+from gym_idsgame.envs.dao.node_type import NodeType
 
 class TestIdsGameConfigSuite():
     pytest.logger = logging.getLogger("network_config")
@@ -88,6 +89,10 @@ class TestIdsGameConfigSuite():
         assert network_config.get_node_pos(2) == (1, 1)
         assert network_config.get_node_pos(3) == (1, 2)
         assert network_config.get_node_pos(4) == (2, 1)
+        with pytest.raises(ValueError):
+            network_config.get_node_pos(5)
+        with pytest.raises(ValueError):
+            network_config.get_node_pos(-1)
 
 
     def test_get_node_id(self):
@@ -103,3 +108,40 @@ class TestIdsGameConfigSuite():
         assert network_config.get_node_id((2, 0)) == -1
         assert network_config.get_node_id((0, 0)) == -1
         assert network_config.get_node_id((0, 2)) == -1
+        with pytest.raises(ValueError):
+            network_config.get_node_id((3, 0))
+        with pytest.raises(ValueError):
+            network_config.get_node_id((-1, 1))
+
+    def test_get_node_adjacency_matrix_ids(self):
+        num_rows = 3
+        num_cols = 3
+        network_config = NetworkConfig(num_rows, num_cols)
+        adjacency_ids = network_config.get_node_adjacency_matrix_ids()
+        assert len(adjacency_ids) == len(network_config.node_list)
+        for node_id, adjacency_id in enumerate(adjacency_ids):
+            row, col = network_config.get_node_pos(node_id)
+            assert adjacency_id == network_config.get_adjacency_matrix_id(row, col)
+
+    def test_get_node_types(self):
+        num_rows = 3
+        num_cols = 3
+        network_config = NetworkConfig(num_rows, num_cols)
+        node_types = network_config.get_node_types()
+        assert node_types.tolist() == network_config.node_list
+        network_config.graph_layout[1][0] = NodeType.EMPTY.value
+        network_config._invalidate_cache()
+        assert network_config.get_node_types().tolist() == network_config.node_list
+
+    def test_invalidate_cache(self):
+        num_rows = 3
+        num_cols = 3
+        network_config = NetworkConfig(num_rows, num_cols)
+        assert network_config.start_pos == (2, 1)
+        assert len(network_config.node_list) == 5
+        network_config.graph_layout[2][1] = NodeType.EMPTY.value
+        network_config.graph_layout[2][0] = NodeType.START.value
+        network_config._invalidate_cache()
+        assert network_config.start_pos == (2, 0)
+        assert network_config.data_pos == (0, 1)
+        assert len(network_config.node_list) == 5
@@ -0,0 +1,85 @@
+"""
+Tests for opponent_pool.py
+"""
+
+import pytest
+import logging
+import numpy as np
+from gym_idsgame.agents.training_agents.common.opponent_pool import OpponentPool
+from gym_idsgame.agents.training_agents.common.opponent_pool_config import OpponentPoolConfig
+
+class TestOpponentPoolSuite():
+    pytest.logger = logging.getLogger("opponent_pool_tests")
+
+    @staticmethod
+    def softmax(qualities):
+        exp_qualities = np.exp(np.array(qualities, dtype=np.float64))
+        return exp_qualities / exp_qualities.sum()
+
+    def test_add(self):
+        pool = OpponentPool(OpponentPoolConfig(pool_maxsize=3, quality_scores=True, initial_quality=1))
+        pool.add("a")
+        assert list(pool.qualities) == [1]
+        pool.append("b", quality=5)
+        pool.append("c", quality=3)
+        # The pool is full, the oldest opponent is evicted and the new one gets the maximal quality score
+        pool.add("d")
+        assert list(pool.opponents) == ["b", "c", "d"]
+        assert list(pool.qualities) == [5, 3, 5]
+        pool.add("e")
+        assert list(pool.opponents) == ["c", "d", "e"]
+        assert list(pool.qualities) == [3, 5, 5]
+        assert len(pool) == 3
+        assert pool[0] == "c"
+
+    def test_add_without_quality_scores(self):
+        pool = OpponentPool(OpponentPoolConfig(pool_maxsize=2))
+        for opponent in ["a", "b", "c"]:
+            pool.add(opponent)
+        assert list(pool.opponents) == ["b", "c"]
+        assert len(pool.qualities) == 0
+
+    def test_sample(self):
+        pool = OpponentPool(OpponentPoolConfig(quality_scores=True))
+        qualities = [1.0, 0.5, 2.0, -1.0, 1.5]
+        for opponent_idx, quality in enumerate(qualities):
+            pool.append(opponent_idx, quality=quality)
+        softmax_dist = TestOpponentPoolSuite.softmax(qualities)
+        assert np.allclose(pool.softmax_distribution(), softmax_dist)
+        for seed in range(200):
+            np.random.seed(seed)
+            expected_idx = np.random.choice(len(qualities), p=softmax_dist)
+            np.random.seed(seed)
+            assert pool.sample() == expected_idx
+
+    def test_update_quality_score(self):
+        eta = 0.01
+        pool = OpponentPool(OpponentPoolConfig(quality_scores=True, quality_score_eta=eta))
+        qualities = [1.0, 2.0, 0.5]
+        for opponent_idx, quality in enumerate(qualities):
+            pool.append(opponent_idx, quality=quality)
+        # q_i <- q_i - eta / (N * p_i), with p_i the softmax probability of the opponent before the update
+        p = TestOpponentPoolSuite.softmax(qualities)
+        expected_quality = qualities[1] - eta / (len(qualities) * p[1])
+        assert pool.quality_score_delta(1) == pytest.approx(expected_quality - qualities[1])
+        pool.update_quality_score(1)
+        assert pool.qualities[1] == pytest.approx(expected_quality)
+        assert pool.qualities[0] == qualities[0] and pool.qualities[2] == qualities[2]
+        qualities[1] = expected_quality
+        assert np.allclose(pool.softmax_distribution(), TestOpponentPoolSuite.softmax(qualities))
+
+    def test_apply_quality_score_deltas(self):
+        pool = OpponentPool(OpponentPoolConfig(quality_scores=True))
+        for opponent_idx in range(3):
+            pool.append(opponent_idx)
+        softmax_dist = pool.softmax_distribution()
+        assert pool.softmax_distribution() is softmax_dist
+        # Without any update the cached distribution is kept
+        pool.apply_quality_score_deltas(np.zeros(3))
+        assert pool.softmax_distribution() is softmax_dist
+        deltas = np.array([0.0, -0.5, 0.25])
+        pool.apply_quality_score_deltas(deltas)
+        assert list(pool.qualities) == [1.0, 0.5, 1.25]
+        updated_softmax_dist = pool.softmax_distribution()
+        assert updated_softmax_dist is not softmax_dist
+        assert np.allclose(updated_softmax_dist, TestOpponentPoolSuite.softmax([1.0, 0.5, 1.25]))